@@ -0,0 +1,76 @@
+"""Benchmark the thread scaling of ``py3dep.fill_depressions``.
+
+Numba fixes the size of its thread pool when it's first imported, so each
+thread count runs in a fresh interpreter with ``NUMBA_NUM_THREADS`` set.
+The first call in each run compiles the kernels and is not timed.
+
+Usage::
+
+    python benchmarks/fill_depressions_threads.py --size 4000 --threads 1 2 4 8
+"""
+
+# ruff: noqa: T201
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+_WORKER = """
+import json, sys, time
+import numpy as np
+import py3dep
+
+size, repeat = int(sys.argv[1]), int(sys.argv[2])
+rng = np.random.default_rng(42)
+dem = rng.random((size, size), dtype="f4") * 100
+py3dep.fill_depressions(rng.random((64, 64), dtype="f4"))
+times = []
+for _ in range(repeat):
+    start = time.perf_counter()
+    py3dep.fill_depressions(dem)
+    times.append(time.perf_counter() - start)
+print(json.dumps(times))
+"""
+
+
+def _run(threads: int, size: int, repeat: int) -> list[float]:
+    """Time ``fill_depressions`` in a subprocess with ``threads`` numba threads."""
+    env = {**os.environ, "NUMBA_NUM_THREADS": str(threads)}
+    out = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", _WORKER, str(size), str(repeat)],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+def main() -> None:
+    """Run the benchmark and print the best time and speedup of each thread count."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=4000, help="Size of the square DEM.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs.")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="Numbers of numba threads to sweep.",
+    )
+    args = parser.parse_args()
+
+    print(f"fill_depressions on a {args.size}x{args.size} DEM, {os.cpu_count()} CPUs")
+    print(f"{'threads':>8} {'best (s)':>10} {'speedup':>8}")
+    base = None
+    for n in args.threads:
+        best = min(_run(n, args.size, args.repeat))
+        base = base or best
+        print(f"{n:>8} {best:>10.3f} {base / best:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
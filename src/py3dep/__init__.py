@@ -4,21 +4,26 @@ from __future__ import annotations
 
 from importlib.metadata import PackageNotFoundError, version
 
-from py3dep import exceptions
+from py3dep import aio, exceptions, index, terrain
+from py3dep.memo import disable_elevation_memo, enable_elevation_memo
 from py3dep.print_versions import show_versions
+from py3dep.products import disable_product_cache, enable_product_cache
 from py3dep.py3dep import (
     add_elevation,
     check_3dep_availability,
     elevation_bycoords,
     elevation_bygrid,
     elevation_profile,
+    elevation_profile_batch,
     get_dem,
     get_dem_vrt,
     get_map,
+    get_map_batch,
     query_3dep_sources,
     static_3dep_dem,
 )
-from py3dep.utils import deg2mpm, fill_depressions
+from py3dep.seamless import disable_block_cache, enable_block_cache, prewarm_block_cache
+from py3dep.utils import deg2mpm, fill_depressions, flow_routing
 
 try:
     __version__ = version("py3dep")
@@ -27,18 +32,31 @@ except PackageNotFoundError:
 
 __all__ = [
     "fill_depressions",
+    "flow_routing",
     "get_map",
+    "get_map_batch",
     "check_3dep_availability",
     "query_3dep_sources",
     "deg2mpm",
     "elevation_bycoords",
     "elevation_bygrid",
     "elevation_profile",
+    "elevation_profile_batch",
     "static_3dep_dem",
     "get_dem",
     "get_dem_vrt",
     "add_elevation",
+    "enable_block_cache",
+    "disable_block_cache",
+    "prewarm_block_cache",
+    "enable_elevation_memo",
+    "disable_elevation_memo",
+    "enable_product_cache",
+    "disable_product_cache",
     "show_versions",
+    "aio",
     "exceptions",
+    "index",
+    "terrain",
     "__version__",
 ]
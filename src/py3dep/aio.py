@@ -0,0 +1,599 @@
+"""Asynchronous access to the 3DEP web services.
+
+The functions of this module are coroutines that run on the caller's event
+loop, so many requests, e.g., elevations of hundreds of locations or maps of
+many geometries, can be multiplexed in a single process. They share an
+:class:`AsyncClient`, i.e., a single HTTP session, and the number of requests
+in flight across all of them is capped by the client's ``max_concurrency``.
+Unlike their synchronous counterparts, the responses are not cached on disk.
+"""
+
+# pyright: reportGeneralTypeIssues=false
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from typing import TYPE_CHECKING, Any, Literal, Union, cast, overload
+
+import aiohttp
+import numpy as np
+import pyproj
+
+import pygeoutils as geoutils
+from py3dep import tnm, wms
+from py3dep.exceptions import InputTypeError, TileDownloadError
+from py3dep.index import (
+    MAX_RECORDS,
+    RES_LAYERS,
+    availability_query,
+    concat_sources,
+    features_query,
+    oids_query,
+    parse_availability,
+    source_layers,
+)
+from py3dep.py3dep import ElevationByCoords, _check_wms_crs, _mask_tiled, _wms_layers
+from pygeoogc import ServiceURL
+from pygeoogc import utils as ogc_utils
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator
+
+    import geopandas as gpd
+    import xarray as xr
+    from numpy.typing import NDArray
+    from shapely import MultiPolygon, Polygon
+    from typing_extensions import Self
+
+    CRSTYPE = Union[int, str, pyproj.CRS]
+
+__all__ = [
+    "AsyncClient",
+    "check_3dep_availability",
+    "elevation_bycoords",
+    "get_capabilities",
+    "get_map",
+    "get_tiled",
+    "query_3dep_sources",
+]
+
+
+class AsyncClient:
+    """A shared HTTP session with a limit on the number of concurrent requests.
+
+    The client can be used as an async context manager and passed to all the
+    functions of :mod:`py3dep.aio` so they share the same connection pool.
+
+    Parameters
+    ----------
+    max_concurrency : int, optional
+        Maximum number of requests in flight, defaults to 10.
+    session : aiohttp.ClientSession, optional
+        An existing session to use, e.g., one that is shared with other libraries.
+        It is not closed by the client. Defaults to ``None``, i.e., a new session
+        is created on first use and closed by :meth:`close`.
+    timeout : float, optional
+        Total timeout of each request in seconds, defaults to 120.
+    ssl : bool, optional
+        Whether to verify SSL certificates, defaults to ``True``.
+
+    Examples
+    --------
+    >>> import asyncio
+    >>> from py3dep import aio
+    >>> async def main():
+    ...     async with aio.AsyncClient(max_concurrency=20) as client:
+    ...         return await aio.elevation_bycoords(
+    ...             [(-7766049.665, 5691929.739)], 3857, "tnm", client=client
+    ...         )
+    >>> asyncio.run(main())  # doctest: +SKIP
+    [363.0]
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 10,
+        session: aiohttp.ClientSession | None = None,
+        timeout: float = 120,
+        ssl: bool = True,
+    ) -> None:
+        if not isinstance(max_concurrency, int) or max_concurrency < 1:
+            raise InputTypeError("max_concurrency", "positive int")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.ssl = ssl
+        self._session = session
+        self._owner = session is None
+        # Created on first use, so it's bound to the event loop that runs the requests
+        self._semaphore: asyncio.Semaphore | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The underlying HTTP session."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._owner = True
+        return self._session
+
+    async def close(self) -> None:
+        """Close the session if it was created by the client."""
+        if self._owner and self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *_: object) -> None:
+        await self.close()
+
+    @overload
+    async def request(
+        self,
+        url: str,
+        *,
+        method: Literal["GET", "POST"] = ...,
+        params: dict[str, str] | None = ...,
+        data: dict[str, str] | None = ...,
+        read: Literal["json"] = ...,
+        ssl: bool | None = ...,
+    ) -> Any: ...
+
+    @overload
+    async def request(
+        self,
+        url: str,
+        *,
+        method: Literal["GET", "POST"] = ...,
+        params: dict[str, str] | None = ...,
+        data: dict[str, str] | None = ...,
+        read: Literal["text"],
+        ssl: bool | None = ...,
+    ) -> str: ...
+
+    @overload
+    async def request(
+        self,
+        url: str,
+        *,
+        method: Literal["GET", "POST"] = ...,
+        params: dict[str, str] | None = ...,
+        data: dict[str, str] | None = ...,
+        read: Literal["binary"],
+        ssl: bool | None = ...,
+    ) -> bytes: ...
+
+    async def request(
+        self,
+        url: str,
+        *,
+        method: Literal["GET", "POST"] = "GET",
+        params: dict[str, str] | None = None,
+        data: dict[str, str] | None = None,
+        read: Literal["json", "text", "binary"] = "json",
+        ssl: bool | None = None,
+    ) -> Any:
+        """Send a request once a slot is available and read its response.
+
+        Parameters
+        ----------
+        url : str
+            The URL.
+        method : str, optional
+            The HTTP method, ``GET`` (default) or ``POST``.
+        params : dict, optional
+            Query parameters of the request.
+        data : dict, optional
+            Form data of a ``POST`` request.
+        read : str, optional
+            How to read the response, ``json`` (default), ``text``, or ``binary``.
+        ssl : bool, optional
+            Whether to verify SSL certificates, defaults to the client's ``ssl``.
+
+        Returns
+        -------
+        dict, str, or bytes
+            The response.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        ssl = self.ssl if ssl is None else ssl
+        async with contextlib.AsyncExitStack() as stack:
+            await stack.enter_async_context(self._semaphore)
+            resp = await stack.enter_async_context(
+                self.session.request(method, url, params=params, data=data, ssl=ssl)
+            )
+            resp.raise_for_status()
+            if read == "binary":
+                return await resp.read()
+            if read == "text":
+                return await resp.text()
+            return await resp.json(content_type=None)
+
+
+@contextlib.asynccontextmanager
+async def _client(client: AsyncClient | None) -> AsyncIterator[AsyncClient]:
+    """Use the given client or a temporary one that is closed afterward."""
+    if client is not None:
+        yield client
+        return
+    async with AsyncClient() as new_client:
+        yield new_client
+
+
+async def get_capabilities(
+    url: str, refresh: bool = False, client: AsyncClient | None = None
+) -> wms.Capabilities:
+    """Get the valid CRSs and layers of a WMS service with caching.
+
+    This is the asynchronous version of :func:`py3dep.wms.get_capabilities`
+    and shares its in-memory and on-disk caches.
+
+    Parameters
+    ----------
+    url : str
+        The WMS service URL.
+    refresh : bool, optional
+        Request the capabilities even if they are cached, defaults to ``False``.
+    client : AsyncClient, optional
+        The client to use, defaults to a new one.
+
+    Returns
+    -------
+    Capabilities
+        Named tuple of the valid CRSs and layers (name to title mapping).
+    """
+    # Reading and writing the on-disk cache is blocking I/O, so it's done off the event loop
+    caps, stale = await asyncio.to_thread(wms.cached_capabilities, url, refresh)
+    if caps is not None:
+        return caps
+    try:
+        async with _client(client) as c:
+            text = await c.request(url, params=wms.CAPABILITIES_PARAMS, read="text", ssl=False)
+        caps = wms.parse_capabilities(url, text)
+    except Exception:
+        if stale is None:
+            raise
+        return stale
+    await asyncio.to_thread(wms.store_capabilities, url, caps)
+    return caps
+
+
+async def _fetch_tile(
+    client: AsyncClient, url: str, payload: dict[str, str], tile: wms.Tile, max_retries: int
+) -> tuple[NDArray[Any], float]:
+    """Download a tile and retry with exponential backoff if it fails."""
+    for attempt in range(max_retries + 1):
+        try:
+            content = await client.request(url, params=payload, read="binary")
+            # Decoding a large tile takes a while, so it's done off the event loop
+            return await asyncio.to_thread(wms.read_tile, content, tile.window)
+        except Exception:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(0.5 * 2**attempt)
+    raise RuntimeError("Unreachable")  # pragma: no cover
+
+
+async def get_tiled(
+    url: str,
+    layers: list[str],
+    bbox: tuple[float, float, float, float],
+    resolution: float,
+    crs: CRSTYPE,
+    *,
+    tile_size: int = wms.TILE_SIZE,
+    max_retries: int = wms.MAX_RETRIES,
+    client: AsyncClient | None = None,
+) -> xr.Dataset:
+    """Get WMS layers within a bbox by downloading a grid of tiles concurrently.
+
+    This is the asynchronous version of :func:`py3dep.wms.get_tiled` and the
+    number of concurrent tile downloads is limited by the client.
+
+    Parameters
+    ----------
+    url : str
+        The WMS service URL.
+    layers : list of str
+        The WMS layer names.
+    bbox : tuple
+        A bounding box (west, south, east, north) in ``crs``.
+    resolution : float
+        The target resolution in meters.
+    crs : str, int, or pyproj.CRS
+        The spatial reference of the bbox and the output.
+    tile_size : int, optional
+        Width and height of the tiles in pixels, defaults to 2048.
+    max_retries : int, optional
+        Maximum number of retries for each failed tile, defaults to 3.
+    client : AsyncClient, optional
+        The client to use, defaults to a new one.
+
+    Returns
+    -------
+    xarray.Dataset
+        The requested layers with the original layer names as variables.
+    """
+    crs_str, shape, transform, requests = wms.plan_tiles(layers, bbox, resolution, crs, tile_size)
+    mosaic = wms.Mosaic(shape, transform, crs_str, None)
+    async with _client(client) as c:
+        results = await asyncio.gather(
+            *(_fetch_tile(c, url, p, t, max_retries) for t, p in requests),
+            return_exceptions=True,
+        )
+    failed = []
+    for (tile, _), result in zip(requests, results):
+        if isinstance(result, BaseException):
+            failed.append((tile, result))
+            continue
+        mosaic.write(tile.layer, tile.window, *result)
+    if failed:
+        tiles, errors = zip(*failed)
+        raise TileDownloadError(url, [(t.layer, t.bbox) for t in tiles], list(errors)) from errors[
+            0
+        ]
+    return mosaic.to_dataset()
+
+
+async def get_map(
+    layers: str | list[str],
+    geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
+    resolution: int,
+    geo_crs: CRSTYPE = 4326,
+    crs: CRSTYPE = 4326,
+    *,
+    tile_size: int = wms.TILE_SIZE,
+    client: AsyncClient | None = None,
+) -> xr.Dataset | xr.DataArray:
+    """Access dynamic layer of 3DEP asynchronously.
+
+    This is the asynchronous version of :func:`py3dep.get_map`. The data
+    is always requested as a grid of tiles that are downloaded concurrently
+    and failed tiles are retried individually.
+
+    Parameters
+    ----------
+    layers : str or list of str
+        A valid 3DEP layer or a list of them.
+    geometry : Polygon, MultiPolygon, or tuple
+        A shapely Polygon or a bounding box of the form ``(west, south, east, north)``.
+    resolution : int
+        The target resolution in meters.
+    geo_crs : str, int, or pyproj.CRS, optional
+        The spatial reference system of the input geometry, defaults to ``EPSG:4326``.
+    crs : str, int, or pyproj.CRS, optional
+        The spatial reference system to be used for requesting the data, defaults to
+        ``EPSG:4326``.
+    tile_size : int, optional
+        Width and height of the tiles in pixels, defaults to 2048.
+    client : AsyncClient, optional
+        The client to use, defaults to a new one.
+
+    Returns
+    -------
+    xarray.DataArray or xarray.Dataset
+        The requested topographic data as an ``xarray.DataArray`` or ``xarray.Dataset``.
+
+    Raises
+    ------
+    TileDownloadError
+        If some tiles cannot be retrieved after retries.
+    """
+    wms_layers = _wms_layers(layers)
+    wms_url = ServiceURL().wms.nm_3dep
+    crs_str = ogc_utils.validate_crs(crs)
+    async with _client(client) as c:
+        caps = await get_capabilities(wms_url, client=c)
+        _check_wms_crs(caps, wms_url, crs_str)
+        _geometry = geoutils.geo2polygon(geometry, geo_crs, crs_str)
+        ds = await get_tiled(
+            wms_url,
+            wms_layers,
+            _geometry.bounds,
+            resolution,
+            crs_str,
+            tile_size=tile_size,
+            client=c,
+        )
+    return _mask_tiled(ds, _geometry, crs_str, wms_layers, list(caps.layers))
+
+
+@overload
+async def elevation_bycoords(
+    coords: tuple[float, float],
+    crs: CRSTYPE = ...,
+    source: Literal["tep", "tnm"] = ...,
+    *,
+    client: AsyncClient | None = ...,
+) -> float: ...
+
+
+@overload
+async def elevation_bycoords(
+    coords: list[tuple[float, float]],
+    crs: CRSTYPE = ...,
+    source: Literal["tep", "tnm"] = ...,
+    *,
+    client: AsyncClient | None = ...,
+) -> list[float]: ...
+
+
+async def _point_elevation(
+    client: AsyncClient, url: str, params: dict[str, str], max_retries: int
+) -> float | None:
+    """Get the elevation of a point from the Point Query Service, ``None`` if it keeps failing."""
+    for attempt in range(max_retries + 1):
+        try:
+            elev = tnm.parse_elevation(await client.request(url, params=params))
+        except tnm.REQUEST_ERRORS:
+            elev = None
+        if elev is not None:
+            return elev
+        if attempt < max_retries:
+            await asyncio.sleep(0.5 * 2**attempt)
+    return None
+
+
+async def elevation_bycoords(
+    coords: tuple[float, float] | list[tuple[float, float]],
+    crs: CRSTYPE = 4326,
+    source: Literal["tep", "tnm"] = "tep",
+    *,
+    max_retries: int = tnm.MAX_RETRIES,
+    fallback: bool = True,
+    client: AsyncClient | None = None,
+) -> float | list[float]:
+    """Get elevation for a list of coordinates asynchronously.
+
+    This is the asynchronous version of :func:`py3dep.elevation_bycoords`.
+    With the ``tnm`` source, each unique location is a request to the Point
+    Query Service that is retried with exponential backoff if it fails or its
+    response is invalid, as in :class:`py3dep.tnm.PointQuery`. With the ``tep``
+    source, and for the ``tnm`` fallback, the static DEM VRT is sampled by GDAL
+    in a worker thread, so the event loop is not blocked.
+
+    Parameters
+    ----------
+    coords : tuple or list of tuple
+        Coordinates of target location(s), e.g., ``[(x, y), ...]``.
+    crs : str, int, or pyproj.CRS or pyproj.CRS, optional
+        Spatial reference (CRS) of coords, defaults to ``EPSG:4326``.
+    source : str, optional
+        Data source to be used, default to ``tep``. Supported sources are
+        ``tnm`` and ``tep``.
+    max_retries : int, optional
+        Maximum number of retries for each point with the ``tnm`` source,
+        defaults to 3.
+    fallback : bool, optional
+        Get the elevations of the points that still fail after the retries
+        from the 10-m static DEM (``tep``), defaults to ``True``. Otherwise,
+        their elevations are ``NaN``.
+    client : AsyncClient, optional
+        The client to use with the ``tnm`` source, defaults to a new one.
+
+    Returns
+    -------
+    float or list of float
+        Elevation in meter.
+    """
+    _crs = crs.to_string() if isinstance(crs, pyproj.CRS) else crs
+    service = ElevationByCoords(crs=_crs, coords=coords, source=source)
+    if source == "tep":
+        values = await asyncio.to_thread(service.tep)
+    else:
+        url = ServiceURL().restful.nm_pqs
+        pts = service.coords_gs.to_crs(4326)
+        keys = [(f"{x:.6f}", f"{y:.6f}") for x, y in zip(pts.x, pts.y)]
+        unique = list(dict.fromkeys(keys))
+        async with _client(client) as c:
+            elevs = await asyncio.gather(
+                *(
+                    _point_elevation(c, url, {"units": "Meters", "x": x, "y": y}, max_retries)
+                    for x, y in unique
+                )
+            )
+        found = {k: e for k, e in zip(unique, elevs) if e is not None}
+        failed = [k for k in unique if k not in found]
+        if failed and fallback:
+            found.update(zip(failed, await asyncio.to_thread(tnm.sample_static_dem, failed)))
+        values = [float(found.get(k, np.nan)) for k in keys]
+    if len(service.coords) == 1:
+        return values[0]
+    return values
+
+
+async def check_3dep_availability(
+    bbox: tuple[float, float, float, float],
+    crs: CRSTYPE = 4326,
+    *,
+    client: AsyncClient | None = None,
+) -> dict[str, bool | str]:
+    """Query 3DEP's resolution availability within a bounding box asynchronously.
+
+    This is the asynchronous version of :func:`py3dep.check_3dep_availability`.
+
+    Parameters
+    ----------
+    bbox : tuple
+        Bounding box as tuple of ``(min_x, min_y, max_x, max_y)``.
+    crs : str, int, or pyproj.CRS or pyproj.CRS, optional
+        Spatial reference (CRS) of ``bbox``, defaults to ``EPSG:4326``.
+    client : AsyncClient, optional
+        The client to use, defaults to a new one.
+
+    Returns
+    -------
+    dict
+        Keys are the supported resolutions and values are their availability.
+        If the query fails due to any reason, the value will be ``Failed``.
+    """
+    payload = availability_query(bbox, crs)
+    base_url = ServiceURL().restful.nm_3dep_index
+    async with _client(client) as c:
+        resps = await asyncio.gather(
+            *(c.request(f"{base_url}/{lyr}/query", params=payload) for lyr in RES_LAYERS.values()),
+            return_exceptions=True,
+        )
+    return {
+        res: "Failed" if isinstance(r, BaseException) else parse_availability(r)
+        for res, r in zip(RES_LAYERS, resps)
+    }
+
+
+async def _layer_sources(
+    client: AsyncClient, url: str, params: dict[str, str]
+) -> gpd.GeoDataFrame | None:
+    """Get the features of a 3DEP index layer that intersect a geometry."""
+    resp = await client.request(url, params=params)
+    oids = sorted(resp.get("objectIds") or [])
+    if not oids:
+        return None
+    resps = await asyncio.gather(
+        *(
+            client.request(url, method="POST", data=features_query(oids[i : i + MAX_RECORDS]))
+            for i in range(0, len(oids), MAX_RECORDS)
+        )
+    )
+    return geoutils.json2geodf(cast("list[dict[str, Any]]", resps))
+
+
+async def query_3dep_sources(
+    bbox: tuple[float, float, float, float],
+    crs: CRSTYPE = 4326,
+    res: str | list[str] | None = None,
+    *,
+    client: AsyncClient | None = None,
+) -> gpd.GeoDataFrame:
+    """Query 3DEP's data sources within a bounding box asynchronously.
+
+    This is the asynchronous version of :func:`py3dep.query_3dep_sources`.
+    All the resolutions are queried concurrently.
+
+    Parameters
+    ----------
+    bbox : tuple
+        Bounding box as tuple of ``(min_x, min_y, max_x, max_y)``.
+    crs : str, int, or pyproj.CRS or pyproj.CRS, optional
+        Spatial reference (CRS) of bbox, defaults to ``EPSG:4326``.
+    res : str, list of str, optional
+        Resolution to query, defaults to ``None``, i.e., all resolutions.
+        Available resolutions are: ``1m``, ``3m``, ``5m``, ``10m``, ``30m``,
+        ``60m``, and ``topobathy``.
+    client : AsyncClient, optional
+        The client to use, defaults to a new one.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        Polygon(s) representing the 3DEP data sources at each resolution.
+        Resolutions are given in the ``dem_res`` column.
+    """
+    layers = source_layers(res)
+    payload = oids_query(bbox, crs)
+    base_url = ServiceURL().restful.nm_3dep_index
+    async with _client(client) as c:
+        sources = await asyncio.gather(
+            *(_layer_sources(c, f"{base_url}/{lyr}/query", payload) for lyr in layers.values())
+        )
+    return concat_sources(dict(zip(layers, sources)))
@@ -0,0 +1,131 @@
+"""Persistent caches for Py3DEP."""
+
+from __future__ import annotations
+
+import contextlib
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping, Sequence
+
+__all__ = ["SQLiteCache"]
+
+# Maximum number of host parameters in a single SQLite statement
+_MAX_VARIABLES = 900
+
+
+class SQLiteCache:
+    """A size-capped key-value store on disk with least-recently-used eviction.
+
+    The store is a SQLite database, so it can be shared between threads and
+    processes: SQLite's file locking serializes the writers and the database
+    is in WAL mode so readers do not block each other. When the total size of
+    the stored values exceeds ``max_size``, the least recently used entries
+    are removed.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the SQLite database. It is created if it does not exist.
+    max_size : int, optional
+        Maximum total size of the stored values in bytes, defaults to 1 GiB.
+    """
+
+    def __init__(self, path: str | Path, max_size: int = 2**30) -> None:
+        self.path = Path(path)
+        self.max_size = int(max_size)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                " ".join(
+                    (
+                        "CREATE TABLE IF NOT EXISTS cache",
+                        "(key TEXT PRIMARY KEY, value BLOB, nbytes INTEGER, accessed REAL)",
+                    )
+                )
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with contextlib.closing(sqlite3.connect(self.path, timeout=60)) as conn, conn:
+            yield conn
+
+    def get(self, key: str) -> bytes | None:
+        """Get the value of a key and mark it as recently used, ``None`` if missing."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def set(self, key: str, value: bytes) -> None:
+        """Store a value and evict the least recently used entries if needed."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Remove the least recently used entries that exceed the maximum size."""
+        conn.execute(
+            " ".join(
+                (
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM",
+                    "(SELECT key, SUM(nbytes) OVER (ORDER BY accessed DESC) AS total",
+                    "FROM cache) WHERE total > ?)",
+                )
+            ),
+            (self.max_size,),
+        )
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, bytes]:
+        """Get the values of many keys and mark them as recently used, missing keys are skipped."""
+        found = {}
+        now = time.time()
+        with self._connect() as conn:
+            for i in range(0, len(keys), _MAX_VARIABLES):
+                batch = keys[i : i + _MAX_VARIABLES]
+                # Only the number of placeholders is formatted into the statements
+                marks = ",".join("?" * len(batch))
+                select = f"SELECT key, value FROM cache WHERE key IN ({marks})"  # noqa: S608
+                update = f"UPDATE cache SET accessed = ? WHERE key IN ({marks})"  # noqa: S608
+                found.update(conn.execute(select, batch).fetchall())
+                conn.execute(update, (now, *batch))
+        return found
+
+    def set_many(self, items: Mapping[str, bytes]) -> None:
+        """Store many values at once and evict the least recently used entries if needed."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                ((k, v, len(v), now) for k, v in items.items()),
+            )
+            self._evict(conn)
+
+    def __contains__(self, key: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT 1 FROM cache WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    @property
+    def size(self) -> int:
+        """Total size of the stored values in bytes."""
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM cache").fetchone()[0]
+
+    def clear(self) -> None:
+        """Remove all the entries."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from typing import TYPE_CHECKING, Literal, TypeVar, cast
 
@@ -9,11 +11,28 @@ import click
 import geopandas as gpd
 import pandas as pd
 
-from py3dep import py3dep
-from py3dep.exceptions import InputTypeError, MissingColumnError, MissingCRSError
+from py3dep import py3dep, utils
+from py3dep.exceptions import (
+    DependencyError,
+    InputTypeError,
+    MissingColumnError,
+    MissingCRSError,
+)
 from py3dep.py3dep import LAYERS
 
+try:
+    import pyarrow.parquet as pq
+
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
+
 if TYPE_CHECKING:
+    from collections.abc import Hashable, Iterator
+
+    import pyarrow as pa
+    from shapely import MultiPolygon, Polygon
+
     DFType = TypeVar("DFType", pd.DataFrame, gpd.GeoDataFrame)
 
 
@@ -49,6 +68,104 @@ def cli() -> None:
     """Command-line interface for Py3DEP."""
 
 
+def _read_chunks(fpath: Path, chunksize: int | None, skip: int) -> Iterator[pd.DataFrame]:
+    """Read the ``lon`` and ``lat`` columns of a CSV or Parquet file in chunks.
+
+    The first ``skip`` rows are not returned and the index of the chunks is
+    the row number in the file.
+    """
+    if fpath.suffix == ".parquet":
+        if not has_pyarrow:
+            raise DependencyError("pyarrow", "Reading Parquet files")
+        pf = pq.ParquetFile(fpath)
+        missing = [c for c in ("lon", "lat") if c not in pf.schema_arrow.names]
+        if missing:
+            raise MissingColumnError(missing)
+        batch_size = chunksize or max(pf.metadata.num_rows, 1)
+        batches = pf.iter_batches(batch_size=batch_size, columns=["lon", "lat"])
+        chunks = (b.to_pandas() for b in _skip_rows(batches, skip))
+    else:
+        # A callable, unlike a range, is not turned into a set of all the skipped rows
+        def skiprows(i: int) -> bool:
+            return 0 < i <= skip
+
+        if chunksize is None:
+            chunks = iter([pd.read_csv(fpath, skiprows=skiprows)])
+        else:
+            chunks = pd.read_csv(fpath, chunksize=chunksize, skiprows=skiprows)
+
+    start = skip
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        elev = get_target_df(chunk, ["lon", "lat"])
+        elev.index = pd.RangeIndex(start, start + len(elev))
+        start += len(elev)
+        yield elev
+
+
+def _skip_rows(batches: Iterator[pa.RecordBatch], skip: int) -> Iterator[pa.RecordBatch]:
+    """Skip the first ``skip`` rows of an iterator of Arrow record batches."""
+    for batch in batches:
+        if skip >= batch.num_rows:
+            skip -= batch.num_rows
+            continue
+        yield batch.slice(skip)
+        skip = 0
+
+
+class _ChunkWriter:
+    """Append chunks of a dataframe to a CSV file or a Parquet dataset and track the progress.
+
+    The progress is stored next to the output, so an interrupted run can be resumed
+    from the last chunk that was completely written. A Parquet dataset is a directory
+    with one file per chunk.
+    """
+
+    def __init__(self, fpath: Path, resume: bool) -> None:
+        self.fpath = fpath
+        self.progress_file = fpath.with_name(f"{fpath.name}.progress.json")
+        self.is_parquet = fpath.suffix == ".parquet"
+        if self.is_parquet and not has_pyarrow:
+            raise DependencyError("pyarrow", "Writing Parquet files")
+        self.state = {"chunks": 0, "rows": 0, "size": 0, "complete": False}
+        if resume and self.progress_file.exists():
+            self.state.update(json.loads(self.progress_file.read_text()))
+        if self.is_parquet:
+            self.fpath.mkdir(parents=True, exist_ok=True)
+            for part in self.fpath.glob("part-*.parquet"):
+                if int(part.stem.split("-")[1]) >= self.state["chunks"]:
+                    part.unlink()
+        elif self.fpath.exists():
+            with self.fpath.open("r+b") as f:
+                f.truncate(self.state["size"])
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        """Append a chunk and record the progress."""
+        n_chunks = self.state["chunks"]
+        if self.is_parquet:
+            part = Path(self.fpath, f"part-{n_chunks:06d}.parquet")
+            chunk.to_parquet(part.with_suffix(".tmp"))
+            part.with_suffix(".tmp").replace(part)
+        else:
+            with self.fpath.open("a", newline="") as f:
+                chunk.to_csv(f, header=n_chunks == 0)
+                self.state["size"] = f.tell()
+        self.state["chunks"] = n_chunks + 1
+        self.state["rows"] += len(chunk)
+        self._save()
+
+    def finish(self) -> None:
+        """Mark the output as complete."""
+        self.state["complete"] = True
+        self._save()
+
+    def _save(self) -> None:
+        tmp = self.progress_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state))
+        tmp.replace(self.progress_file)
+
+
 @cli.command("coords", context_settings=CONTEXT_SETTINGS)
 @click.argument("fpath", type=click.Path(exists=True))
 @click.option(
@@ -59,15 +176,44 @@ def cli() -> None:
     help="Source of the elevation data: The National Map (tnm) or 3DEP (tep).",
 )
 @save_arg
+@click.option(
+    "-c",
+    "--chunksize",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of points to read, sample, and save at a time. Defaults to all.",
+)
+@click.option(
+    "-f",
+    "--out_format",
+    default="csv",
+    type=click.Choice(["csv", "parquet"], case_sensitive=False),
+    help="Format of the output file, defaults to csv.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted run from its last saved chunk.",
+)
 def coords(
     fpath: Path,
+    *,
     query_source: Literal["tep", "tnm"] = "tep",
     save_dir: str | Path = "topo_3dep",
+    chunksize: int | None = None,
+    out_format: Literal["csv", "parquet"] = "csv",
+    resume: bool = False,
 ) -> None:
     """Retrieve topographic data for a list of coordinates.
 
     \b
-    FPATH: Path to a csv file with two columns named ``lon`` and ``lat``.
+    FPATH: Path to a csv or parquet file with two columns named ``lon`` and ``lat``.
+
+    \b
+    With ``--chunksize``, the points are read, sampled, and appended to the
+    output in chunks, so the memory usage does not depend on the number of points.
+    Rerunning an interrupted run with ``--resume`` continues from its last saved chunk.
+    For ``parquet`` outputs, each chunk is saved as a separate file in a directory.
 
     \b
     Examples:
@@ -75,22 +221,61 @@ def coords(
         lon,lat
         -122.2493328,37.8122894
         $ py3dep coords coords.csv -q tep -s topo_dir
+        $ py3dep coords coords.parquet -c 1000000 -f parquet --resume
     """  # noqa: D301
     fpath = Path(fpath)
-    elev = get_target_df(pd.read_csv(fpath), ["lon", "lat"])
+    if fpath.suffix not in (".csv", ".parquet"):
+        raise InputTypeError("file", ".csv or .parquet")
 
-    count = "1 point" if len(elev) == 1 else f"{len(elev)} points"
-    click.echo(f"Found coordinates of {count} in {fpath.resolve()}. Retrieving ... ")
+    Path(save_dir).mkdir(parents=True, exist_ok=True)
+    writer = _ChunkWriter(Path(save_dir, f"{fpath.stem}_elevation.{out_format}"), resume)
+    if writer.state["complete"]:
+        click.echo(f"All the points in {fpath.resolve()} have already been retrieved.")
+        return
+    if writer.state["chunks"] > 0:
+        click.echo(f"Resuming after {writer.state['rows']} points.")
 
-    coords_list = list(elev.itertuples(index=False, name=None))
-    coords_list = cast("list[tuple[float, float]]", coords_list)
-    elev["elevation"] = py3dep.elevation_bycoords(coords_list, 4326, query_source)
+    click.echo(f"Retrieving elevations of the points in {fpath.resolve()} ... ")
+    for elev in _read_chunks(fpath, chunksize, writer.state["rows"]):
+        coords_list = list(elev.itertuples(index=False, name=None))
+        coords_list = cast("list[tuple[float, float]]", coords_list)
+        elev["elevation"] = py3dep.elevation_bycoords(coords_list, 4326, query_source)
+        writer.write(elev.astype("f4"))
+    writer.finish()
 
-    Path(save_dir).mkdir(parents=True, exist_ok=True)
-    elev.astype("f4").to_csv(Path(save_dir, f"{fpath.stem}_elevation.csv"))
+    rows = writer.state["rows"]
+    count = "1 point" if rows == 1 else f"{rows} points"
+    click.echo(f"Found coordinates of {count} in {fpath.resolve()}.")
     click.echo("Done.")
 
 
+def _save_map(
+    layers: str | list[str], geometry: Polygon | MultiPolygon, res: float, crs: str, fpath: Path
+) -> Path:
+    """Get the layers within a geometry and save them to a netCDF file."""
+    return utils.save_netcdf(py3dep.get_map(layers, geometry, res, geo_crs=crs, crs=4326), fpath)
+
+
+def _process_maps(
+    layers: str | list[str],
+    target_df: gpd.GeoDataFrame,
+    crs: str,
+    save_dir: Path,
+    workers: int,
+) -> Iterator[tuple[Hashable, Path | Exception]]:
+    """Get the layers within the geometries in separate processes."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_save_map, layers, g, r, crs, Path(save_dir, f"{i}.nc")): i
+            for i, r, g in target_df.itertuples()
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as ex:
+                yield futures[future], ex
+
+
 @cli.command("geometry", context_settings=CONTEXT_SETTINGS)
 @click.argument("fpath", type=click.Path(exists=True))
 @click.option(
@@ -102,10 +287,33 @@ def coords(
     help="Target topographic data layers",
 )
 @save_arg
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of geometries to process concurrently, defaults to 1.",
+)
+@click.option(
+    "-e",
+    "--executor",
+    default="thread",
+    type=click.Choice(["thread", "process"], case_sensitive=False),
+    help="Run the concurrent workers as threads (default) or processes.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip the geometries whose netcdf file already exists and is valid.",
+)
 def geometry(
     fpath: Path,
+    *,
     layers: str | list[str] = "DEM",
     save_dir: str | Path = "topo_3dep",
+    workers: int = 1,
+    executor: Literal["thread", "process"] = "thread",
+    resume: bool = False,
 ) -> None:
     """Retrieve topographic data within geometries.
 
@@ -116,9 +324,15 @@ def geometry(
         - ``res``: Target resolution in meters.
         - ``geometry``: A Polygon or MultiPloygon.
 
+    \b
+    The geometries that fail are reported at the end and the command exits with
+    a non-zero status. Rerunning it with ``--resume`` only retries those that are
+    missing or invalid.
+
     \b
     Examples:
         $ py3dep geometry ny_geom.gpkg -l "Slope Map" -l DEM -s topo_dir
+        $ py3dep geometry ny_geom.gpkg -s topo_dir -w 8 --resume
     """  # noqa: D301
     fpath = Path(fpath)
     if fpath.suffix not in (".shp", ".gpkg"):
@@ -129,16 +343,44 @@ def geometry(
         raise MissingCRSError
     crs = target_df.crs.to_string()
 
-    target_df = get_target_df(target_df, ["id", "res", "geometry"])
-    args_list = ((g, r, Path(save_dir, f"{i}.nc")) for i, r, g in target_df.itertuples(index=False))
+    target_df = get_target_df(target_df, ["id", "res", "geometry"]).set_index("id")
 
     count = "1 geometry" if len(target_df) == 1 else f"{len(target_df)} geometries"
     click.echo(f"Found {count} in {fpath.resolve()}.")
 
-    Path(save_dir).mkdir(parents=True, exist_ok=True)
+    save_dir = Path(save_dir)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    if resume:
+        done = [i for i in target_df.index if utils.is_valid_netcdf(Path(save_dir, f"{i}.nc"))]
+        if done:
+            click.echo(f"Skipping {len(done)} of them with existing outputs.")
+            target_df = target_df.drop(done)
+
+    if executor == "process" and workers > 1:
+        results = _process_maps(layers, target_df, crs, save_dir, workers)
+    else:
+        results = py3dep.get_map_batch(
+            layers,
+            target_df.geometry,
+            target_df["res"].tolist(),
+            geo_crs=crs,
+            max_workers=workers,
+            save_dir=save_dir,
+            return_exceptions=True,
+        )
+
+    failed = {}
     with click.progressbar(
-        args_list, label="Getting topographic data from 3DEP", length=len(target_df)
+        length=len(target_df), label="Getting topographic data from 3DEP"
     ) as bar:
-        for geo, res, f in bar:
-            py3dep.get_map(layers, geo, res, geo_crs=crs, crs=4326).to_netcdf(f)
+        for fid, result in results:
+            if isinstance(result, Exception):
+                failed[fid] = f"{type(result).__name__}: {result}"
+            bar.update(1)
+
+    if failed:
+        click.echo(f"Failed to get {len(failed)} of {len(target_df)} geometries:")
+        for fid, err in failed.items():
+            click.echo(f"  {fid}: {err}")
+        raise SystemExit(1)
     click.echo("Done.")
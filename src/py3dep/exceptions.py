@@ -104,3 +104,83 @@ class InputRangeError(Exception):
     def __str__(self) -> str:
         """Return the error message."""
         return self.message
+
+
+class DependencyError(ImportError):
+    """Exception raised when an optional dependency is required but not installed.
+
+    Parameters
+    ----------
+    libraries : str or list of str
+        Name(s) of the missing libraries.
+    feature : str
+        The feature that requires the libraries.
+    """
+
+    def __init__(self, libraries: str | list[str], feature: str) -> None:
+        libraries = [libraries] if isinstance(libraries, str) else libraries
+        self.message = "\n".join(
+            (
+                f"{feature} requires {', '.join(libraries)}. You can install it using",
+                f"pip install {' '.join(libraries)}, or",
+                f"conda install -c conda-forge {' '.join(libraries)}",
+            )
+        )
+        super().__init__(self.message)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return self.message
+
+
+class InvalidTileError(ValueError):
+    """Exception raised when the response for a tile is not a valid GeoTiff of the tile.
+
+    Parameters
+    ----------
+    expected : tuple of int
+        The expected shape of the tile.
+    shape : tuple of int, optional
+        The shape of the tile in the response, defaults to ``None``, i.e.,
+        the response is empty.
+    """
+
+    def __init__(self, expected: tuple[int, int], shape: tuple[int, ...] | None = None) -> None:
+        reason = "the response is empty" if shape is None else f"its shape is {shape}"
+        self.message = f"Invalid tile of shape {expected}: {reason}"
+        super().__init__(self.message)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return self.message
+
+
+class TileDownloadError(Exception):
+    """Exception raised when some tiles of a tiled request cannot be downloaded.
+
+    Parameters
+    ----------
+    url : str
+        The server url
+    tiles : list of tuple
+        Layer name and bounding box of the failed tiles.
+    errors : list of Exception, optional
+        The last error of each failed tile, defaults to ``None``.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        tiles: list[tuple[str, tuple[float, float, float, float]]],
+        errors: list[BaseException] | None = None,
+    ) -> None:
+        self.tiles = tiles
+        self.errors = errors or []
+        reasons = [f": {type(e).__name__}: {e}" for e in self.errors] or [""] * len(tiles)
+        failed = "\n".join(f"{lyr}: {bbox}{r}" for (lyr, bbox), r in zip(tiles, reasons))
+        self.message = f"Failed to download {len(tiles)} tiles from {url} after retries:\n{failed}"
+        super().__init__(self.message)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return self.message
@@ -0,0 +1,381 @@
+"""Concurrent queries of the 3DEP index layers of all the resolutions."""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Any, Literal, Union, cast
+
+import geopandas as gpd
+import pandas as pd
+
+import async_retriever as ar
+import pygeoutils as geoutils
+from py3dep.exceptions import InputTypeError, InputValueError
+from pygeoogc import ServiceURL
+from pygeoogc import utils as ogc_utils
+from pygeoogc.exceptions import ServiceError
+
+if TYPE_CHECKING:
+    import pyproj
+
+    CRSTYPE = Union[int, str, pyproj.CRS]
+    BBOX = tuple[float, float, float, float]
+
+__all__ = [
+    "MAX_RECORDS",
+    "RES_LAYERS",
+    "IndexClient",
+    "availability_query",
+    "concat_sources",
+    "features_query",
+    "oids_query",
+    "parse_availability",
+    "source_layers",
+]
+
+RES_LAYERS = {
+    "1m": 18,
+    "3m": 19,
+    "5m": 20,
+    "10m": 21,
+    "30m": 22,
+    "60m": 23,
+    "topobathy": 30,
+}
+"""The layer IDs of the 3DEP index service for each resolution."""
+MAX_RECORDS = 1000
+
+
+def _check_bbox(bbox: Any) -> None:
+    """Check that a bounding box is a sequence of length 4."""
+    if not isinstance(bbox, Sequence) or len(bbox) != 4:
+        raise InputTypeError("bbox", "a tuple of length 4")
+
+
+def availability_query(bbox: BBOX, crs: CRSTYPE) -> dict[str, str]:
+    """Get the query parameters for counting the 3DEP index features within a bbox.
+
+    Parameters
+    ----------
+    bbox : tuple
+        Bounding box as tuple of ``(min_x, min_y, max_x, max_y)``.
+    crs : str, int, or pyproj.CRS
+        Spatial reference (CRS) of ``bbox``.
+
+    Returns
+    -------
+    dict
+        The query parameters.
+    """
+    _check_bbox(bbox)
+    return {
+        **ogc_utils.esri_query(bbox, crs, 4326),
+        "spatialRel": "esriSpatialRelIntersects",
+        "returnGeometry": "false",
+        "returnIdsOnly": "false",
+        "returnCountOnly": "true",
+        "f": "json",
+    }
+
+
+def oids_query(bbox: BBOX, crs: CRSTYPE) -> dict[str, str]:
+    """Get the query parameters for the object IDs of the 3DEP index features within a bbox.
+
+    Parameters
+    ----------
+    bbox : tuple
+        Bounding box as tuple of ``(min_x, min_y, max_x, max_y)``.
+    crs : str, int, or pyproj.CRS
+        Spatial reference (CRS) of ``bbox``.
+
+    Returns
+    -------
+    dict
+        The query parameters.
+    """
+    _check_bbox(bbox)
+    return {
+        **ogc_utils.esri_query(bbox, crs, 4326),
+        "spatialRel": "esriSpatialRelIntersects",
+        "returnIdsOnly": "true",
+        "f": "json",
+    }
+
+
+def features_query(oids: Sequence[int]) -> dict[str, str]:
+    """Get the form data for a page of the 3DEP index features by their object IDs.
+
+    Parameters
+    ----------
+    oids : list of int
+        Object IDs of the features.
+
+    Returns
+    -------
+    dict
+        The form data of the ``POST`` request.
+    """
+    return {
+        "objectIds": ",".join(str(i) for i in oids),
+        "returnGeometry": "true",
+        "outSR": "4326",
+        "outfields": "*",
+        "f": "json",
+    }
+
+
+def parse_availability(resp: dict[str, Any] | None) -> bool | str:
+    """Get the availability from a count query response, ``Failed`` if it has failed.
+
+    Parameters
+    ----------
+    resp : dict
+        The response of a query with the parameters of :func:`availability_query`,
+        ``None`` if the request has failed.
+
+    Returns
+    -------
+    bool or str
+        Whether there are any features, or ``Failed``.
+    """
+    if resp is None or "error" in resp:
+        return "Failed"
+    return bool(resp.get("count"))
+
+
+def source_layers(res: str | list[str] | None) -> dict[str, int]:
+    """Validate the resolutions and get their 3DEP index layer IDs.
+
+    Parameters
+    ----------
+    res : str or list of str, optional
+        Resolutions, ``None`` for all the resolutions in :data:`RES_LAYERS`.
+
+    Returns
+    -------
+    dict
+        The layer IDs of the resolutions.
+    """
+    if res is None:
+        return RES_LAYERS.copy()
+    if isinstance(res, str) and res in RES_LAYERS:
+        return {res: RES_LAYERS[res]}
+    if isinstance(res, (list, tuple)) and all(r in RES_LAYERS for r in res):
+        return {r: RES_LAYERS[r] for r in res}
+    raise InputValueError("res", list(RES_LAYERS))
+
+
+def concat_sources(sources: dict[str, gpd.GeoDataFrame | None]) -> gpd.GeoDataFrame:
+    """Concatenate the 3DEP sources of each resolution with a ``dem_res`` column.
+
+    Parameters
+    ----------
+    sources : dict
+        The features of each resolution, ``None`` for the resolutions without any.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        The features of all the resolutions in ``EPSG:4326``. It's empty, with
+        only the ``dem_res`` and ``geometry`` columns, if there are no features.
+    """
+    if all(gdf is None or gdf.empty for gdf in sources.values()):
+        return gpd.GeoDataFrame({"dem_res": pd.Series(dtype=str)}, geometry=[], crs=4326)
+    return (  # pyright: ignore[reportReturnType]
+        gpd.GeoDataFrame(  # pyright: ignore[reportCallIssue]
+            pd.concat(sources).reset_index(  # pyright: ignore[reportCallIssue,reportArgumentType]
+                level=1, drop=True
+            ),
+            crs=4326,
+        )
+        .reset_index()
+        .rename(columns={"index": "dem_res"})
+    )
+
+
+def _select(features: gpd.GeoDataFrame, oids: list[int]) -> gpd.GeoDataFrame:
+    """Select the features by their object IDs, sorted by the IDs."""
+    return features[features.index.isin(oids)].sort_index().reset_index(drop=True)
+
+
+class IndexClient:
+    """Query the 3DEP index layers of many resolutions and bounding boxes at once.
+
+    Each stage of a query, i.e., counting the features, getting their object IDs,
+    and getting the features page by page, is a single batch of concurrent
+    requests for all the resolutions and bounding boxes that share one session.
+    The features that intersect more than one bounding box are requested once.
+    The responses are cached on disk by ``async_retriever``.
+
+    Parameters
+    ----------
+    res : str, list of str, optional
+        Resolutions to query, defaults to ``None``, i.e., all resolutions.
+        Available resolutions are: ``1m``, ``3m``, ``5m``, ``10m``, ``30m``,
+        ``60m``, and ``topobathy``.
+    max_workers : int, optional
+        Maximum number of concurrent requests, defaults to 8.
+    max_records : int, optional
+        Maximum number of features per request, defaults to 1000.
+
+    Examples
+    --------
+    >>> from py3dep.index import IndexClient
+    >>> client = IndexClient(["1m", "10m"])
+    >>> bboxes = [(-69.77, 45.07, -69.31, 45.45), (-69.31, 45.07, -68.85, 45.45)]
+    >>> avail = client.availability(bboxes)
+    >>> sources = client.sources(bboxes)
+    """
+
+    def __init__(
+        self,
+        res: str | list[str] | None = None,
+        max_workers: int = 8,
+        max_records: int = MAX_RECORDS,
+    ) -> None:
+        self.layers = source_layers(res)
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise InputTypeError("max_workers", "positive int")
+        if not isinstance(max_records, int) or max_records < 1:
+            raise InputTypeError("max_records", "positive int")
+        self.max_workers = max_workers
+        self.max_records = max_records
+        self.base_url = ServiceURL().restful.nm_3dep_index
+
+    def _url(self, res: str) -> str:
+        """Get the query URL of the index layer of a resolution."""
+        return f"{self.base_url}/{self.layers[res]}/query"
+
+    def _retrieve(
+        self,
+        urls: list[str],
+        kwds: list[dict[str, Any]],
+        method: Literal["GET", "POST"] = "GET",
+        raise_status: bool = True,
+    ) -> list[dict[str, Any] | None]:
+        """Send a batch of requests concurrently with a single session."""
+        if not urls:
+            return []
+        resps = ar.retrieve_json(
+            urls,
+            kwds,
+            request_method=method,
+            max_workers=min(self.max_workers, len(urls)),
+            raise_status=raise_status,
+        )
+        return cast("list[dict[str, Any] | None]", resps)
+
+    def availability(
+        self, bboxes: Sequence[BBOX], crs: CRSTYPE = 4326
+    ) -> list[dict[str, bool | str]]:
+        """Check whether the bounding boxes intersect the 3DEP data of each resolution.
+
+        Parameters
+        ----------
+        bboxes : list of tuple
+            Bounding boxes as tuples of ``(min_x, min_y, max_x, max_y)``.
+        crs : str, int, or pyproj.CRS, optional
+            Spatial reference (CRS) of ``bboxes``, defaults to ``EPSG:4326``.
+
+        Returns
+        -------
+        list of dict
+            The availability of each resolution for each bounding box. If the
+            query of a resolution fails, its value is ``Failed`` and its cached
+            response is removed, so it can be tried again later.
+        """
+        payloads = [availability_query(bbox, crs) for bbox in bboxes]
+        pairs = [(self._url(res), p) for p in payloads for res in self.layers]
+        resps = self._retrieve(
+            [u for u, _ in pairs], [{"params": p} for _, p in pairs], raise_status=False
+        )
+        avail = [parse_availability(r) for r in resps]
+        for (url, payload), a in zip(pairs, avail):
+            if a == "Failed":
+                ar.delete_url_cache(url, params=payload)
+        n = len(self.layers)
+        return [dict(zip(self.layers, avail[i : i + n])) for i in range(0, len(avail), n)]
+
+    def object_ids(self, bboxes: Sequence[BBOX], crs: CRSTYPE = 4326) -> list[dict[str, list[int]]]:
+        """Get the sorted object IDs of the index features of each resolution in each bbox.
+
+        Parameters
+        ----------
+        bboxes : list of tuple
+            Bounding boxes as tuples of ``(min_x, min_y, max_x, max_y)``.
+        crs : str, int, or pyproj.CRS, optional
+            Spatial reference (CRS) of ``bboxes``, defaults to ``EPSG:4326``.
+
+        Returns
+        -------
+        list of dict
+            The object IDs of each resolution for each bounding box.
+        """
+        payloads = [oids_query(bbox, crs) for bbox in bboxes]
+        resps = self._retrieve(
+            [self._url(res) for _ in payloads for res in self.layers],
+            [{"params": p} for p in payloads for _ in self.layers],
+        )
+        oids = []
+        for resp in resps:
+            if resp is None or "error" in resp:
+                raise ServiceError(str((resp or {}).get("error", "Failed to get the object IDs")))
+            oids.append(sorted(resp.get("objectIds") or []))
+        n = len(self.layers)
+        return [dict(zip(self.layers, oids[i : i + n])) for i in range(0, len(oids), n)]
+
+    def _features(self, oids: dict[str, list[int]]) -> dict[str, gpd.GeoDataFrame]:
+        """Get the features of each resolution by their object IDs, page by page concurrently.
+
+        The features are indexed by their object IDs.
+        """
+        pages = [
+            (res, ids[i : i + self.max_records])
+            for res, ids in oids.items()
+            for i in range(0, len(ids), self.max_records)
+        ]
+        resps = self._retrieve(
+            [self._url(res) for res, _ in pages],
+            [{"data": features_query(ids)} for _, ids in pages],
+            method="POST",
+        )
+        by_res: dict[str, list[dict[str, Any]]] = {}
+        for (res, _), resp in zip(pages, resps):
+            if resp is None or "error" in resp:
+                raise ServiceError(str((resp or {}).get("error", "Failed to get the features")))
+            by_res.setdefault(res, []).append(resp)
+        features = {}
+        for res, r in by_res.items():
+            gdf = cast("gpd.GeoDataFrame", geoutils.json2geodf(r))
+            field = r[0].get("objectIdFieldName", "OBJECTID")
+            features[res] = gdf.set_index(gdf[field].to_numpy())
+        return features
+
+    def sources(self, bboxes: Sequence[BBOX], crs: CRSTYPE = 4326) -> list[gpd.GeoDataFrame]:
+        """Get the 3DEP data sources of each resolution within the bounding boxes.
+
+        Parameters
+        ----------
+        bboxes : list of tuple
+            Bounding boxes as tuples of ``(min_x, min_y, max_x, max_y)``.
+        crs : str, int, or pyproj.CRS, optional
+            Spatial reference (CRS) of ``bboxes``, defaults to ``EPSG:4326``.
+
+        Returns
+        -------
+        list of geopandas.GeoDataFrame
+            Polygon(s) representing the 3DEP data sources within each bounding box.
+            Resolutions are given in the ``dem_res`` column.
+        """
+        oids = self.object_ids(bboxes, crs)
+        unique = {res: sorted(set().union(*(o[res] for o in oids))) for res in self.layers}
+        features = self._features(unique)
+        return [
+            concat_sources(
+                {
+                    res: _select(features[res], ids) if ids else None
+                    for res, ids in bbox_oids.items()
+                }
+            )
+            for bbox_oids in oids
+        ]
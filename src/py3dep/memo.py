@@ -0,0 +1,273 @@
+"""Memoization of the elevations of points and grids."""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, NamedTuple
+
+import numpy as np
+
+from py3dep.cache import SQLiteCache
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from pathlib import Path
+
+    import xarray as xr
+    from numpy.typing import NDArray
+
+__all__ = [
+    "GRID_MEMO_SIZE",
+    "ElevationMemo",
+    "MemoStats",
+    "clear_grid_memo",
+    "disable_elevation_memo",
+    "enable_elevation_memo",
+    "get_elevation_memo",
+    "get_grid",
+    "grid_signature",
+    "set_grid",
+]
+
+GRID_MEMO_SIZE = 16
+_MEMO: dict[str, ElevationMemo] = {}
+_GRIDS: OrderedDict[tuple[Any, ...], NDArray[np.floating]] = OrderedDict()
+_GRIDS_LOCK = threading.Lock()
+
+
+class MemoStats(NamedTuple):
+    """Counters of the points that are looked up in an elevation memo.
+
+    ``hits`` and ``disk_hits`` are the unique points of each call that are found
+    in memory and on disk, ``misses`` are the ones that are sampled, and
+    ``duplicates`` are the repeated points within calls.
+    """
+
+    hits: int
+    disk_hits: int
+    misses: int
+    duplicates: int
+    size: int
+
+
+class ElevationMemo:
+    """A bounded in-memory LRU of point elevations with an optional on-disk store.
+
+    The points are keyed on their coordinates, quantized to ``decimals``
+    decimal places, along with their CRS and the elevation source. So, repeated
+    points are answered without reading the DEM or requesting the service.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of points that are kept in memory, defaults to 100,000.
+    path : str or pathlib.Path, optional
+        Path to a SQLite database for storing the elevations on disk as well,
+        defaults to ``None``, i.e., in-memory only. The database is a
+        :class:`~py3dep.cache.SQLiteCache`, so it can be shared by multiple
+        processes.
+    max_size : int, optional
+        Maximum size of the on-disk store in bytes, defaults to 256 MiB.
+    decimals : int, optional
+        Number of decimal places of the coordinates that are kept in the keys,
+        defaults to 6, i.e., about 0.1 m in degrees.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 100_000,
+        path: str | Path | None = None,
+        max_size: int = 2**28,
+        decimals: int = 6,
+    ) -> None:
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.store = None if path is None else SQLiteCache(path, max_size)
+        self._lru: OrderedDict[tuple[str, str, int, int], float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = [0, 0, 0, 0]
+
+    @property
+    def stats(self) -> MemoStats:
+        """Hit and miss counters and the number of points in memory."""
+        with self._lock:
+            return MemoStats(*self._counts, len(self._lru))
+
+    def clear(self) -> None:
+        """Remove all the points from memory and disk and reset the counters."""
+        with self._lock:
+            self._lru.clear()
+            self._counts = [0, 0, 0, 0]
+        if self.store is not None:
+            self.store.clear()
+
+    def _get(self, keys: list[tuple[str, str, int, int]]) -> dict[int, float]:
+        """Get the memoized elevations of the keys by their positions."""
+        found = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                elev = self._lru.get(key)
+                if elev is not None:
+                    self._lru.move_to_end(key)
+                    found[i] = elev
+            self._counts[0] += len(found)
+        if self.store is None or len(found) == len(keys):
+            return found
+
+        missing = {"|".join(map(str, k)): i for i, k in enumerate(keys) if i not in found}
+        on_disk = {
+            missing[k]: float(np.frombuffer(v, dtype="f8")[0])
+            for k, v in self.store.get_many(list(missing)).items()
+        }
+        self._put([keys[i] for i in on_disk], list(on_disk.values()), to_disk=False)
+        with self._lock:
+            self._counts[1] += len(on_disk)
+        return found | on_disk
+
+    def _put(
+        self, keys: list[tuple[str, str, int, int]], values: Sequence[float], to_disk: bool
+    ) -> None:
+        """Memoize the elevations of the keys."""
+        with self._lock:
+            for key, elev in zip(keys, values):
+                self._lru[key] = elev
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+        if to_disk and self.store is not None:
+            self.store.set_many(
+                {"|".join(map(str, k)): np.float64(v).tobytes() for k, v in zip(keys, values)}
+            )
+
+    def elevations(
+        self,
+        coords: Sequence[tuple[float, float]],
+        crs: str,
+        source: str,
+        sample: Callable[[list[tuple[float, float]]], Sequence[float]],
+    ) -> NDArray[np.float64]:
+        """Get the elevations of points, sampling only the ones that are not memoized.
+
+        Parameters
+        ----------
+        coords : list of tuple
+            Coordinates of the points.
+        crs : str
+            The validated CRS of the coordinates.
+        source : str
+            Name of the elevation source.
+        sample : callable
+            Function that gets the elevations of a list of coordinates from
+            the source. It's called once with the unique points that are
+            not memoized, if any.
+
+        Returns
+        -------
+        numpy.ndarray
+            Elevations of all the points.
+        """
+        xy = np.asarray(coords, dtype="f8").reshape(-1, 2)
+        quantized = np.round(xy * 10**self.decimals).astype("i8")
+        unique, first, inverse = np.unique(
+            quantized, axis=0, return_index=True, return_inverse=True
+        )
+        keys = [(source, crs, int(ix), int(iy)) for ix, iy in unique]
+        values = np.empty(len(keys), dtype="f8")
+        found = self._get(keys)
+        if found:
+            values[list(found)] = list(found.values())
+        missing = [i for i in range(len(keys)) if i not in found]
+        if missing:
+            sampled = sample([tuple(xy[first[i]]) for i in missing])
+            values[missing] = sampled
+            self._put([keys[i] for i in missing], values[missing].tolist(), to_disk=True)
+        with self._lock:
+            self._counts[2] += len(missing)
+            self._counts[3] += len(xy) - len(keys)
+        return values[inverse.ravel()]
+
+
+def enable_elevation_memo(
+    maxsize: int = 100_000,
+    path: str | Path | None = None,
+    max_size: int = 2**28,
+    decimals: int = 6,
+) -> ElevationMemo:
+    """Memoize the elevations that ``elevation_bycoords`` returns.
+
+    Once enabled, repeated points, within a call or across calls, are answered
+    from memory, or from disk if ``path`` is given, without reading the DEM or
+    requesting the service. The memo is keyed on the quantized coordinates,
+    their CRS, and the elevation source.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of points that are kept in memory, defaults to 100,000.
+        When it's full, the least recently used points are removed.
+    path : str or pathlib.Path, optional
+        Path to a SQLite database for storing the elevations on disk as well,
+        defaults to ``None``, i.e., in-memory only.
+    max_size : int, optional
+        Maximum size of the on-disk store in bytes, defaults to 256 MiB.
+    decimals : int, optional
+        Number of decimal places of the coordinates that are kept in the keys,
+        defaults to 6.
+
+    Returns
+    -------
+    ElevationMemo
+        The memo, whose ``stats`` attribute has the hit and miss counters.
+    """
+    _MEMO["memo"] = ElevationMemo(maxsize, path, max_size, decimals)
+    return _MEMO["memo"]
+
+
+def disable_elevation_memo() -> None:
+    """Stop memoizing the elevations, the on-disk store, if any, is kept."""
+    _MEMO.pop("memo", None)
+
+
+def get_elevation_memo() -> ElevationMemo | None:
+    """Get the elevation memo, if it's enabled."""
+    return _MEMO.get("memo")
+
+
+def grid_signature(ds: xr.DataArray | xr.Dataset, *extra: Any) -> tuple[Any, ...]:
+    """Get a hashable signature of the grid of a dataset, i.e., its CRS, transform, and shape.
+
+    Parameters
+    ----------
+    ds : xarray.DataArray or xarray.Dataset
+        A dataset with CRS and spatial dimensions.
+    *extra : hashable
+        Other parameters that the values on the grid depend on, e.g., the
+        resolution of the source.
+    """
+    return (ds.rio.crs.to_wkt(), tuple(ds.rio.transform())[:6], ds.rio.shape, *extra)
+
+
+def get_grid(key: tuple[Any, ...]) -> NDArray[np.floating] | None:
+    """Get a copy of the memoized values of a grid by its signature, if any."""
+    with _GRIDS_LOCK:
+        values = _GRIDS.get(key)
+        if values is None:
+            return None
+        _GRIDS.move_to_end(key)
+    return values.copy()
+
+
+def set_grid(key: tuple[Any, ...], values: NDArray[np.floating]) -> None:
+    """Memoize the values of a grid, keeping the ``GRID_MEMO_SIZE`` most recent grids."""
+    with _GRIDS_LOCK:
+        _GRIDS[key] = values.copy()
+        _GRIDS.move_to_end(key)
+        while len(_GRIDS) > GRID_MEMO_SIZE:
+            _GRIDS.popitem(last=False)
+
+
+def clear_grid_memo() -> None:
+    """Remove all the memoized grids."""
+    with _GRIDS_LOCK:
+        _GRIDS.clear()
@@ -133,6 +133,8 @@ def show_versions(file: TextIO = sys.stdout) -> None:
         "xarray",
         #  py3dep deps
         "click",
+        "dask",
+        "pyarrow",
         "pyflwdir",
         #  pynhd deps
         "networkx",
@@ -0,0 +1,170 @@
+"""Content-addressed on-disk cache of the DEM products."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import warnings
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+import numpy as np
+import rioxarray  # noqa: F401
+import xarray as xr
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.io import MemoryFile
+
+from py3dep.cache import SQLiteCache
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+    from rasterio.crs import CRS
+    from rasterio.transform import Affine
+
+__all__ = [
+    "Product",
+    "disable_product_cache",
+    "enable_product_cache",
+    "get_product",
+    "product_key",
+    "set_product",
+    "to_dataarray",
+]
+
+_PRODUCT_CACHE: dict[str, SQLiteCache] = {}
+
+
+class Product(NamedTuple):
+    """A cached DEM product, i.e., a 2D array with its grid and metadata."""
+
+    values: NDArray[np.floating]
+    transform: Affine
+    crs: CRS | None
+    name: str | None
+    attrs: dict[str, Any]
+
+
+def enable_product_cache(path: str | Path | None = None, max_size: int = 2**30) -> None:
+    """Cache the DEM products of ``get_dem``, ``add_elevation``, and ``elevation_bygrid`` on disk.
+
+    Once enabled, the products are stored as compressed Cloud Optimized GeoTIFFs
+    in a SQLite database, keyed by a hash of everything that they depend on, i.e.,
+    the function, the resolution of the source, the CRS, the target grid or
+    geometry, and whether the depressions are filled. Subsequent calls for the
+    same products are then read from the local disk without downloading or
+    warping the DEM. The database can be shared by multiple processes.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path, optional
+        Path to the SQLite database, defaults to ``./cache/3dep_products.sqlite``.
+    max_size : int, optional
+        Maximum size of the cache in bytes, defaults to 1 GiB. When the cache
+        is full, the least recently used products are removed.
+    """
+    path = Path("cache", "3dep_products.sqlite") if path is None else path
+    _PRODUCT_CACHE["products"] = SQLiteCache(path, max_size)
+
+
+def disable_product_cache() -> None:
+    """Stop using the on-disk product cache, the cached products are kept on disk."""
+    _PRODUCT_CACHE.pop("products", None)
+
+
+def product_key(*parts: Any) -> str:
+    """Get the content-addressed key of a product from the parameters that it depends on.
+
+    The parts are hashed in order, bytes as is, e.g., the coordinates of a grid
+    as ``ndarray.tobytes()``, and the other objects by their ``repr``.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _to_json(obj: Any) -> Any:
+    """Convert the NumPy scalars and arrays in the attributes to JSON types."""
+    return obj.tolist() if hasattr(obj, "tolist") else str(obj)
+
+
+def _to_cog(product: Product) -> bytes:
+    """Serialize a product to a compressed Cloud Optimized GeoTIFF."""
+    height, width = product.values.shape
+    with warnings.catch_warnings(), MemoryFile() as mem:
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with mem.open(
+            driver="COG",
+            width=width,
+            height=height,
+            count=1,
+            dtype=product.values.dtype,
+            transform=product.transform,
+            crs=product.crs,
+            nodata=np.nan if product.values.dtype.kind == "f" else None,
+            compress="deflate",
+            predictor=3 if product.values.dtype.kind == "f" else 2,
+        ) as dst:
+            dst.write(product.values, 1)
+            dst.update_tags(
+                py3dep_name=json.dumps(product.name),
+                py3dep_attrs=json.dumps(product.attrs, default=_to_json),
+            )
+        return mem.read()
+
+
+def _from_cog(data: bytes) -> Product:
+    """Deserialize a product from a GeoTIFF."""
+    with warnings.catch_warnings(), MemoryFile(data) as mem, mem.open() as src:
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        tags = src.tags()
+        return Product(
+            src.read(1),
+            src.transform,
+            src.crs,
+            json.loads(tags["py3dep_name"]),
+            json.loads(tags["py3dep_attrs"]),
+        )
+
+
+def get_product(key: str) -> Product | None:
+    """Get a product from the cache, ``None`` if the cache is disabled or it's missing."""
+    cache = _PRODUCT_CACHE.get("products")
+    if cache is None:
+        return None
+    data = cache.get(key)
+    return None if data is None else _from_cog(data)
+
+
+def set_product(key: str, product: Product | xr.DataArray) -> None:
+    """Store a product, or a georeferenced 2D ``DataArray``, if the cache is enabled."""
+    cache = _PRODUCT_CACHE.get("products")
+    if cache is None:
+        return
+    if isinstance(product, xr.DataArray):
+        product = Product(
+            product.to_numpy(),
+            product.rio.transform(),
+            product.rio.crs,
+            None if product.name is None else str(product.name),
+            {k: v for k, v in product.attrs.items() if k != "_FillValue"},
+        )
+    cache.set(key, _to_cog(product))
+
+
+def to_dataarray(product: Product) -> xr.DataArray:
+    """Convert a product to a ``DataArray`` with ``y`` and ``x`` coordinates at the cell centers."""
+    height, width = product.values.shape
+    x, _ = product.transform * (np.arange(width) + 0.5, np.full(width, 0.5))
+    _, y = product.transform * (np.full(height, 0.5), np.arange(height) + 0.5)
+    da = xr.DataArray(
+        product.values,
+        coords={"y": y, "x": x},
+        dims=("y", "x"),
+        name=product.name,
+        attrs=product.attrs,
+    )
+    if product.crs is not None:
+        da = da.rio.write_crs(product.crs)
+    return da.rio.write_transform(product.transform).rio.write_nodata(np.nan)
@@ -3,60 +3,51 @@
 # pyright: reportGeneralTypeIssues=false
 from __future__ import annotations
 
-import contextlib
 import itertools
-from collections.abc import Sequence
-from typing import TYPE_CHECKING, Any, Literal, Union, cast, overload
+from collections.abc import Hashable, Iterator, Mapping, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal, Union, cast, overload
 
 import geopandas as gpd
 import numpy as np
 import pandas as pd
 import pyproj
-import rasterio
-import rioxarray as rxr
+import shapely
 import xarray as xr
 from rasterio import RasterioIOError
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from scipy import ndimage
 from shapely import LineString, MultiLineString, MultiPolygon, Polygon, ops
-from shapely import box as shapely_box
 
-import async_retriever as ar
 import pygeoutils as geoutils
-from py3dep import utils
+from py3dep import memo, products, seamless, terrain, tnm, utils
 from py3dep.exceptions import (
     InputTypeError,
     InputValueError,
     MissingCRSError,
     ServiceUnavailableError,
 )
-from pygeoogc import WMS, ArcGISRESTful, ServiceURL
+from py3dep.index import IndexClient
+from py3dep.wms import LAYERS, TILE_SIZE, Capabilities, get_capabilities, get_tiled
+from pygeoogc import WMS, ServiceURL
 from pygeoogc import utils as ogc_utils
-from pygeoogc.exceptions import ZeroMatchedError
 
 if TYPE_CHECKING:
-    from pathlib import Path
+    from numpy.typing import NDArray
 
     CRSTYPE = Union[int, str, pyproj.CRS]
 
 MAX_PIXELS = 8000000
-LAYERS = [
-    "DEM",
-    "Hillshade Gray",
-    "Aspect Degrees",
-    "Aspect Map",
-    "GreyHillshade_elevationFill",
-    "Hillshade Multidirectional",
-    "Slope Map",
-    "Slope Degrees",
-    "Hillshade Elevation Tinted",
-    "Height Ellipsoidal",
-    "Contour 25",
-    "Contour Smoothed 25",
-]
+_DEM_ATTRS = {"units": "meters", "vertical_datum": "NAVD88", "vertical_resolution": 0.001}
 __all__ = [
     "get_map",
+    "get_map_batch",
     "elevation_bygrid",
     "elevation_bycoords",
     "elevation_profile",
+    "elevation_profile_batch",
     "check_3dep_availability",
     "query_3dep_sources",
     "static_3dep_dem",
@@ -73,6 +64,11 @@ def get_map(
     resolution: int,
     geo_crs: CRSTYPE = ...,
     crs: CRSTYPE = ...,
+    *,
+    tile_size: int | None = ...,
+    max_workers: int = ...,
+    tiff_dir: str | Path | None = ...,
+    local_terrain: bool = ...,
 ) -> xr.DataArray: ...
 
 
@@ -83,6 +79,11 @@ def get_map(
     resolution: int,
     geo_crs: CRSTYPE = ...,
     crs: CRSTYPE = ...,
+    *,
+    tile_size: int | None = ...,
+    max_workers: int = ...,
+    tiff_dir: str | Path | None = ...,
+    local_terrain: bool = ...,
 ) -> xr.Dataset: ...
 
 
@@ -92,12 +93,21 @@ def get_map(
     resolution: int,
     geo_crs: CRSTYPE = 4326,
     crs: CRSTYPE = 4326,
+    *,
+    tile_size: int | None = None,
+    max_workers: int = 4,
+    tiff_dir: str | Path | None = None,
+    local_terrain: bool = False,
 ) -> xr.Dataset | xr.DataArray:
     """Access dynamic layer of `3DEP <https://www.usgs.gov/core-science-systems/ngp/3dep>`__.
 
     The 3DEP service has multi-resolution sources, so depending on the user
     provided resolution the data is resampled on server-side based
-    on all the available data sources. The following layers are available:
+    on all the available data sources. For large areas at fine resolutions,
+    use ``tile_size`` and/or ``tiff_dir`` to download the data as a grid of
+    tiles concurrently. The tiles are placed directly into a pre-allocated
+    array or written to disk, and failed tiles are retried individually.
+    The following layers are available:
 
     - ``DEM``
     - ``Hillshade Gray``
@@ -128,12 +138,239 @@ def get_map(
         ``EPSG:4326``. Valid values are ``EPSG:4326``, ``EPSG:3576``, ``EPSG:3571``,
         ``EPSG:3575``, ``EPSG:3857``, ``EPSG:3572``, ``CRS:84``, ``EPSG:3573``,
         and ``EPSG:3574``.
+    tile_size : int, optional
+        Width and height of the tiles in pixels for a tiled download, defaults to
+        ``None``, i.e., no tiling unless ``tiff_dir`` is given, in which case
+        tiles of 2048 pixels are used.
+    max_workers : int, optional
+        Maximum number of concurrent tile downloads, defaults to 4. This
+        argument is only used for tiled downloads.
+    tiff_dir : str or pathlib.Path, optional
+        Directory for writing the tiles into one GeoTiff file per layer instead
+        of memory, defaults to ``None``. The returned data is then read from these
+        files lazily.
+    local_terrain : bool, optional
+        Compute the ``Slope Degrees``, ``Aspect Degrees``, ``Hillshade Gray``, and
+        ``Hillshade Multidirectional`` layers locally from the DEM using the
+        :mod:`py3dep.terrain` module, instead of requesting them from the service,
+        defaults to ``False``. So, the DEM is downloaded once regardless of the
+        number of these layers. Since the DEM is not available beyond the
+        bounding box of ``geometry``, the cells on its edges are ``NaN``.
 
     Returns
     -------
     xarray.DataArray or xarray.Dataset
         The requested topographic data as an ``xarray.DataArray`` or ``xarray.Dataset``.
+
+    Raises
+    ------
+    TileDownloadError
+        If some tiles of a tiled download cannot be retrieved after retries.
+    """
+    _layers = list(layers) if isinstance(layers, (list, tuple)) else [layers]
+    derived = [lyr for lyr in _layers if lyr in terrain.WMS_LAYERS] if local_terrain else []
+    remote = [lyr for lyr in _layers if lyr not in derived]
+    if derived and "DEM" not in remote:
+        remote.insert(0, "DEM")
+    wms, valid_layers = _wms_client(remote if derived else layers, crs)
+    if not derived:
+        return _get_map(
+            wms,
+            valid_layers,
+            geometry,
+            resolution,
+            geo_crs,
+            tile_size=tile_size,
+            max_workers=max_workers,
+            tiff_dir=tiff_dir,
+        )
+
+    # The DEM is needed within the whole bbox for computing the terrain attributes
+    _geometry = geoutils.geo2polygon(geometry, geo_crs, crs)
+    ds = _get_map(
+        wms,
+        valid_layers,
+        _geometry.bounds,
+        resolution,
+        crs,
+        tile_size=tile_size,
+        max_workers=max_workers,
+        tiff_dir=tiff_dir,
+    )
+    ds = ds.to_dataset() if isinstance(ds, xr.DataArray) else ds
+    for lyr in derived:
+        ds[_layer_name(lyr)] = terrain.WMS_LAYERS[lyr](ds["elevation"])
+    ds = ds[[_layer_name(lyr) for lyr in _layers]]
+    if isinstance(geometry, (Polygon, MultiPolygon)):
+        ds = geoutils.xarray_geomask(ds, _geometry, crs)
+    return ds[_layer_name(_layers[0])] if len(_layers) == 1 else ds
+
+
+def _layer_name(layer: str) -> str:
+    """Get the name of a 3DEP layer in the returned datasets."""
+    return "elevation" if layer == "DEM" else layer.replace(" ", "_").lower()
+
+
+def get_map_batch(
+    layers: str | list[str],
+    geometries: gpd.GeoDataFrame
+    | gpd.GeoSeries
+    | Mapping[Hashable, Polygon | MultiPolygon | tuple[float, float, float, float]]
+    | Sequence[Polygon | MultiPolygon | tuple[float, float, float, float]],
+    resolution: int | Sequence[int],
+    geo_crs: CRSTYPE = 4326,
+    crs: CRSTYPE = 4326,
+    *,
+    max_workers: int = 4,
+    save_dir: str | Path | None = None,
+    return_exceptions: bool = False,
+) -> Iterator[tuple[Hashable, xr.Dataset | xr.DataArray | Path | Exception]]:
+    """Get dynamic layers of 3DEP for many geometries concurrently.
+
+    The layers and CRS are validated once and all the geometries share a single
+    WMS client, so unlike calling ``get_map`` in a loop, no extra requests are
+    sent per geometry. The results are yielded as soon as they are ready, so
+    their order is not necessarily the same as the input geometries.
+
+    Parameters
+    ----------
+    layers : str or list of str
+        A valid 3DEP layer or a list of them. See ``get_map`` for the list
+        of the available layers.
+    geometries : GeoDataFrame, GeoSeries, dict, or list
+        Polygons, MultiPolygons, or bounding boxes of the form
+        ``(west, south, east, north)``. The index of the ``GeoDataFrame``/``GeoSeries``,
+        the keys of the ``dict``, or the position in the ``list`` are used as
+        the keys of the results.
+    resolution : int or list of int
+        The target resolution in meters for all the geometries, or one for each
+        geometry in the same order as ``geometries``.
+    geo_crs : str, int, or pyproj.CRS, optional
+        The spatial reference system of the input geometries, defaults to ``EPSG:4326``.
+        It's ignored if ``geometries`` is a ``GeoDataFrame`` or ``GeoSeries``
+        with a CRS.
+    crs : str, int, or pyproj.CRS, optional
+        The spatial reference system to be used for requesting the data, defaults to
+        ``EPSG:4326``. See ``get_map`` for the valid values.
+    max_workers : int, optional
+        Maximum number of geometries that are downloaded concurrently, defaults to 4.
+    save_dir : str or pathlib.Path, optional
+        If given, each result is saved to ``save_dir/<key>.nc`` and its path is
+        yielded instead of the data, defaults to ``None``.
+    return_exceptions : bool, optional
+        If ``True``, the exception of a failed geometry is yielded as its result
+        instead of being raised, defaults to ``False``.
+
+    Returns
+    -------
+    iterator of tuple
+        An iterator over the key of each geometry and its data as ``xarray.DataArray``
+        or ``xarray.Dataset``, the path to the saved file, or the exception if
+        ``return_exceptions=True``.
     """
+    if isinstance(geometries, (gpd.GeoDataFrame, gpd.GeoSeries)):
+        geo_crs = geometries.crs or geo_crs
+    items = _batch_items(geometries, resolution)
+
+    if save_dir is not None:
+        save_dir = Path(save_dir)
+        save_dir.mkdir(parents=True, exist_ok=True)
+
+    wms, valid_layers = _wms_client(layers, crs)
+    return _iter_map_batch(
+        wms,
+        valid_layers,
+        items,
+        geo_crs,
+        max_workers=max_workers,
+        save_dir=save_dir,
+        return_exceptions=return_exceptions,
+    )
+
+
+def _iter_map_batch(
+    wms: WMS,
+    valid_layers: list[str],
+    items: Iterator[
+        tuple[Hashable, Polygon | MultiPolygon | tuple[float, float, float, float], int]
+    ],
+    geo_crs: CRSTYPE,
+    *,
+    max_workers: int,
+    save_dir: Path | None,
+    return_exceptions: bool,
+) -> Iterator[tuple[Hashable, xr.Dataset | xr.DataArray | Path | Exception]]:
+    """Download the items of a batch concurrently and yield them as they complete."""
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending: dict[Future[xr.Dataset | xr.DataArray], Hashable] = {}
+
+    def _submit(n: int) -> None:
+        for key, geom, res in itertools.islice(items, n):
+            future = executor.submit(
+                _get_map,
+                wms,
+                valid_layers,
+                geom,
+                res,
+                geo_crs,
+                tile_size=None,
+                max_workers=4,
+                tiff_dir=None,
+            )
+            pending[future] = key
+
+    try:
+        # Keep a bounded number of geometries in flight, so the results of a slow consumer
+        # don't pile up in memory
+        _submit(2 * max_workers)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    ds = future.result()
+                    if save_dir is None:
+                        yield key, ds
+                        continue
+                    # netCDF files are written from a single thread since HDF5 is not thread-safe
+                    fpath = utils.save_netcdf(ds, Path(save_dir, f"{key}.nc"))
+                except Exception as ex:
+                    if not return_exceptions:
+                        raise
+                    yield key, ex
+                else:
+                    yield key, fpath
+            _submit(len(done))
+    finally:
+        # Cancel the pending geometries and wait for the running ones, so nothing is
+        # left downloading after an error or when the generator is closed early
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _batch_items(
+    geometries: gpd.GeoDataFrame
+    | gpd.GeoSeries
+    | Mapping[Hashable, Polygon | MultiPolygon | tuple[float, float, float, float]]
+    | Sequence[Polygon | MultiPolygon | tuple[float, float, float, float]],
+    resolution: int | Sequence[int],
+) -> Iterator[tuple[Hashable, Polygon | MultiPolygon | tuple[float, float, float, float], int]]:
+    """Get the key, geometry, and resolution of each item of a batch."""
+    if isinstance(geometries, (gpd.GeoDataFrame, gpd.GeoSeries)):
+        geometries = dict(zip(geometries.index, geometries.geometry))
+    elif not isinstance(geometries, Mapping):
+        geometries = dict(enumerate(geometries))
+
+    if isinstance(resolution, (int, float, np.number)):
+        resolutions = itertools.repeat(resolution)
+    elif len(resolution) != len(geometries):
+        raise InputTypeError("resolution", "int or a list of the same length as geometries")
+    else:
+        resolutions = iter(resolution)
+    return ((key, geom, res) for (key, geom), res in zip(geometries.items(), resolutions))
+
+
+def _wms_layers(layers: str | list[str]) -> list[str]:
+    """Validate the 3DEP layers and get their WMS layer names."""
     _layers = list(layers) if isinstance(layers, (list, tuple)) else [layers]
     invalid = [lyr for lyr in _layers if lyr not in LAYERS]
     if invalid:
@@ -142,44 +379,124 @@ def get_map(
     if "DEM" in _layers:
         _layers[_layers.index("DEM")] = "None"
 
-    _layers = [f"3DEPElevation:{lyr}" for lyr in _layers]
+    return [f"3DEPElevation:{lyr}" for lyr in _layers]
+
+
+def _check_wms_crs(caps: Capabilities, wms_url: str, crs: CRSTYPE) -> None:
+    """Check if a CRS is supported by the WMS service."""
+    if len(caps.crs) == 0:
+        raise ServiceUnavailableError(wms_url)
 
+    if ogc_utils.validate_crs(crs).lower() not in caps.crs:
+        raise InputValueError("crs", caps.crs)
+
+
+def _wms_client(layers: str | list[str], crs: CRSTYPE) -> tuple[WMS, list[str]]:
+    """Validate the layers and CRS, and get a WMS client and the service's valid layers."""
+    _layers = _wms_layers(layers)
     wms_url = ServiceURL().wms.nm_3dep
+    caps = get_capabilities(wms_url)
+    _check_wms_crs(caps, wms_url, crs)
+    wms = WMS(wms_url, layers=_layers, outformat="image/tiff", crs=crs, validation=False)
+    return wms, list(caps.layers)
 
-    valid_crs = ogc_utils.valid_wms_crs(wms_url)
 
-    if len(valid_crs) == 0:
-        raise ServiceUnavailableError(wms_url)
+def _mask_tiled(
+    ds: xr.Dataset,
+    geometry: Polygon | MultiPolygon,
+    crs: CRSTYPE,
+    layers: list[str],
+    valid_layers: list[str],
+) -> xr.Dataset | xr.DataArray:
+    """Mask the tiled layers to a geometry and rename them to their titles."""
+    ds = geoutils.xarray_geomask(ds, geometry, crs)
+    if len(ds) == 1:
+        ds = ds[layers[0]]
+    return utils.rename_layers(ds, valid_layers)
 
-    if ogc_utils.validate_crs(crs).lower() not in valid_crs:
-        raise InputValueError("crs", valid_crs)
 
+def _get_map(
+    wms: WMS,
+    valid_layers: list[str],
+    geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
+    resolution: int,
+    geo_crs: CRSTYPE,
+    *,
+    tile_size: int | None,
+    max_workers: int,
+    tiff_dir: str | Path | None,
+) -> xr.Dataset | xr.DataArray:
+    """Get the layers of a WMS client within a geometry."""
+    crs = wms.crs
     _geometry = geoutils.geo2polygon(geometry, geo_crs, crs)
-    wms = WMS(wms_url, layers=_layers, outformat="image/tiff", crs=crs, validation=False)
+    if tile_size is not None or tiff_dir is not None:
+        ds = get_tiled(
+            wms.url,
+            wms.layers,
+            _geometry.bounds,
+            resolution,
+            crs,
+            tile_size=tile_size or TILE_SIZE,
+            max_workers=max_workers,
+            tiff_dir=tiff_dir,
+        )
+        return _mask_tiled(ds, _geometry, crs, wms.layers, valid_layers)
+
     r_dict = wms.getmap_bybox(_geometry.bounds, resolution, box_crs=crs, max_px=MAX_PIXELS)
 
     try:
         ds = geoutils.gtiff2xarray(r_dict, _geometry, crs)
     except RasterioIOError as ex:
-        raise ServiceUnavailableError(wms_url) from ex
-    valid_layers = wms.get_validlayers()
-    return utils.rename_layers(ds, list(valid_layers))
+        raise ServiceUnavailableError(wms.url) from ex
+    return utils.rename_layers(ds, valid_layers)
+
+
+@overload
+def static_3dep_dem(
+    geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
+    crs: CRSTYPE,
+    resolution: int = ...,
+    chunks: int | tuple[int, int] | dict[str, int] | Literal["auto"] | None = ...,
+    *,
+    out: None = ...,
+    max_workers: int = ...,
+) -> xr.DataArray: ...
+
+
+@overload
+def static_3dep_dem(
+    geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
+    crs: CRSTYPE,
+    resolution: int = ...,
+    chunks: int | tuple[int, int] | dict[str, int] | Literal["auto"] | None = ...,
+    *,
+    out: str | Path,
+    max_workers: int = ...,
+) -> Path: ...
 
 
 def static_3dep_dem(
     geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
     crs: CRSTYPE,
     resolution: int = 10,
-) -> xr.DataArray:
+    chunks: int | tuple[int, int] | dict[str, int] | Literal["auto"] | None = None,
+    *,
+    out: str | Path | None = None,
+    max_workers: int = 4,
+) -> xr.DataArray | Path:
     """Get DEM data at specific resolution from 3DEP.
 
     Notes
     -----
     In contrast to ``get_map`` function, this function only gets DEM data at
-    specific resolution, namely 10 m, 30 m, and 60 m. However, this function
-    is faster. This function is intended for cases where only need DEM at a
-    specific resolution is required and for the other requests ``get_map``
-    should be used.
+    resolutions of at least 10 m from the seamless DEMs that are available
+    at 10 m, 30 m, and 60 m. However, this function is faster. For the other
+    resolutions, the coarsest seamless DEM that is not coarser than the requested
+    resolution is read with a decimated windowed read, i.e., its pixels are
+    averaged and GDAL reads from its overviews, so only the needed bytes are
+    transferred. The seamless DEM is opened once per thread and reused by
+    subsequent calls, and it is read through the on-disk block cache, if it is
+    enabled with ``enable_block_cache``, for the resolutions of 10 m, 30 m, and 60 m.
 
     Parameters
     ----------
@@ -190,50 +507,98 @@ def static_3dep_dem(
         CRS of the input geometry.
     resolution : int, optional
         Target DEM source resolution in meters, defaults to 10 m which is the highest
-        resolution available over the US. Available options are 10, 30, and 60.
+        resolution available over the US. It must be at least 10, e.g., 10, 30, 60,
+        or coarser resolutions such as 100 or 250.
+    chunks : int, tuple, dict, or str, optional
+        Chunk sizes along ``y`` and ``x``, e.g., ``{"y": 4096, "x": 4096}`` or
+        ``"auto"``, for returning a lazy dask-backed ``DataArray`` instead of
+        loading the DEM into memory, defaults to ``None``. Then, nodata masking
+        and clipping by ``geometry`` are done chunk by chunk when the data
+        are computed. This option requires ``dask``.
+    out : str or pathlib.Path, optional
+        Path to a Cloud Optimized GeoTIFF (COG) or, if it ends with ``.zarr``,
+        a Zarr store for writing the DEM to, instead of returning it, defaults
+        to ``None``. The DEM is read, masked, and written block by block, so
+        it's never held in memory as a whole, and the COG has overviews.
+        Writing to Zarr requires ``dask`` and ``zarr``. It cannot be used
+        with ``chunks``, since the Zarr chunks are set by the blocks.
+    max_workers : int, optional
+        Maximum number of blocks that are read concurrently when ``out``
+        is given, defaults to 4.
 
     Returns
     -------
-    xarray.DataArray
-        The request DEM at the specified resolution.
+    xarray.DataArray or pathlib.Path
+        The request DEM at the specified resolution, or the path to the
+        written file if ``out`` is given.
     """
-    base_url = "https://prd-tnm.s3.amazonaws.com/StagedProducts/Elevation"
-    url = {
-        10: f"{base_url}/13/TIFF/USGS_Seamless_DEM_13.vrt",
-        30: f"{base_url}/1/TIFF/USGS_Seamless_DEM_1.vrt",
-        60: f"{base_url}/2/TIFF/USGS_Seamless_DEM_2.vrt",
-    }
-    if resolution not in url:
-        raise InputValueError("resolution", list(url))
-
-    dem = rxr.open_rasterio(url[resolution])
-    dem = cast("xr.DataArray", dem)
-    if "band" in dem.dims:
-        dem = dem.squeeze("band")
-    poly = geoutils.geo2polygon(geometry, crs, dem.rio.crs)
-    dem = dem.rio.clip_box(*poly.bounds)
-    if isinstance(geometry, (Polygon, MultiPolygon)):
-        dem = dem.rio.clip([poly])
-    dem = dem.where(dem > dem.rio.nodata, drop=False)
-    dem = dem.rio.write_nodata(np.nan)
-    dem.attrs.update({"units": "meters", "vertical_datum": "NAVD88", "vertical_resolution": 0.001})
+    if out is not None and chunks is not None:
+        raise InputTypeError("chunks", "None when out is given")
+    src_res = seamless.source_resolution(resolution)
+    src = seamless.open_vrt(src_res)
+    factor = resolution / src_res
+    poly = geoutils.geo2polygon(geometry, crs, src.crs)
+    if out is not None:
+        is_poly = isinstance(geometry, (Polygon, MultiPolygon))
+        return seamless.write_dem(
+            src,
+            poly.bounds,
+            poly if is_poly else None,
+            out,
+            attrs=_DEM_ATTRS,
+            max_workers=max_workers,
+            factor=factor,
+        )
+    dem = seamless.clip_box(src, poly.bounds, chunks, factor)
+    if chunks is not None:
+        is_poly = isinstance(geometry, (Polygon, MultiPolygon))
+        dem = seamless.mask_chunks(dem, poly if is_poly else None)
+    else:
+        if isinstance(geometry, (Polygon, MultiPolygon)):
+            dem = dem.rio.clip([poly])
+        dem = dem.where(dem > dem.rio.nodata, drop=False)
+        dem = dem.rio.write_nodata(np.nan)
+    dem.attrs.update(_DEM_ATTRS)
     dem.name = "elevation"
     return dem
 
 
+@overload
+def get_dem(
+    geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
+    resolution: int,
+    crs: CRSTYPE = ...,
+    *,
+    out: None = ...,
+) -> xr.DataArray: ...
+
+
+@overload
+def get_dem(
+    geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
+    resolution: int,
+    crs: CRSTYPE = ...,
+    *,
+    out: str | Path,
+) -> Path: ...
+
+
 def get_dem(
     geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
     resolution: int,
     crs: CRSTYPE = 4326,
-) -> xr.DataArray:
+    *,
+    out: str | Path | None = None,
+) -> xr.DataArray | Path:
     """Get DEM data at any resolution from 3DEP.
 
     Notes
     -----
     This function is a wrapper of ``static_3dep_dem`` and ``get_map`` functions.
-    Since ``static_3dep_dem`` is much faster, if the requested resolution is 10 m,
-    30 m, or 60 m, ``static_3dep_dem`` will be used. Otherwise, ``get_map``
-    will be used.
+    Since ``static_3dep_dem`` is much faster, if the requested resolution is at
+    least 10 m, ``static_3dep_dem`` will be used. Otherwise, ``get_map``
+    will be used. If the product cache is enabled with ``enable_product_cache``,
+    the DEM is read from the cache for the same geometry, CRS, and resolution.
 
     Parameters
     ----------
@@ -244,13 +609,42 @@ def get_dem(
         Target DEM source resolution in meters.
     crs : str, int, or pyproj.CRS, optional
         The spatial reference system of the input geometry, defaults to ``EPSG:4326``.
+    out : str or pathlib.Path, optional
+        Path to a Cloud Optimized GeoTIFF or a ``.zarr`` store for writing the
+        DEM to block by block, instead of returning it, defaults to ``None``.
+        It's only supported for the resolutions of at least 10 m that
+        ``static_3dep_dem`` serves, see its ``out`` argument for more details.
 
     Returns
     -------
-    xarray.DataArray
-        DEM at the specified resolution in meters and 4326 CRS.
+    xarray.DataArray or pathlib.Path
+        DEM at the specified resolution in meters and 4326 CRS, or the path
+        to the written file if ``out`` is given.
     """
-    if np.isclose(resolution, (10, 30, 60)).any():
+    if out is not None:
+        return static_3dep_dem(geometry, crs, resolution, out=out)
+
+    key = products.product_key(
+        "get_dem",
+        resolution,
+        ogc_utils.validate_crs(crs),
+        geoutils.geo2polygon(geometry, crs, crs).wkb,
+    )
+    cached = products.get_product(key)
+    if cached is not None:
+        return products.to_dataarray(cached)
+    dem = _get_dem(geometry, resolution, crs)
+    products.set_product(key, dem)
+    return dem
+
+
+def _get_dem(
+    geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
+    resolution: int,
+    crs: CRSTYPE,
+) -> xr.DataArray:
+    """Get DEM data at any resolution from 3DEP without the product cache."""
+    if resolution >= min(seamless.VRT_URLS) * (1 - 1e-6):
         dem = static_3dep_dem(geometry, crs, resolution)
     else:
         dem = get_map("DEM", geometry, resolution, crs)
@@ -288,6 +682,17 @@ def add_elevation(
     -------
     xarray.Dataset
         The dataset with ``elevation`` variable added.
+
+    Notes
+    -----
+    The DEM is downloaded for the footprint of the grid of ``ds`` and
+    bilinearly resampled onto the grid with a single warp. The elevations
+    are memoized by the signature of the grid, i.e., its CRS, transform,
+    and shape, along with ``resolution``, so subsequent calls for the same
+    grid, e.g., for other time steps, don't download the DEM again. The
+    memoized grids can be removed with ``py3dep.memo.clear_grid_memo``.
+    If the product cache is enabled with ``enable_product_cache``, the
+    elevations are also stored on disk for the subsequent runs.
     """
     if not isinstance(ds, (xr.DataArray, xr.Dataset)):
         raise InputTypeError("ds", "xarray.DataArray or xarray.Dataset")
@@ -302,26 +707,13 @@ def add_elevation(
     else:
         ds = ds.copy()
     ds = ds.rio.set_spatial_dims(x_dim=x_dim, y_dim=y_dim)
-    if ds_crs.is_projected:
-        ds_proj = ds
-        crs_proj = ds_crs
-    else:
-        ds_proj = ds.rio.reproject(5070)
-        crs_proj = 5070
-    ds_bounds = ds_proj.rio.bounds()
-    if resolution is None:
-        resolution = int(ds_proj.rio.resolution()[0])
-    bounds = shapely_box(*ds_bounds).buffer(3 * resolution, join_style=2, cap_style=2)
-    bounds = geoutils.geometry_reproject(bounds, crs_proj, 4326)
+    key = memo.grid_signature(ds, "add_elevation", resolution)
+    elev = memo.get_grid(key)
+    if elev is None:
+        elev = _elevation_grid(ds, resolution)
+        memo.set_grid(key, elev)
 
-    dims_order = (y_dim, x_dim)
-    elev = (
-        get_dem(bounds.bounds, resolution).rename({"x": x_dim, "y": y_dim}).transpose(*dims_order)
-    )
-    if ds_crs != elev.rio.crs:
-        elev = elev.rio.reproject(ds_crs)
-    elev = geoutils.xarray_geomask(elev, ds.rio.bounds(), ds_crs)
-    ds["elevation"] = (dims_order, elev.rio.reproject_match(ds, resampling=1).values)
+    ds["elevation"] = ((y_dim, x_dim), elev)
     ds["elevation"] = ds["elevation"].rio.write_crs(
         ds.rio.crs, grid_mapping_name=ds.rio.grid_mapping
     )
@@ -331,6 +723,32 @@ def add_elevation(
     return ds
 
 
+def _elevation_grid(ds: xr.Dataset, resolution: int | None) -> NDArray[np.float32]:
+    """Get the elevations on the grid of a dataset with a single warp of the DEM.
+
+    The footprint of the grid is computed from its transformed bounds, buffered
+    by three DEM cells, so the dataset itself is not reprojected.
+    """
+    key = products.product_key("add_elevation", "3DEP", *memo.grid_signature(ds, resolution))
+    cached = products.get_product(key)
+    if cached is not None:
+        return cached.values
+
+    to_5070 = pyproj.Transformer.from_crs(ds.rio.crs, 5070, always_xy=True)
+    xmin, ymin, xmax, ymax = to_5070.transform_bounds(*ds.rio.bounds(), densify_pts=21)
+    if resolution is None:
+        if ds.rio.crs.is_projected:
+            resolution = int(ds.rio.resolution()[0])
+        else:
+            resolution = int((xmax - xmin) / ds.rio.width)
+    buffer = 3 * resolution
+    bbox = (xmin - buffer, ymin - buffer, xmax + buffer, ymax + buffer)
+    dem = _get_dem(bbox, resolution, 5070)
+    elev = dem.rio.reproject_match(ds, resampling=Resampling.bilinear).astype("f4")
+    products.set_product(key, elev)
+    return elev.to_numpy()
+
+
 def get_dem_vrt(
     bbox: tuple[float, float, float, float],
     resolution: int,
@@ -395,22 +813,95 @@ def elevation_bygrid(
     -------
     xarray.DataArray
         Elevations of the input coordinates as a ``xarray.DataArray``.
+
+    Notes
+    -----
+    If the product cache is enabled with ``enable_product_cache``, the
+    elevations are read from the cache for the same grid, CRS, resolution,
+    and ``depression_filling``.
     """
     pts_crs = ogc_utils.validate_crs(crs)
-    bbox = (
-        gpd.GeoSeries(gpd.points_from_xy(*zip(*itertools.product(xcoords, ycoords)), crs=pts_crs))
-        .to_crs(5070)
-        .buffer(2 * resolution)
-        .total_bounds
+    xcoords = np.asarray(xcoords, dtype="f8")
+    ycoords = np.asarray(ycoords, dtype="f8")
+    key = products.product_key(
+        "elevation_bygrid",
+        "3DEP",
+        resolution,
+        pts_crs,
+        xcoords.tobytes(),
+        ycoords.tobytes(),
+        depression_filling,
+    )
+    cached = products.get_product(key)
+    if cached is None:
+        cached = _elevation_bygrid(xcoords, ycoords, pts_crs, resolution, depression_filling)
+        products.set_product(key, cached)
+
+    elev = xr.DataArray(
+        cached.values,
+        coords={"y": ycoords, "x": xcoords},
+        dims=("y", "x"),
+        name=cached.name,
+        attrs=cached.attrs,
+    )
+    elev = elev.rio.write_crs(pts_crs)
+    return elev.rio.write_nodata(np.nan)
+
+
+def _elevation_bygrid(
+    xcoords: NDArray[np.float64],
+    ycoords: NDArray[np.float64],
+    crs: str,
+    resolution: int,
+    depression_filling: bool,
+) -> products.Product:
+    """Get the DEM and interpolate it at the points of a grid."""
+    # The bbox of the grid only depends on its extents, so only its densified
+    # boundary is transformed instead of all the grid points.
+    to_5070 = pyproj.Transformer.from_crs(crs, 5070, always_xy=True)
+    xmin, ymin, xmax, ymax = to_5070.transform_bounds(
+        xcoords.min(), ycoords.min(), xcoords.max(), ycoords.max(), densify_pts=21
     )
+    buffer = 2 * resolution
+    bbox = (xmin - buffer, ymin - buffer, xmax + buffer, ymax + buffer)
 
-    dem = get_dem(tuple(bbox), resolution, 5070)
-    dem = dem.rio.reproject(pts_crs)
+    dem = _get_dem(bbox, resolution, 5070)
 
     if depression_filling:
         dem = utils.fill_depressions(dem)
 
-    return dem.interp(x=list(xcoords), y=list(ycoords))
+    values = _interp_grid(dem, xcoords, ycoords, crs)
+    attrs = {k: v for k, v in dem.attrs.items() if k != "_FillValue"}
+    return products.Product(values, Affine.identity(), None, str(dem.name), attrs)
+
+
+def _interp_grid(
+    dem: xr.DataArray,
+    xcoords: NDArray[np.float64],
+    ycoords: NDArray[np.float64],
+    crs: CRSTYPE,
+    max_points: int = 2**22,
+) -> NDArray[np.float32]:
+    """Bilinearly interpolate a DEM at the points of a grid in another CRS.
+
+    The grid points are transformed to the CRS of the DEM, and the DEM is
+    sampled at their fractional pixel positions. This is done in blocks of
+    rows with about ``max_points`` points, so the memory usage of the
+    intermediate arrays does not depend on the size of the grid.
+    """
+    transformer = pyproj.Transformer.from_crs(crs, dem.rio.crs, always_xy=True)
+    data = dem.to_numpy().astype("f4", copy=False)
+    x0, dx = dem.x[0].item(), (dem.x[1] - dem.x[0]).item()
+    y0, dy = dem.y[0].item(), (dem.y[1] - dem.y[0]).item()
+    nrows = max(max_points // xcoords.size, 1)
+    elev = np.empty((ycoords.size, xcoords.size), dtype="f4")
+    for i in range(0, ycoords.size, nrows):
+        xx, yy = np.meshgrid(xcoords, ycoords[i : i + nrows])
+        xx, yy = transformer.transform(xx, yy)
+        elev[i : i + nrows] = ndimage.map_coordinates(
+            data, ((yy - y0) / dy, (xx - x0) / dx), order=1, mode="constant", cval=np.nan
+        )
+    return elev
 
 
 class ElevationByCoords:
@@ -447,28 +938,46 @@ class ElevationByCoords:
             return self.tep()
         return self.tnm()
 
-    def tnm(self) -> list[float]:
-        """Return list of elevations in meters."""
+    def tnm(self, max_retries: int = tnm.MAX_RETRIES, fallback: bool = True) -> list[float]:
+        """Return list of elevations in meters.
+
+        Identical coordinates are requested once and the number of concurrent
+        requests adapts to the latency and error rate of the service. Failed
+        points are retried individually, see :class:`py3dep.tnm.PointQuery`.
+
+        Parameters
+        ----------
+        max_retries : int, optional
+            Maximum number of retries for each point, defaults to 3.
+        fallback : bool, optional
+            Get the elevations of the points that still fail after the retries
+            from the 10-m static DEM (``tep``), defaults to ``True``. Otherwise,
+            their elevations are ``NaN``.
+        """
         pts = self.coords_gs.to_crs(4326)
-        kwds = [
-            {"params": {"units": "Meters", "x": f"{x:.6f}", "y": f"{y:.6f}"}}
-            for x, y in zip(pts.x, pts.y)
-        ]
-        resp = ar.retrieve_json([ServiceURL().restful.nm_pqs] * len(kwds), kwds, max_workers=5)
-        resp = cast("list[dict[str, Any]]", resp)
-        return [float(r["value"]) for r in resp]
-
-    def tep(self) -> list[float]:
-        """Get elevation from 10-m resolution 3DEP."""
-        url = "/".join(
-            (
-                "https://prd-tnm.s3.amazonaws.com/StagedProducts/Elevation",
-                "13/TIFF/USGS_Seamless_DEM_13.vrt",
-            )
-        )
-        with rasterio.open(url) as src:
-            points_proj = self.coords_gs.to_crs(src.crs)
-            elev = np.array(list(src.sample(zip(points_proj.x, points_proj.y)))).ravel()
+        query = tnm.PointQuery(ServiceURL().restful.nm_pqs, max_retries, fallback)
+        return query.query(list(zip(pts.x, pts.y))).tolist()
+
+    @overload
+    def tep(self, as_array: Literal[False] = ...) -> list[float]: ...
+
+    @overload
+    def tep(self, as_array: Literal[True]) -> NDArray[np.floating]: ...
+
+    def tep(self, as_array: bool = False) -> list[float] | NDArray[np.floating]:
+        """Get elevation from 10-m resolution 3DEP.
+
+        Parameters
+        ----------
+        as_array : bool, optional
+            Return the elevations as a ``numpy.ndarray`` instead of a list,
+            defaults to ``False``.
+        """
+        src = seamless.open_vrt(10)
+        points_proj = self.coords_gs.to_crs(src.crs)
+        elev = seamless.sample_points(src, points_proj.x, points_proj.y)
+        if as_array:
+            return elev
         return elev.tolist()
 
 
@@ -505,25 +1014,110 @@ def elevation_bycoords(
         Query Service with 10 m resolution) and ``tep`` (using 3DEP's static DEM VRTs
         at 10 m resolution). The ``tnm`` and ``tep`` sources are more accurate since they
         use the 1/3 arc-second DEM layer from 3DEP service but it is limited to the US.
-        Note that ``tnm`` is bit unstable. It's recommended to use ``tep`` unless 10-m
-        resolution accuracy is not necessary.
+        Note that ``tnm`` is bit unstable, so its failed points are retried and the
+        points that keep failing are sampled from the ``tep`` source instead. It's
+        recommended to use ``tep`` unless 10-m resolution accuracy is not necessary.
 
     Returns
     -------
     float or list of float
         Elevation in meter.
+
+    Notes
+    -----
+    If the elevation memo is enabled with ``enable_elevation_memo``, repeated
+    points are answered from the memo and only the new unique points are sampled.
     """
     _crs = crs.to_string() if isinstance(crs, pyproj.CRS) else crs
-    service = ElevationByCoords(crs=_crs, coords=coords, source=source)
-    if len(service.coords) == 1:
-        return service.values[0]
-    return service.values
+    elev_memo = memo.get_elevation_memo()
+    if elev_memo is None:
+        service = ElevationByCoords(crs=_crs, coords=coords, source=source)
+        values = service.values
+    else:
+        if source not in ("tnm", "tep"):
+            raise InputValueError("source", ("tnm", "tep"))
+        values = elev_memo.elevations(
+            geoutils.coords_list(coords),
+            ogc_utils.validate_crs(_crs),
+            source,
+            lambda pts: ElevationByCoords(crs=_crs, coords=pts, source=source).values,
+        ).tolist()
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+def _merge_line(line: LineString | MultiLineString) -> LineString:
+    """Validate a line and merge it to a single ``LineString``."""
+    if not isinstance(line, (LineString, MultiLineString)):
+        raise InputTypeError("lines", "LineString or MultiLineString")
+
+    if isinstance(line, MultiLineString):
+        line = ops.linemerge(line)
+        if not isinstance(line, LineString):
+            raise InputTypeError("lines", "MultiLineString that can be merged to LineString")
+    return line
+
+
+def _smooth_line(line: LineString, spacing: float) -> LineString:
+    """Smooth a line with a spline and resample it at a uniform spacing."""
+    if len(line.coords) < 4:
+        # The cubic spline needs at least four vertices
+        line = LineString(line.interpolate(np.linspace(0, 1, 4), normalized=True))
+    return geoutils.smooth_linestring(line, 0.1, max(int(np.ceil(line.length / spacing)), 2))
+
+
+def _sample_profiles(
+    lines: Sequence[LineString],
+    spacing: float,
+    crs: CRSTYPE,
+    method: Literal["nearest", "bilinear"],
+) -> tuple[
+    NDArray[np.int64],
+    NDArray[np.float64],
+    NDArray[np.float64],
+    NDArray[np.float64],
+    NDArray[np.float64],
+]:
+    """Sample the 10-m DEM along the smoothed lines at a uniform spacing.
+
+    The lines are reprojected together and the points of all of them are
+    sampled in a single pass over the blocks of the DEM that they pass through,
+    so the blocks that the lines share are read once.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Number of points of each line, and the ``x`` and ``y`` in ``crs``,
+        distance from the start of their line in meters, and elevation of
+        all the points.
+    """
+    crs_prj = 5070
+    lines_prj = gpd.GeoSeries(lines, crs=crs).to_crs(crs_prj)
+    smoothed = [_smooth_line(line, spacing) for line in lines_prj]
+    counts = shapely.get_num_coordinates(smoothed).astype("i8")
+    x_prj, y_prj = shapely.get_coordinates(smoothed).T
+
+    src = seamless.open_vrt(10)
+    to_src = pyproj.Transformer.from_crs(crs_prj, src.crs, always_xy=True)
+    elevation = seamless.interp_points(src, *to_src.transform(x_prj, y_prj), method=method)
+
+    starts = np.cumsum(counts) - counts
+    step = np.hypot(np.diff(x_prj, prepend=x_prj[0]), np.diff(y_prj, prepend=y_prj[0]))
+    step[starts] = 0
+    distance = step.cumsum()
+    distance -= np.repeat(distance[starts], counts)
+
+    to_crs = pyproj.Transformer.from_crs(crs_prj, crs, always_xy=True)
+    x, y = to_crs.transform(x_prj, y_prj)
+    return counts, np.asarray(x), np.asarray(y), distance, elevation
 
 
 def elevation_profile(
-    lines: LineString | MultiLineString,
+    lines: LineString | MultiLineString | Sequence[LineString | MultiLineString],
     spacing: float,
     crs: CRSTYPE = 4326,
+    method: Literal["nearest", "bilinear"] = "nearest",
 ) -> xr.DataArray:
     """Get the elevation profile along a line at a given uniform spacing.
 
@@ -534,53 +1128,117 @@ def elevation_profile(
 
     Parameters
     ----------
-    lines : LineString or MultiLineString
+    lines : LineString, MultiLineString, or list of them
         Line segment(s) to be profiled. If its type is ``MultiLineString``,
         it will be converted to a single ``LineString`` and if this operation
-        fails, an ``InputTypeError`` will be raised.
+        fails, an ``InputTypeError`` will be raised. For a list of lines, all
+        of them are profiled at once and only the blocks of the DEM that the
+        lines pass through are read, once.
     spacing : float
         Spacing between the sample points along the line in meters.
     crs : str, int, or pyproj.CRS, optional
         Spatial reference System (CRS) of ``lines``, defaults to ``EPSG:4326``.
+    method : {"nearest", "bilinear"}, optional
+        Method for interpolating the DEM at the sample points, defaults to ``nearest``.
 
     Returns
     -------
     xarray.DataArray
         Elevation profile with dimension ``z`` and three coordinates: ``x``, ``y``,
         and ``distance``. The ``distance`` coordinate is the distance from the start
-        of the line in meters.
+        of the line in meters. For a list of lines, the profiles are stacked along
+        a ``line`` dimension and the profiles that are shorter than the longest one
+        are padded with ``NaN``.
     """
-    if not isinstance(lines, (LineString, MultiLineString)):
-        raise InputTypeError("lines", "LineString or MultiLineString")
-
-    if isinstance(lines, MultiLineString):
-        path = ops.linemerge(lines)
-        if not isinstance(path, LineString):
-            raise InputTypeError("lines", "MultiLineString that can be merged to LineString")
-    else:
-        path = lines
-
-    crs_prj = 5070
-    geom_proj = geoutils.geometry_reproject(path, crs, crs_prj)
-    npts = int(np.ceil(geom_proj.length / spacing))
-    geom_proj = geoutils.smooth_linestring(geom_proj, 0.1, npts)
-    elev_list = elevation_bycoords(list(zip(*geom_proj.xy)), crs=crs_prj, source="tep")
+    is_list = isinstance(lines, (list, tuple))
+    paths = [_merge_line(line) for line in (lines if is_list else [lines])]
+    counts, x, y, distance, elev = _sample_profiles(paths, spacing, crs, method)
+
+    line = np.repeat(np.arange(len(counts)), counts)
+    z = np.arange(len(line)) - np.repeat(np.cumsum(counts) - counts, counts)
+    stacked = []
+    for values in (elev, x, y, distance):
+        arr = np.full((len(counts), counts.max()), np.nan)
+        arr[line, z] = values
+        stacked.append(arr if is_list else arr[0])
+    dims = ("line", "z") if is_list else "z"
     elevation = xr.DataArray(
-        elev_list,
-        dims="z",
-        coords={"z": range(len(elev_list))},
+        stacked[0],
+        dims=dims,
+        coords={"z": range(counts.max())},
         attrs={"source": "10-m DEM from 3DEP"},
     )
-    geom = geoutils.geometry_reproject(geom_proj, crs_prj, crs)
-    x, y = geom.xy
-    elevation["x"], elevation["y"] = ("z", list(x)), ("z", list(y))
-    distance = np.hypot(np.diff(x), np.diff(y)).cumsum()
-    distance = np.insert(distance, 0, 0)
-    elevation["distance"] = ("z", distance)
+    elevation["x"], elevation["y"] = (dims, stacked[1]), (dims, stacked[2])
+    elevation["distance"] = (dims, stacked[3])
     elevation["distance"].attrs = {"units": "m", "long_name": "Distance from start"}
     return elevation
 
 
+def elevation_profile_batch(
+    lines: gpd.GeoSeries | gpd.GeoDataFrame,
+    spacing: float,
+    crs: CRSTYPE = 4326,
+    method: Literal["nearest", "bilinear"] = "nearest",
+    as_dataframe: bool = True,
+) -> pd.DataFrame | xr.Dataset:
+    """Get the elevation profiles of many lines at a given uniform spacing.
+
+    Unlike calling ``elevation_profile`` for each line, the lines are
+    reprojected once and the points of all of them are sampled in a single
+    pass over the blocks of the 10-m DEM, so the blocks that are shared by
+    overlapping or neighboring lines are read once.
+
+    Parameters
+    ----------
+    lines : GeoSeries or GeoDataFrame
+        Lines to be profiled. The ``MultiLineString`` geometries are converted to
+        a single ``LineString`` and if this operation fails, an ``InputTypeError``
+        is raised. The index is used as the line IDs, so it must be unique.
+    spacing : float
+        Spacing between the sample points along the lines in meters.
+    crs : str, int, or pyproj.CRS, optional
+        Spatial reference System (CRS) of ``lines``, defaults to ``EPSG:4326``.
+        It's ignored if ``lines`` has a CRS.
+    method : {"nearest", "bilinear"}, optional
+        Method for interpolating the DEM at the sample points, defaults to ``nearest``.
+    as_dataframe : bool, optional
+        Return the profiles as a long-form ``pandas.DataFrame``, defaults to ``True``.
+        Otherwise, they are returned as an ``xarray.Dataset`` with ``line`` and
+        ``station`` dimensions, whose profiles that are shorter than the longest
+        one are padded with ``NaN``.
+
+    Returns
+    -------
+    pandas.DataFrame or xarray.Dataset
+        The ``x`` and ``y`` in ``crs``, ``distance`` from the start of the line
+        in meters, and ``elevation`` of the sample points of all the lines
+        indexed by the line ID and the station number of the points.
+    """
+    if not isinstance(lines, (gpd.GeoSeries, gpd.GeoDataFrame)):
+        raise InputTypeError("lines", "GeoSeries or GeoDataFrame")
+    if not lines.index.is_unique:
+        dups = lines.index[lines.index.duplicated()].unique()
+        raise InputValueError("lines.index", ["unique line IDs"], ", ".join(map(str, dups)))
+    crs = lines.crs or crs
+    paths = [_merge_line(line) for line in lines.geometry]
+    counts, x, y, distance, elev = _sample_profiles(paths, spacing, crs, method)
+
+    index = pd.MultiIndex.from_arrays(
+        (
+            np.repeat(lines.index.to_numpy(), counts),
+            np.arange(len(elev)) - np.repeat(np.cumsum(counts) - counts, counts),
+        ),
+        names=("line", "station"),
+    )
+    profiles = pd.DataFrame({"x": x, "y": y, "distance": distance, "elevation": elev}, index=index)
+    if as_dataframe:
+        return profiles
+    ds = profiles.to_xarray()
+    ds["distance"].attrs = {"units": "m", "long_name": "Distance from start"}
+    ds["elevation"].attrs = {"units": "m", "source": "10-m DEM from 3DEP"}
+    return ds
+
+
 def check_3dep_availability(
     bbox: tuple[float, float, float, float], crs: CRSTYPE = 4326
 ) -> dict[str, bool | str]:
@@ -611,52 +1269,7 @@ def check_3dep_availability(
     >>> py3dep.check_3dep_availability(bbox)
     {'1m': True, '3m': False, '5m': False, '10m': True, '30m': True, '60m': False, 'topobathy': False}
     """
-    if not isinstance(bbox, Sequence) or len(bbox) != 4:
-        raise InputTypeError("bbox", "a tuple of length 4")
-
-    res_layers = {
-        "1m": 18,
-        "3m": 19,
-        "5m": 20,
-        "10m": 21,
-        "30m": 22,
-        "60m": 23,
-        "topobathy": 30,
-    }
-    base_url = ServiceURL().restful.nm_3dep_index
-    urls = [f"{base_url}/{lyr}/query" for lyr in res_layers.values()]
-
-    geom_query = ogc_utils.esri_query(bbox, crs, 4326)
-    payload = {
-        **geom_query,
-        "spatialRel": "esriSpatialRelIntersects",
-        "returnGeometry": "false",
-        "returnIdsOnly": "false",
-        "returnCountOnly": "true",
-        "f": "json",
-    }
-
-    resps = ar.retrieve_json(
-        urls,
-        [{"params": payload}] * len(urls),
-        max_workers=len(urls),
-        raise_status=False,
-    )
-    resps = cast("list[dict[str, Any]]", resps)
-
-    def _check(r: dict[str, Any] | None) -> bool | str:
-        if r is None or "error" in r:
-            return "Failed"
-        return bool(r.get("count"))
-
-    avail = {res: _check(r) for res, r in zip(res_layers, resps)}
-    failed = [res for res, r in avail.items() if r == "Failed"]
-    if failed:
-        [
-            ar.delete_url_cache(f"{base_url}/{res_layers[res]}/query", params=payload)
-            for res in failed
-        ]
-    return avail
+    return IndexClient().availability([bbox], crs)[0]
 
 
 def query_3dep_sources(
@@ -698,41 +1311,4 @@ def query_3dep_sources(
     >>> src.groupby("dem_res")["OBJECTID"].count().to_dict()
     {'1m': 4}
     """
-    if not isinstance(bbox, Sequence) or len(bbox) != 4:
-        raise InputTypeError("bbox", "a tuple of length 4")
-
-    res_layers = {
-        "1m": 18,
-        "3m": 19,
-        "5m": 20,
-        "10m": 21,
-        "30m": 22,
-        "60m": 23,
-        "topobathy": 30,
-    }
-    if res is None:
-        layers = res_layers
-    elif isinstance(res, str) and res in res_layers:
-        layers = {res: res_layers[res]}
-    elif isinstance(res, (list, tuple)) and all(r in res_layers for r in res):
-        layers = {r: res_layers[r] for r in res}
-    else:
-        raise InputValueError("res", list(res_layers))
-
-    def _check(lyr: int) -> gpd.GeoDataFrame | None:
-        client = ArcGISRESTful(ServiceURL().restful.nm_3dep_index, lyr, outformat="json")
-        with contextlib.suppress(ZeroMatchedError):
-            oids = client.oids_bygeom(bbox, crs)
-            return geoutils.json2geodf(client.get_features(oids))
-        return None
-
-    return (  # pyright: ignore[reportReturnType]
-        gpd.GeoDataFrame(  # pyright: ignore[reportCallIssue]
-            pd.concat({res: _check(lyr) for res, lyr in layers.items()}).reset_index(  # pyright: ignore[reportCallIssue,reportArgumentType]
-                level=1, drop=True
-            ),
-            crs=4326,
-        )
-        .reset_index()
-        .rename(columns={"index": "dem_res"})
-    )
+    return IndexClient(res).sources([bbox], crs)[0]
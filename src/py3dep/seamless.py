@@ -0,0 +1,888 @@
+"""Windowed access to the staged 3DEP seamless DEMs."""
+
+from __future__ import annotations
+
+import atexit
+import io
+import itertools
+import math
+import os
+import threading
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Literal, Union
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+import rasterio.windows
+import rioxarray  # noqa: F401
+import xarray as xr
+from rasterio import RasterioIOError, features
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+import pygeoutils as geoutils
+from py3dep.cache import SQLiteCache
+from py3dep.exceptions import DependencyError, InputRangeError, InputValueError
+
+if TYPE_CHECKING:
+    import pyproj
+    from numpy.typing import ArrayLike, NDArray
+    from rasterio.io import DatasetReader, DatasetWriter
+    from shapely import MultiPolygon, Polygon
+
+    CRSTYPE = Union[int, str, pyproj.CRS]
+    CHUNKS = Union[int, tuple[int, int], dict[str, int], Literal["auto"], None]
+
+try:
+    import dask.array as da
+    from dask.base import tokenize
+
+    has_dask = True
+except ImportError:
+    has_dask = False
+
+try:
+    import zarr  # noqa: F401
+
+    has_zarr = True
+except ImportError:
+    has_zarr = False
+
+__all__ = [
+    "VRT_URLS",
+    "clip_box",
+    "close_datasets",
+    "disable_block_cache",
+    "enable_block_cache",
+    "interp_points",
+    "invalidate_dataset",
+    "mask_chunks",
+    "open_dataset",
+    "open_vrt",
+    "prewarm_block_cache",
+    "read_window",
+    "sample_points",
+    "source_resolution",
+    "write_dem",
+]
+
+BASE_URL = "https://prd-tnm.s3.amazonaws.com/StagedProducts/Elevation"
+VRT_URLS = {
+    10: f"{BASE_URL}/13/TIFF/USGS_Seamless_DEM_13.vrt",
+    30: f"{BASE_URL}/1/TIFF/USGS_Seamless_DEM_1.vrt",
+    60: f"{BASE_URL}/2/TIFF/USGS_Seamless_DEM_2.vrt",
+}
+WINDOW_SIZE = 512
+BLOCK_SIZE = 512
+
+_BLOCK_CACHE: dict[str, SQLiteCache] = {}
+
+
+class _PoolOwner:
+    """A marker that lives as long as the dataset pool of a thread."""
+
+
+_POOLS: dict[int, dict[str, DatasetReader]] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _close_pool(key: int) -> None:
+    """Close the datasets of the pool of a thread that has ended and unregister it."""
+    with _POOLS_LOCK:
+        datasets = _POOLS.pop(key, {})
+    for src in list(datasets.values()):
+        src.close()
+    datasets.clear()
+
+
+class _DatasetPool(threading.local):
+    """Open datasets of the current thread, keyed by their path.
+
+    The pools of all the threads are registered in ``_POOLS``, so they can be
+    closed by ``close_datasets``. When a thread ends, its pool is discarded
+    and its datasets are closed.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """Start a new empty pool for the current thread and process."""
+        self.pid = os.getpid()
+        self.datasets: dict[str, DatasetReader] = {}
+        self.owner = _PoolOwner()
+        key = id(self.owner)
+        with _POOLS_LOCK:
+            _POOLS[key] = self.datasets
+        weakref.finalize(self.owner, _close_pool, key)
+
+
+_POOL = _DatasetPool()
+
+
+def open_dataset(path: str | Path) -> DatasetReader:
+    """Get an open dataset that is reused by the current thread and process.
+
+    Opening a VRT requires parsing its XML and resolving its sources, which is
+    expensive for the seamless DEMs. So, datasets are opened once per thread,
+    since rasterio datasets are not thread-safe, and per process, since they
+    cannot be shared after a fork, and reused by subsequent calls.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path or URL of the dataset.
+
+    Returns
+    -------
+    rasterio.io.DatasetReader
+        The open dataset. It should not be closed by the caller, use
+        ``close_datasets`` instead.
+    """
+    path = str(path)
+    if _POOL.pid != os.getpid():
+        _POOL.reset()
+    src = _POOL.datasets.get(path)
+    if src is None or src.closed:
+        src = rasterio.open(path)
+        _POOL.datasets[path] = src
+    return src
+
+
+def source_resolution(resolution: float) -> int:
+    """Get the coarsest seamless DEM resolution that is not coarser than a resolution.
+
+    Parameters
+    ----------
+    resolution : float
+        Target resolution in meters, at least 10.
+
+    Returns
+    -------
+    int
+        Resolution of the seamless DEM in meters, i.e., 10, 30, or 60.
+    """
+    valid = [res for res in VRT_URLS if res <= resolution * (1 + 1e-6)]
+    if not valid:
+        raise InputRangeError("resolution", f">= {min(VRT_URLS)}")
+    return max(valid)
+
+
+def open_vrt(resolution: int) -> DatasetReader:
+    """Get the reused open dataset of a seamless DEM, see ``open_dataset``.
+
+    Parameters
+    ----------
+    resolution : int
+        Resolution of the seamless DEM in meters. Available options are
+        10, 30, and 60.
+
+    Returns
+    -------
+    rasterio.io.DatasetReader
+        The open dataset of the seamless DEM.
+    """
+    if resolution not in VRT_URLS:
+        raise InputValueError("resolution", list(VRT_URLS))
+    return open_dataset(VRT_URLS[resolution])
+
+
+def invalidate_dataset(path: str | Path | None = None) -> None:
+    """Discard the open dataset(s) of the current thread, so they are reopened on next use.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path, optional
+        Path or URL of the dataset to discard, defaults to ``None``, i.e.,
+        all the datasets of the current thread.
+    """
+    paths = list(_POOL.datasets) if path is None else [str(path)]
+    for p in paths:
+        src = _POOL.datasets.pop(p, None)
+        if src is not None:
+            src.close()
+
+
+@atexit.register
+def close_datasets() -> None:
+    """Close all the reused open datasets of all the threads of the current process."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for datasets in pools:
+        for path in list(datasets):
+            src = datasets.pop(path, None)
+            if src is not None:
+                src.close()
+
+
+def enable_block_cache(path: str | Path | None = None, max_size: int = 2**30) -> None:
+    """Cache the blocks that are read from the seamless DEMs on disk.
+
+    Once enabled, all reads from the static 3DEP VRTs, i.e., ``static_3dep_dem``
+    and ``elevation_bycoords`` with ``source="tep"``, are done in blocks of
+    512 by 512 pixels that are stored in a SQLite database. Subsequent requests
+    that cover the same blocks are then read from the local disk. The database
+    can be shared by multiple processes.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path, optional
+        Path to the SQLite database, defaults to ``./cache/3dep_blocks.sqlite``.
+    max_size : int, optional
+        Maximum size of the cache in bytes, defaults to 1 GiB. When the cache
+        is full, the least recently used blocks are removed.
+    """
+    path = Path("cache", "3dep_blocks.sqlite") if path is None else path
+    _BLOCK_CACHE["blocks"] = SQLiteCache(path, max_size)
+
+
+def disable_block_cache() -> None:
+    """Stop using the on-disk block cache, the cached blocks are kept on disk."""
+    _BLOCK_CACHE.pop("blocks", None)
+
+
+def _block_key(src: DatasetReader, row: int, col: int) -> str:
+    """Get the cache key of a block of a dataset."""
+    return f"{Path(src.name).name}/{BLOCK_SIZE}/{row}_{col}"
+
+
+def _read_block(cache: SQLiteCache, src: DatasetReader, row: int, col: int) -> NDArray[np.floating]:
+    """Read a block from the block cache or the dataset and cache it."""
+    key = _block_key(src, row, col)
+    cached = cache.get(key)
+    if cached is not None:
+        return np.load(io.BytesIO(cached))
+    row_off, col_off = row * BLOCK_SIZE, col * BLOCK_SIZE
+    window = Window(
+        col_off,
+        row_off,
+        min(BLOCK_SIZE, src.width - col_off),
+        min(BLOCK_SIZE, src.height - row_off),
+    )
+    block = src.read(1, window=window)
+    buffer = io.BytesIO()
+    np.save(buffer, block)
+    cache.set(key, buffer.getvalue())
+    return block
+
+
+def read_window(
+    src: DatasetReader, window: Window, out_shape: tuple[int, int] | None = None
+) -> NDArray[np.floating]:
+    """Read a window of the first band of a dataset, through the block cache if enabled.
+
+    Parameters
+    ----------
+    src : rasterio.io.DatasetReader
+        An open raster dataset.
+    window : rasterio.windows.Window
+        The window to read that is within the dataset. Its offsets and lengths
+        must be integers, unless ``out_shape`` is given.
+    out_shape : tuple of int, optional
+        Shape of the output array for a decimated read, defaults to ``None``,
+        i.e., the shape of ``window``. Then, the window is resampled by averaging
+        and GDAL reads from the overviews of the dataset, if there are any, so
+        only the needed bytes are transferred. Decimated reads bypass the block
+        cache.
+
+    Returns
+    -------
+    numpy.ndarray
+        The 2D array of the window.
+
+    Notes
+    -----
+    If the read fails and ``src`` is a reused dataset from ``open_dataset``,
+    it is discarded, so the next call to ``open_dataset`` reopens it.
+    """
+    try:
+        if out_shape is not None and out_shape != (window.height, window.width):
+            return src.read(1, window=window, out_shape=out_shape, resampling=Resampling.average)
+        return _read_window(src, window)
+    except RasterioIOError:
+        for path, pooled in list(_POOL.datasets.items()):
+            if pooled is src:
+                invalidate_dataset(path)
+        raise
+
+
+def _read_window(src: DatasetReader, window: Window) -> NDArray[np.floating]:
+    """Read a window of the first band of a dataset."""
+    cache = _BLOCK_CACHE.get("blocks")
+    if cache is None:
+        return src.read(1, window=window)
+
+    row_off, col_off = int(window.row_off), int(window.col_off)
+    height, width = int(window.height), int(window.width)
+    arr = np.empty((height, width), dtype=src.dtypes[0])
+    for brow in range(row_off // BLOCK_SIZE, (row_off + height - 1) // BLOCK_SIZE + 1):
+        for bcol in range(col_off // BLOCK_SIZE, (col_off + width - 1) // BLOCK_SIZE + 1):
+            block = _read_block(cache, src, brow, bcol)
+            r0, c0 = brow * BLOCK_SIZE, bcol * BLOCK_SIZE
+            rs, cs = max(r0, row_off), max(c0, col_off)
+            re = min(r0 + block.shape[0], row_off + height)
+            ce = min(c0 + block.shape[1], col_off + width)
+            arr[rs - row_off : re - row_off, cs - col_off : ce - col_off] = block[
+                rs - r0 : re - r0, cs - c0 : ce - c0
+            ]
+    return arr
+
+
+def _bounds_window(src: DatasetReader, bounds: tuple[float, float, float, float]) -> Window:
+    """Get the window of a dataset that covers a bounding box in the dataset's CRS."""
+    window = rasterio.windows.from_bounds(*bounds, transform=src.transform)
+    (row_start, row_stop), (col_start, col_stop) = window.toranges()
+    row_start = min(max(math.floor(row_start), 0), src.height)
+    row_stop = min(max(math.ceil(row_stop), 0), src.height)
+    col_start = min(max(math.floor(col_start), 0), src.width)
+    col_stop = min(max(math.ceil(col_stop), 0), src.width)
+    if row_stop - row_start < 1 or col_stop - col_start < 1:
+        raise InputRangeError("geometry", "within the extent of the DEM")
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def _decimated_shape(window: Window, factor: float) -> tuple[int, int]:
+    """Get the shape of a window that is decimated by a factor."""
+    return (
+        max(round(int(window.height) / factor), 1),
+        max(round(int(window.width) / factor), 1),
+    )
+
+
+def _sub_window(window: Window, shape: tuple[int, int], sub: Window) -> Window:
+    """Get the window of the dataset for a window of a, possibly decimated, array of ``window``.
+
+    For decimated arrays, the offsets and lengths of the returned window are fractional.
+    """
+    scale_y, scale_x = window.height / shape[0], window.width / shape[1]
+    if scale_y == scale_x == 1:
+        return Window(
+            window.col_off + sub.col_off, window.row_off + sub.row_off, sub.width, sub.height
+        )
+    return Window(
+        window.col_off + sub.col_off * scale_x,
+        window.row_off + sub.row_off * scale_y,
+        sub.width * scale_x,
+        sub.height * scale_y,
+    )
+
+
+class _LazyWindow:
+    """An array-like window of a dataset that is read on indexing.
+
+    The dataset is opened with ``open_dataset`` on each read, so the
+    windows can be read from dask's worker threads and processes.
+    """
+
+    def __init__(
+        self, path: str, window: Window, dtype: str, shape: tuple[int, int] | None = None
+    ) -> None:
+        self.path = path
+        self.window = window
+        self.shape = (int(window.height), int(window.width)) if shape is None else shape
+        self.dtype = np.dtype(dtype)
+        self.ndim = 2
+
+    def __getitem__(self, key: tuple[slice, slice]) -> NDArray[np.floating]:
+        (r0, r1, _), (c0, c1, _) = (k.indices(n) for k, n in zip(key, self.shape))
+        if r1 <= r0 or c1 <= c0:
+            return np.empty((max(r1 - r0, 0), max(c1 - c0, 0)), dtype=self.dtype)
+        window = _sub_window(self.window, self.shape, Window(c0, r0, c1 - c0, r1 - r0))
+        return read_window(open_dataset(self.path), window, (r1 - r0, c1 - c0))
+
+
+def _dask_chunks(chunks: CHUNKS) -> Any:
+    """Convert the ``chunks`` argument to a form that ``dask.array`` accepts."""
+    if isinstance(chunks, dict):
+        return (chunks.get("y", -1), chunks.get("x", -1))
+    return chunks
+
+
+def clip_box(
+    src: DatasetReader,
+    bounds: tuple[float, float, float, float],
+    chunks: CHUNKS = None,
+    factor: float = 1.0,
+) -> xr.DataArray:
+    """Read the part of the first band of a dataset that covers a bounding box.
+
+    Parameters
+    ----------
+    src : rasterio.io.DatasetReader
+        An open raster dataset.
+    bounds : tuple of length 4
+        The bounding box ``(xmin, ymin, xmax, ymax)`` in the dataset's CRS.
+    chunks : int, tuple, dict, or str, optional
+        Chunk sizes along ``y`` and ``x`` for returning a lazy dask-backed array,
+        e.g., ``{"y": 2048, "x": 2048}`` or ``"auto"``, defaults to ``None``, i.e.,
+        the data are read into memory. The chunks are read with datasets that are
+        opened using ``open_dataset`` with the path of ``src``.
+    factor : float, optional
+        Decimation factor of the pixels, e.g., 2 for reading the data at twice
+        the pixel size of the dataset, defaults to 1. The pixels are resampled
+        by averaging, see ``read_window``.
+
+    Returns
+    -------
+    xarray.DataArray
+        The clipped data with ``x`` and ``y`` coordinates of pixel centers.
+    """
+    window = _bounds_window(src, bounds)
+    height, width = _decimated_shape(window, factor)
+    transform = src.window_transform(window) * Affine.scale(
+        window.width / width, window.height / height
+    )
+    x = transform.c + transform.a * (np.arange(width) + 0.5)
+    y = transform.f + transform.e * (np.arange(height) + 0.5)
+    if chunks is None:
+        data = read_window(src, window, (height, width))
+    else:
+        if not has_dask:
+            raise DependencyError("dask", "Reading the DEM lazily")
+        lazy = _LazyWindow(src.name, window, src.dtypes[0], (height, width))
+        data = da.from_array(
+            lazy,
+            chunks=_dask_chunks(chunks),
+            name=f"seamless-{tokenize(src.name, tuple(window.flatten()), factor)}",
+            lock=False,
+            meta=np.array((), dtype=lazy.dtype),
+        )
+    dem = xr.DataArray(data, dims=("y", "x"), coords={"y": y, "x": x})
+    dem = dem.rio.write_transform(transform)
+    dem = dem.rio.write_crs(src.crs)
+    return dem.rio.write_nodata(src.nodata)
+
+
+def _mask_chunk(
+    block: NDArray[np.floating],
+    geometry: Polygon | MultiPolygon | None,
+    transform: rasterio.Affine,
+    nodata: float,
+    block_info: dict[Any, Any] | None = None,
+) -> NDArray[np.floating]:
+    """Mask the nodata and outside of a geometry cells of a chunk."""
+    if block_info is None:
+        return _mask_block(block, None, transform, nodata)
+    (r0, _), (c0, _) = block_info[0]["array-location"]
+    window = Window(c0, r0, *block.shape[::-1])
+    return _mask_block(block, geometry, rasterio.windows.transform(window, transform), nodata)
+
+
+def _mask_block(
+    block: NDArray[np.floating],
+    geometry: Polygon | MultiPolygon | None,
+    transform: rasterio.Affine,
+    nodata: float,
+) -> NDArray[np.floating]:
+    """Mask the nodata and outside of a geometry cells of a block with its own transform."""
+    valid = block > nodata
+    if geometry is not None:
+        valid &= features.geometry_mask(
+            [geometry], out_shape=block.shape, transform=transform, invert=True
+        )
+    return np.where(valid, block, np.nan).astype(block.dtype, copy=False)
+
+
+def mask_chunks(dem: xr.DataArray, geometry: Polygon | MultiPolygon | None) -> xr.DataArray:
+    """Set nodata cells and cells outside a geometry to NaN chunk by chunk.
+
+    Parameters
+    ----------
+    dem : xarray.DataArray
+        A dask-backed DEM with dimensions ``y`` and ``x``.
+    geometry : Polygon or MultiPolygon or None
+        Geometry in the CRS of ``dem``. Cells whose centers are outside of it
+        are masked. If ``None``, only the nodata cells are masked.
+
+    Returns
+    -------
+    xarray.DataArray
+        The masked DEM with NaN as the nodata value.
+    """
+    masked = da.map_blocks(
+        _mask_chunk,
+        dem.data,
+        geometry,
+        dem.rio.transform(),
+        dem.rio.nodata,
+        dtype=dem.dtype,
+    )
+    dem = dem.copy(data=masked)
+    return dem.rio.write_nodata(np.nan)
+
+
+def prewarm_block_cache(
+    geometry: Polygon | MultiPolygon | tuple[float, float, float, float],
+    crs: CRSTYPE = 4326,
+    resolution: int = 10,
+) -> int:
+    """Fill the on-disk block cache with the DEM blocks that cover a geometry.
+
+    Parameters
+    ----------
+    geometry : Polygon, MultiPolygon, or tuple of length 4
+        Geometry or bounding box of form ``(xmin, ymin, xmax, ymax)`` to cache.
+    crs : int, str, of pyproj.CRS, optional
+        CRS of the input geometry, defaults to ``EPSG:4326``.
+    resolution : int, optional
+        Resolution of the seamless DEM in meters, defaults to 10. Available
+        options are 10, 30, and 60.
+
+    Returns
+    -------
+    int
+        Number of blocks that cover the geometry.
+
+    Notes
+    -----
+    If the block cache is not enabled, it is enabled with the default settings
+    of ``enable_block_cache``.
+    """
+    if resolution not in VRT_URLS:
+        raise InputValueError("resolution", list(VRT_URLS))
+
+    if "blocks" not in _BLOCK_CACHE:
+        enable_block_cache()
+    cache = _BLOCK_CACHE["blocks"]
+    src = open_vrt(resolution)
+    bounds = geoutils.geo2polygon(geometry, crs, src.crs).bounds
+    window = _bounds_window(src, bounds)
+    rows = range(
+        int(window.row_off) // BLOCK_SIZE,
+        (int(window.row_off + window.height) - 1) // BLOCK_SIZE + 1,
+    )
+    cols = range(
+        int(window.col_off) // BLOCK_SIZE,
+        (int(window.col_off + window.width) - 1) // BLOCK_SIZE + 1,
+    )
+    for row in rows:
+        for col in cols:
+            _read_block(cache, src, row, col)
+    return len(rows) * len(cols)
+
+
+def _group_by_window(
+    rows: NDArray[np.int64], cols: NDArray[np.int64], window_size: int
+) -> list[NDArray[np.int64]]:
+    """Group pixel indices by the ``window_size`` block that contains them."""
+    key = (rows // window_size) * (int(cols.max()) // window_size + 1) + cols // window_size
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    splits = np.flatnonzero(key[1:] != key[:-1]) + 1
+    return np.split(order, splits)
+
+
+def sample_points(
+    src: DatasetReader,
+    x: ArrayLike,
+    y: ArrayLike,
+    window_size: int = WINDOW_SIZE,
+) -> NDArray[np.floating]:
+    """Sample the first band of a raster at many points using windowed reads.
+
+    Points are binned by the ``window_size`` by ``window_size`` blocks of the
+    raster grid that contain them. Then, for each bin only the window that
+    bounds its points is read, once, and the values are gathered with NumPy
+    indexing. The results are the same as ``src.sample`` but with one read
+    per block instead of one read per point. If the block cache is enabled,
+    see ``enable_block_cache``, the windows are read through the cache.
+
+    Parameters
+    ----------
+    src : rasterio.io.DatasetReader
+        An open raster dataset.
+    x : array_like
+        X-coordinates of the points in the dataset's CRS.
+    y : array_like
+        Y-coordinates of the points in the dataset's CRS.
+    window_size : int, optional
+        Size of the blocks, in pixels, that the points are grouped by,
+        defaults to 512.
+
+    Returns
+    -------
+    numpy.ndarray
+        Values at the points with the same dtype as the dataset. Points that
+        fall outside the dataset are set to its nodata value (or 0 if the
+        dataset has no nodata value).
+    """
+    x = np.atleast_1d(np.asarray(x, dtype="f8"))
+    y = np.atleast_1d(np.asarray(y, dtype="f8"))
+    values = np.full(x.shape, src.nodata or 0, dtype=src.dtypes[0])
+
+    inv = ~src.transform
+    cols = np.floor(inv.a * x + inv.b * y + inv.c).astype("i8")
+    rows = np.floor(inv.d * x + inv.e * y + inv.f).astype("i8")
+    inside = np.flatnonzero((rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width))
+    if inside.size == 0:
+        return values
+
+    rows, cols = rows[inside], cols[inside]
+    for grp in _group_by_window(rows, cols, window_size):
+        r, c = rows[grp], cols[grp]
+        row_off, col_off = r.min(), c.min()
+        window = Window(col_off, row_off, c.max() - col_off + 1, r.max() - row_off + 1)
+        arr = read_window(src, window)
+        values[inside[grp]] = arr[r - row_off, c - col_off]
+    return values
+
+
+def _bilinear(
+    arr: NDArray[np.floating],
+    nodata: float | None,
+    rows: NDArray[np.float64],
+    cols: NDArray[np.float64],
+) -> NDArray[np.float64]:
+    """Bilinearly interpolate an array at fractional pixel positions within it."""
+    r0 = np.minimum(np.floor(rows).astype("i8"), arr.shape[0] - 2)
+    c0 = np.minimum(np.floor(cols).astype("i8"), arr.shape[1] - 2)
+    wr, wc = rows - r0, cols - c0
+    corners = arr.astype("f8")
+    if nodata is not None:
+        corners[arr == nodata] = np.nan
+    top = corners[r0, c0] * (1 - wc) + corners[r0, c0 + 1] * wc
+    bottom = corners[r0 + 1, c0] * (1 - wc) + corners[r0 + 1, c0 + 1] * wc
+    return top * (1 - wr) + bottom * wr
+
+
+def interp_points(
+    src: DatasetReader,
+    x: ArrayLike,
+    y: ArrayLike,
+    method: Literal["nearest", "bilinear"] = "nearest",
+    window_size: int = WINDOW_SIZE,
+) -> NDArray[np.float64]:
+    """Interpolate the first band of a raster at many points using windowed reads.
+
+    Same as ``sample_points``, the points are grouped by the blocks of the
+    raster grid that contain them and only the window that bounds the points
+    of each block is read, so for points along a line, only the corridor of
+    the blocks that the line passes through is read. If the block cache is
+    enabled, see ``enable_block_cache``, the windows are read through the cache.
+
+    Parameters
+    ----------
+    src : rasterio.io.DatasetReader
+        An open raster dataset.
+    x : array_like
+        X-coordinates of the points in the dataset's CRS.
+    y : array_like
+        Y-coordinates of the points in the dataset's CRS.
+    method : {"nearest", "bilinear"}, optional
+        Interpolation method, defaults to ``nearest``. For ``bilinear``, the
+        values are interpolated between the centers of the four nearest pixels.
+    window_size : int, optional
+        Size of the blocks, in pixels, that the points are grouped by,
+        defaults to 512.
+
+    Returns
+    -------
+    numpy.ndarray
+        Values at the points as float64. Points that fall outside the dataset
+        or next to its nodata pixels are ``NaN``.
+    """
+    if method not in ("nearest", "bilinear"):
+        raise InputValueError("method", ("nearest", "bilinear"))
+    x = np.atleast_1d(np.asarray(x, dtype="f8"))
+    y = np.atleast_1d(np.asarray(y, dtype="f8"))
+    if method == "nearest":
+        values = sample_points(src, x, y, window_size).astype("f8")
+        if src.nodata is not None:
+            values[values == src.nodata] = np.nan
+        return values
+
+    values = np.full(x.shape, np.nan, dtype="f8")
+    inv = ~src.transform
+    cols = inv.a * x + inv.b * y + inv.c - 0.5
+    rows = inv.d * x + inv.e * y + inv.f - 0.5
+    inside = np.flatnonzero(
+        (rows >= 0) & (rows <= src.height - 1) & (cols >= 0) & (cols <= src.width - 1)
+    )
+    if inside.size == 0 or src.height < 2 or src.width < 2:
+        return values
+
+    rows, cols = rows[inside], cols[inside]
+    r0 = np.minimum(rows.astype("i8"), src.height - 2)
+    c0 = np.minimum(cols.astype("i8"), src.width - 2)
+    for grp in _group_by_window(r0, c0, window_size):
+        row_off, col_off = r0[grp].min(), c0[grp].min()
+        window = Window(col_off, row_off, c0[grp].max() - col_off + 2, r0[grp].max() - row_off + 2)
+        arr = read_window(src, window)
+        values[inside[grp]] = _bilinear(arr, src.nodata, rows[grp] - row_off, cols[grp] - col_off)
+    return values
+
+
+def _block_windows(height: int, width: int, block_size: int) -> list[Window]:
+    """Split a grid into windows of ``block_size`` by ``block_size`` pixels."""
+    return [
+        Window(c, r, min(block_size, width - c), min(block_size, height - r))
+        for r in range(0, height, block_size)
+        for c in range(0, width, block_size)
+    ]
+
+
+def _read_masked(
+    path: str,
+    window: Window,
+    block: Window,
+    geometry: Polygon | MultiPolygon | None,
+    *,
+    transform: rasterio.Affine,
+    nodata: float,
+) -> NDArray[np.float32]:
+    """Read a window of a dataset as a block of the output in the current thread and mask it."""
+    out_shape = (int(block.height), int(block.width))
+    data = read_window(open_dataset(path), window, out_shape).astype("f4", copy=False)
+    return _mask_block(data, geometry, rasterio.windows.transform(block, transform), nodata)
+
+
+def _write_blocks(
+    dst: DatasetWriter,
+    src: DatasetReader,
+    window: Window,
+    geometry: Polygon | MultiPolygon | None,
+    max_workers: int,
+) -> None:
+    """Read the masked blocks of the output concurrently and write them in order of completion.
+
+    The blocks are on the grid of ``dst``, which covers ``window`` of ``src``
+    and can be decimated. The datasets that the workers open are closed before
+    returning, since the workers end with the call.
+    """
+    shape = (dst.height, dst.width)
+    blocks = iter(_block_windows(dst.height, dst.width, BLOCK_SIZE))
+    pending = {}
+    pools: list[dict[str, DatasetReader]] = []
+
+    def _submit(n: int) -> None:
+        for block in itertools.islice(blocks, n):
+            src_window = _sub_window(window, shape, block)
+            future = executor.submit(
+                _read_masked,
+                src.name,
+                src_window,
+                block,
+                geometry,
+                transform=dst.transform,
+                nodata=src.nodata,
+            )
+            pending[future] = block
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers, initializer=lambda: pools.append(_POOL.datasets)
+        ) as executor:
+            _submit(2 * max_workers)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dst.write(future.result(), 1, window=pending.pop(future))
+                _submit(len(done))
+    finally:
+        for datasets in pools:
+            while datasets:
+                datasets.popitem()[1].close()
+
+
+def write_dem(
+    src: DatasetReader,
+    bounds: tuple[float, float, float, float],
+    geometry: Polygon | MultiPolygon | None,
+    out: str | Path,
+    *,
+    attrs: dict[str, Any] | None = None,
+    max_workers: int = 4,
+    factor: float = 1.0,
+) -> Path:
+    """Write the first band of a dataset within a bounding box to disk block by block.
+
+    The blocks are read concurrently, each thread with its own dataset from
+    ``open_dataset``, and their nodata cells and cells outside of ``geometry``
+    are set to ``NaN``. So, the whole array is never held in memory. For a
+    ``.zarr`` path, the blocks are written to a chunked Zarr store, which
+    requires ``dask`` and ``zarr``. Otherwise, they are written to a tiled and
+    compressed GeoTIFF that is converted to a Cloud Optimized GeoTIFF (COG)
+    with overviews. The COG is moved to ``out`` only once it's complete, so
+    an interrupted call does not leave a partial file at ``out``.
+
+    Parameters
+    ----------
+    src : rasterio.io.DatasetReader
+        An open raster dataset.
+    bounds : tuple of length 4
+        The bounding box ``(xmin, ymin, xmax, ymax)`` in the dataset's CRS.
+    geometry : Polygon or MultiPolygon or None
+        Geometry in the CRS of the dataset for masking the cells outside of it.
+    out : str or pathlib.Path
+        Path to the output COG or Zarr store. It's overwritten if it exists.
+    attrs : dict, optional
+        Attributes that are written as the tags of the COG or attributes of the
+        ``elevation`` variable of the Zarr store, defaults to ``None``.
+    max_workers : int, optional
+        Maximum number of blocks that are read concurrently, defaults to 4.
+    factor : float, optional
+        Decimation factor of the pixels, defaults to 1, see ``clip_box``.
+
+    Returns
+    -------
+    pathlib.Path
+        Path to the output file.
+    """
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    attrs = attrs or {}
+    if out.suffix == ".zarr":
+        if not (has_dask and has_zarr):
+            raise DependencyError(["dask", "zarr"], "Writing the DEM to a Zarr store")
+        dem = mask_chunks(clip_box(src, bounds, 4 * BLOCK_SIZE, factor), geometry)
+        dem = dem.astype("f4").rename("elevation")
+        dem.attrs.update(attrs)
+        dem.to_dataset().to_zarr(out, mode="w")
+        return out
+
+    window = _bounds_window(src, bounds)
+    height, width = _decimated_shape(window, factor)
+    transform = src.window_transform(window) * Affine.scale(
+        window.width / width, window.height / height
+    )
+    tmp = out.with_name(f"{out.name}.part")
+    cog = out.with_name(f"{out.name}.cog.part")
+    profile = {
+        "driver": "GTiff",
+        "width": width,
+        "height": height,
+        "count": 1,
+        "dtype": "float32",
+        "crs": src.crs,
+        "transform": transform,
+        "nodata": np.nan,
+        "tiled": True,
+        "blockxsize": BLOCK_SIZE,
+        "blockysize": BLOCK_SIZE,
+        "compress": "deflate",
+        "predictor": 3,
+        "BIGTIFF": "IF_SAFER",
+    }
+    try:
+        with rasterio.open(tmp, "w", **profile) as dst:
+            _write_blocks(dst, src, window, geometry, max_workers)
+            dst.update_tags(**attrs)
+        rasterio.shutil.copy(
+            tmp,
+            cog,
+            driver="COG",
+            compress="deflate",
+            predictor=3,
+            blocksize=BLOCK_SIZE,
+            overview_resampling="average",
+            BIGTIFF="IF_SAFER",
+        )
+        cog.replace(out)
+    finally:
+        tmp.unlink(missing_ok=True)
+        cog.unlink(missing_ok=True)
+    return out
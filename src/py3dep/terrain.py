@@ -0,0 +1,208 @@
+"""Terrain attributes that are computed locally from a DEM."""
+
+from __future__ import annotations
+
+import functools
+from typing import TYPE_CHECKING, Callable, Literal
+
+import numpy as np
+import rioxarray  # noqa: F401
+import xarray as xr
+
+from py3dep.exceptions import InputTypeError, InputValueError
+from py3dep.utils import cell_spacing
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+__all__ = ["WMS_LAYERS", "aspect", "curvature", "hillshade", "slope", "tpi"]
+
+
+def _check_dem(dem: xr.DataArray) -> tuple[str, str]:
+    """Check that a DEM is a 2D DataArray and get its y and x dimensions."""
+    if not isinstance(dem, xr.DataArray) or dem.ndim != 2:
+        raise InputTypeError("dem", "2D xarray.DataArray")
+    ydim, xdim = dem.dims
+    if dem[ydim].size < 3 or dem[xdim].size < 3:
+        raise InputTypeError("dem", "DataArray with at least 3 rows and 3 columns")
+    return str(ydim), str(xdim)
+
+
+def _spacing(dem: xr.DataArray) -> tuple[xr.DataArray | float, float]:
+    """Get the signed spacing of the cells along x and y in meters."""
+    _check_dem(dem)
+    return cell_spacing(dem)
+
+
+def _window(dem: xr.DataArray, dr: int, dc: int) -> xr.DataArray:
+    """Get the values of the neighbors that are ``dr`` rows and ``dc`` columns away."""
+    ydim, xdim = dem.dims
+    return dem.shift({ydim: -dr, xdim: -dc})
+
+
+def _gradients(dem: xr.DataArray) -> tuple[xr.DataArray, xr.DataArray]:
+    """Get the gradients of a DEM along its x and y coordinates using Horn (1981)."""
+    dx, dy = _spacing(dem)
+    z = {(dr, dc): _window(dem, dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)}
+    gx = (z[-1, 1] + 2 * z[0, 1] + z[1, 1] - z[-1, -1] - 2 * z[0, -1] - z[1, -1]) / (8 * dx)
+    gy = (z[1, -1] + 2 * z[1, 0] + z[1, 1] - z[-1, -1] - 2 * z[-1, 0] - z[-1, 1]) / (8 * dy)
+    return gx, gy
+
+
+def _finalize(da: xr.DataArray, name: str, units: str) -> xr.DataArray:
+    """Set the name, units, and nodata of a terrain attribute."""
+    da = da.astype("f4")
+    da.name = name
+    da.attrs = {"units": units}
+    return da.rio.write_nodata(np.nan)
+
+
+def slope(dem: xr.DataArray, units: Literal["degrees", "m/m"] = "degrees") -> xr.DataArray:
+    """Compute the slope of a DEM.
+
+    The gradients are computed using the 3x3 finite differences of Horn (1981),
+    so the cells on the edges are ``NaN``. The cell sizes are in meters, i.e.,
+    for geographic CRSs, they are computed at the latitude of each row.
+    Lazy dask-backed DEMs remain lazy.
+
+    Parameters
+    ----------
+    dem : xarray.DataArray
+        Elevation in meters with a CRS.
+    units : {"degrees", "m/m"}, optional
+        Units of the slope, defaults to ``degrees``.
+
+    Returns
+    -------
+    xarray.DataArray
+        Slope as float32, named ``slope_degrees`` or ``slope``, respectively.
+    """
+    if units not in ("degrees", "m/m"):
+        raise InputValueError("units", ("degrees", "m/m"))
+    gx, gy = _gradients(dem)
+    tan = np.hypot(gx, gy)
+    if units == "m/m":
+        return _finalize(tan, "slope", "m/m")
+    return _finalize(np.degrees(np.arctan(tan)), "slope_degrees", "degrees")
+
+
+def _aspect(gx: xr.DataArray, gy: xr.DataArray) -> xr.DataArray:
+    """Get the compass direction of the steepest descent in radians."""
+    return np.arctan2(-gx, -gy)
+
+
+def aspect(dem: xr.DataArray) -> xr.DataArray:
+    """Compute the aspect of a DEM, i.e., the direction that its slopes face.
+
+    Parameters
+    ----------
+    dem : xarray.DataArray
+        Elevation in meters with a CRS.
+
+    Returns
+    -------
+    xarray.DataArray
+        Aspect in degrees clockwise from north as float32, named ``aspect_degrees``.
+        Flat cells and the cells on the edges are ``NaN``.
+    """
+    gx, gy = _gradients(dem)
+    asp = (np.degrees(_aspect(gx, gy)) + 360) % 360
+    return _finalize(asp.where((gx != 0) | (gy != 0)), "aspect_degrees", "degrees")
+
+
+def hillshade(
+    dem: xr.DataArray,
+    azimuth: float | Sequence[float] = 315.0,
+    altitude: float = 45.0,
+    z_factor: float = 1.0,
+) -> xr.DataArray:
+    """Compute the hillshade of a DEM.
+
+    Parameters
+    ----------
+    dem : xarray.DataArray
+        Elevation in meters with a CRS.
+    azimuth : float or list of float, optional
+        Compass direction of the light source in degrees, defaults to 315, i.e.,
+        north-west. For a multidirectional hillshade, pass a list of directions,
+        e.g., ``(225, 270, 315, 360)``, and the average of their hillshades is
+        returned.
+    altitude : float, optional
+        Angle of the light source above the horizon in degrees, defaults to 45.
+    z_factor : float, optional
+        Vertical exaggeration, defaults to 1.
+
+    Returns
+    -------
+    xarray.DataArray
+        Hillshade between 0 and 255 as float32, named ``hillshade``.
+    """
+    gx, gy = _gradients(dem)
+    slp = np.arctan(z_factor * np.hypot(gx, gy))
+    asp = _aspect(gx, gy)
+    zenith = np.deg2rad(90 - altitude)
+    azimuths = np.deg2rad(np.atleast_1d(azimuth))
+    shade = sum(
+        np.cos(zenith) * np.cos(slp) + np.sin(zenith) * np.sin(slp) * np.cos(az - asp)
+        for az in azimuths
+    )
+    return _finalize(255 * (shade / len(azimuths)).clip(min=0), "hillshade", "")
+
+
+def curvature(dem: xr.DataArray) -> xr.DataArray:
+    """Compute the curvature of a DEM.
+
+    The curvature is the second derivative of the surface based on
+    Zevenbergen and Thorne (1987) with the same sign and scale as in ArcGIS,
+    i.e., positive for convex and negative for concave surfaces in 1/100 m.
+
+    Parameters
+    ----------
+    dem : xarray.DataArray
+        Elevation in meters with a CRS.
+
+    Returns
+    -------
+    xarray.DataArray
+        Curvature as float32, named ``curvature``. The cells on the edges are ``NaN``.
+    """
+    dx, dy = _spacing(dem)
+    d = ((_window(dem, 0, -1) + _window(dem, 0, 1)) / 2 - dem) / dx**2
+    e = ((_window(dem, -1, 0) + _window(dem, 1, 0)) / 2 - dem) / dy**2
+    return _finalize(-200 * (d + e), "curvature", "1/100 m")
+
+
+def tpi(dem: xr.DataArray, radius: int = 1) -> xr.DataArray:
+    """Compute the topographic position index (TPI) of a DEM.
+
+    TPI is the difference between the elevation of a cell and the mean
+    elevation of its neighbors within a square window.
+
+    Parameters
+    ----------
+    dem : xarray.DataArray
+        Elevation in meters.
+    radius : int, optional
+        Radius of the window in cells, defaults to 1, i.e., a 3x3 window.
+
+    Returns
+    -------
+    xarray.DataArray
+        TPI in meters as float32, named ``tpi``. The cells within ``radius``
+        of the edges are ``NaN``.
+    """
+    ydim, xdim = _check_dem(dem)
+    if not isinstance(radius, int) or radius < 1:
+        raise InputTypeError("radius", "positive int")
+    size = 2 * radius + 1
+    total = dem.rolling({ydim: size, xdim: size}, center=True).sum()
+    return _finalize(dem - (total - dem) / (size**2 - 1), "tpi", "m")
+
+
+WMS_LAYERS: dict[str, Callable[[xr.DataArray], xr.DataArray]] = {
+    "Slope Degrees": slope,
+    "Aspect Degrees": aspect,
+    "Hillshade Gray": hillshade,
+    "Hillshade Multidirectional": functools.partial(hillshade, azimuth=(225, 270, 315, 360)),
+}
+"""The layers of the 3DEP WMS service that can be computed from the DEM."""
@@ -0,0 +1,263 @@
+"""Adaptive querying of The National Map's Point Query Service."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, NamedTuple, cast
+
+import aiohttp
+import numpy as np
+import pyproj
+
+import async_retriever as ar
+from async_retriever.exceptions import ServiceError
+from py3dep import seamless
+from py3dep.exceptions import InputTypeError
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from numpy.typing import NDArray
+
+__all__ = [
+    "AdaptiveConcurrency",
+    "PointQuery",
+    "QueryStats",
+    "parse_elevation",
+    "sample_static_dem",
+]
+
+MAX_RETRIES = 3
+REQUEST_ERRORS = (ServiceError, aiohttp.ClientError, asyncio.TimeoutError)
+"""The exceptions of failed requests, i.e., network and service errors."""
+
+
+class QueryStats(NamedTuple):
+    """Statistics of a batch of point queries."""
+
+    points: int
+    unique: int
+    requests: int
+    retries: int
+    fallback: int
+    workers: int
+
+
+class AdaptiveConcurrency:
+    """Additive-increase, multiplicative-decrease control of concurrent requests.
+
+    After each round of requests, the number of workers is halved if the error
+    rate exceeds ``error_rate``, decreased by one if the latency per request is
+    more than ``latency_factor`` times the best observed latency, and increased
+    by one otherwise.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Initial number of concurrent requests, defaults to 5.
+    min_workers : int, optional
+        Minimum number of concurrent requests, defaults to 1.
+    max_workers : int, optional
+        Maximum number of concurrent requests, defaults to 32.
+    error_rate : float, optional
+        Error rate of a round above which the concurrency is halved,
+        defaults to 0.05.
+    latency_factor : float, optional
+        Ratio of a round's latency to the best observed latency above which
+        the concurrency is decreased, defaults to 2.
+    """
+
+    def __init__(
+        self,
+        workers: int = 5,
+        min_workers: int = 1,
+        max_workers: int = 32,
+        error_rate: float = 0.05,
+        latency_factor: float = 2.0,
+    ) -> None:
+        if not 1 <= min_workers <= workers <= max_workers:
+            raise InputTypeError("workers", "int between min_workers and max_workers")
+        self.workers = workers
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.error_rate = error_rate
+        self.latency_factor = latency_factor
+        self.best_latency = np.inf
+        self.failed_rounds = 0
+
+    def update(self, n_requests: int, n_failed: int, elapsed: float) -> None:
+        """Adjust the concurrency based on the outcome of a round of requests."""
+        if n_requests == 0:
+            return
+        if n_failed / n_requests > self.error_rate:
+            self.workers = max(self.min_workers, self.workers // 2)
+            self.failed_rounds += 1
+            return
+        self.failed_rounds = 0
+        # Requests run in waves of ``workers``, so this is the latency of each request
+        latency = elapsed * self.workers / n_requests
+        self.best_latency = min(self.best_latency, latency)
+        if latency > self.latency_factor * self.best_latency:
+            self.workers = max(self.min_workers, self.workers - 1)
+        else:
+            self.workers = min(self.max_workers, self.workers + 1)
+
+    @property
+    def backoff(self) -> float:
+        """Seconds to wait before the next round, grows with consecutive failed rounds."""
+        if self.failed_rounds == 0:
+            return 0.0
+        return min(0.5 * 2 ** (self.failed_rounds - 1), 8.0)
+
+
+class PointQuery:
+    """Get elevations from the Point Query Service with adaptive concurrency.
+
+    Identical coordinates are queried once. The points are requested in rounds
+    whose concurrency is adjusted by :class:`AdaptiveConcurrency` based on the
+    observed latency and error rate. Failed points are retried individually in
+    the later rounds and the points that still fail after ``max_retries``
+    retries are sampled from the 10-m static 3DEP DEM instead, if ``fallback``
+    is ``True``.
+
+    Parameters
+    ----------
+    url : str
+        The Point Query Service URL.
+    max_retries : int, optional
+        Maximum number of retries for each point, defaults to 3.
+    fallback : bool, optional
+        Sample the 10-m static DEM for the points that keep failing, defaults
+        to ``True``. If ``False``, their elevations are ``NaN``, as are those
+        of the points that fall outside the DEM or on its nodata cells.
+    concurrency : AdaptiveConcurrency, optional
+        The concurrency controller, defaults to one that starts with 5 workers.
+    batch_factor : int, optional
+        Number of requests per round as a multiple of the number of workers,
+        defaults to 4.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_retries: int = MAX_RETRIES,
+        fallback: bool = True,
+        concurrency: AdaptiveConcurrency | None = None,
+        batch_factor: int = 4,
+    ) -> None:
+        self.url = url
+        self.max_retries = max_retries
+        self.fallback = fallback
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.batch_factor = batch_factor
+        self.stats = QueryStats(0, 0, 0, 0, 0, self.concurrency.workers)
+
+    def _round(self, params: list[dict[str, str]]) -> tuple[list[float | None], float]:
+        """Request a round of points and get their elevations, ``None`` for failures."""
+        start = time.perf_counter()
+        try:
+            resp = ar.retrieve_json(
+                [self.url] * len(params),
+                [{"params": p} for p in params],
+                max_workers=self.concurrency.workers,
+                raise_status=False,
+            )
+        except REQUEST_ERRORS:
+            resp = [None] * len(params)
+        elapsed = time.perf_counter() - start
+        return [parse_elevation(r) for r in cast("list[dict[str, Any] | None]", resp)], elapsed
+
+    def query(self, coords: Sequence[tuple[float, float]]) -> NDArray[np.float64]:
+        """Get the elevations of a list of ``(lon, lat)`` coordinates in meters.
+
+        Parameters
+        ----------
+        coords : list of tuple
+            Coordinates in ``EPSG:4326``.
+
+        Returns
+        -------
+        numpy.ndarray
+            Elevations in meters.
+        """
+        keys = [(f"{x:.6f}", f"{y:.6f}") for x, y in coords]
+        unique = list(dict.fromkeys(keys))
+        values: dict[tuple[str, str], float] = {}
+        attempts = dict.fromkeys(unique, 0)
+        pending = deque(unique)
+        failed = []
+        n_requests = n_retries = 0
+        while pending:
+            time.sleep(self.concurrency.backoff)
+            size = self.concurrency.workers * self.batch_factor
+            batch = [pending.popleft() for _ in range(min(size, len(pending)))]
+            params = [{"units": "Meters", "x": x, "y": y} for x, y in batch]
+            elevations, elapsed = self._round(params)
+            n_requests += len(batch)
+            n_retries += sum(attempts[k] > 0 for k in batch)
+            n_failed = 0
+            for key, param, elev in zip(batch, params, elevations):
+                if elev is not None:
+                    values[key] = elev
+                    continue
+                n_failed += 1
+                # Make sure a cached invalid response is not reused on retry
+                ar.delete_url_cache(self.url, params=param)
+                attempts[key] += 1
+                if attempts[key] > self.max_retries:
+                    failed.append(key)
+                else:
+                    pending.append(key)
+            self.concurrency.update(len(batch), n_failed, elapsed)
+
+        if failed:
+            values.update(zip(failed, self._fallback(failed)))
+        self.stats = QueryStats(
+            len(keys), len(unique), n_requests, n_retries, len(failed), self.concurrency.workers
+        )
+        return np.array([values[k] for k in keys], dtype="f8")
+
+    def _fallback(self, keys: list[tuple[str, str]]) -> NDArray[np.float64]:
+        """Sample the 10-m static DEM at the points that kept failing."""
+        if not self.fallback:
+            return np.full(len(keys), np.nan)
+        return sample_static_dem(keys)
+
+
+def parse_elevation(resp: dict[str, Any] | None) -> float | None:
+    """Get the elevation from a Point Query Service response, ``None`` if invalid."""
+    try:
+        return float(resp["value"])  # pyright: ignore[reportOptionalSubscript]
+    except (TypeError, KeyError, ValueError):
+        return None
+
+
+def sample_static_dem(coords: Sequence[tuple[float | str, float | str]]) -> NDArray[np.float64]:
+    """Sample the 10-m static DEM at ``(lon, lat)`` coordinates, ``NaN`` off the DEM.
+
+    This is the fallback for the points that the Point Query Service fails to
+    return an elevation for.
+
+    Parameters
+    ----------
+    coords : list of tuple
+        Coordinates in ``EPSG:4326``.
+
+    Returns
+    -------
+    numpy.ndarray
+        Elevations in meters, ``NaN`` for the points that fall outside the DEM
+        or on its nodata cells.
+    """
+    src = seamless.open_vrt(10)
+    lon, lat = np.array(coords, dtype="f8").reshape(-1, 2).T
+    x, y = pyproj.Transformer.from_crs(4326, src.crs, always_xy=True).transform(lon, lat)
+    elev = seamless.sample_points(src, x, y).astype("f8")
+    left, bottom, right, top = src.bounds
+    outside = (x < left) | (x >= right) | (y <= bottom) | (y > top)
+    if src.nodata is not None:
+        outside |= elev == src.nodata
+    elev[outside] = np.nan
+    return elev
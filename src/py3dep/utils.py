@@ -4,22 +4,31 @@ from __future__ import annotations
 
 import functools
 import heapq
+import itertools
 import warnings
-from typing import TYPE_CHECKING, Any, Callable, Literal, TypeVar, Union, overload
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Literal, NamedTuple, TypeVar, Union, overload
 
 import numpy as np
+import rioxarray  # noqa: F401
 import xarray as xr
 from numpy.typing import NDArray
 
 from py3dep.exceptions import InputTypeError, InputValueError, NoOutletError
 
 if TYPE_CHECKING:
+    from pathlib import Path
+
     import pyproj
 
     CRSTYPE = Union[int, str, pyproj.CRS]
 
 
-__all__ = ["deg2mpm", "fill_depressions"]
+__all__ = ["FlowRouting", "cell_spacing", "deg2mpm", "fill_depressions", "flow_routing"]
+
+EARTH_RADIUS = 6371008.8
+
+T = TypeVar("T")
 
 
 try:
@@ -32,7 +41,6 @@ except ImportError:
     has_numba = False
     prange = range
 
-    T = TypeVar("T")
     Func = Callable[..., T]
 
     def njit(
@@ -48,6 +56,13 @@ except ImportError:
         return decorator_njit
 
 
+try:
+    import dask.array as da
+
+    has_dask = True
+except ImportError:
+    has_dask = False
+
 FloatArray = NDArray[np.float32]
 BoolArray = NDArray[np.bool_]
 IntArray = NDArray[np.uint32]
@@ -55,44 +70,173 @@ DataArray = TypeVar("DataArray", FloatArray, xr.DataArray)
 
 
 @njit(
-    "boolean[:, ::1](f4[:, ::1], boolean[:, ::1], boolean[:, ::1], optional(uint32[::1]), optional(f4))",
+    "i8(f4[:, ::1], boolean[:, ::1], i4, optional(f4), boolean[:, ::1])", nogil=True, parallel=True
+)
+def _edge_queue(
+    elevtn: FloatArray,
+    done: BoolArray,
+    connectivity: np.int32,
+    elv_max: np.float32 | None,
+    out: BoolArray,
+) -> int:
+    """Mark the valid cells on the edge of the valid region in ``out`` and count them.
+
+    A valid cell is on the edge if it's on the array boundary or has a ``done``
+    neighbor and, if ``elv_max`` is given, it's not higher than ``elv_max``.
+    The rows are processed in parallel in a single pass without allocations.
+    """
+    nrow, ncol = done.shape
+    check_max = elv_max is not None
+    zmax = np.float32(0) if elv_max is None else elv_max
+    n_edge = 0
+    for r in prange(nrow):
+        for c in range(ncol):
+            edge = not done[r, c] and (not check_max or elevtn[r, c] <= zmax)
+            if edge and 0 < r < nrow - 1 and 0 < c < ncol - 1:
+                edge = done[r - 1, c] or done[r, c - 1] or done[r, c + 1] or done[r + 1, c]
+                if not edge and connectivity == 8:
+                    edge = (
+                        done[r - 1, c - 1]
+                        or done[r - 1, c + 1]
+                        or done[r + 1, c - 1]
+                        or done[r + 1, c + 1]
+                    )
+            out[r, c] = edge
+            n_edge += edge
+    return n_edge
+
+
+@njit(
+    "void(f4[:, ::1], boolean[:, ::1], i4, optional(uint32[::1]), optional(f4), boolean[:, ::1])",
     nogil=True,
-    parallel=True,
 )
-def _get_queued(
+def _get_queued(  # noqa: PLR0917
     elevtn: FloatArray,
-    not_done: BoolArray,
-    structure: BoolArray,
+    done: BoolArray,
+    connectivity: np.int32,
     idxs_pit: IntArray | None,
     elv_max: np.float32 | None,
-) -> BoolArray:
-    """Get queued cells for depression filling."""
-    nrow, ncol = elevtn.shape
+    out: BoolArray,
+) -> None:
+    """Get queued cells for depression filling in ``out``."""
     if idxs_pit is not None:
         # initiate queue with outlet cells
-        queued = np.full((nrow, ncol), False, dtype=np.bool_)
+        out[:, :] = False
         for idx in idxs_pit:
-            queued.flat[idx] = True
-        return queued
+            out.flat[idx] = True
+        return
     # initiate queue with edge cells
-    s = np.where(structure.ravel())[0]
-    queued = not_done.copy()
-    for r in prange(0, nrow):
-        for c in prange(0, ncol):
-            if ~not_done[r, c] or r in (0, nrow - 1) or c in (0, ncol - 1):
-                continue
-            a0 = not_done[slice(r - 1, r + 2), slice(c - 1, c + 2)].ravel()
-            if np.all(a0[s]):
-                queued[r, c] = False
-    if elv_max is not None:
-        queued = np.logical_and(queued, elevtn <= elv_max)
-        if not np.any(queued):
-            raise NoOutletError
-    return queued
+    if _edge_queue(elevtn, done, connectivity, elv_max, out) == 0 and elv_max is not None:
+        raise NoOutletError
+
+
+@njit("UniTuple(i8[::1], 2)(i4)", nogil=True)
+def _neighbors(connectivity: np.int32) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+    """Get the row and column offsets of the neighbors of a cell."""
+    if connectivity == 4:
+        return np.array([-1, 0, 0, 1], dtype=np.int64), np.array([0, -1, 1, 0], dtype=np.int64)
+    drs = np.array([-1, -1, -1, 0, 0, 1, 1, 1], dtype=np.int64)
+    return drs, np.array([-1, 0, 1, -1, 1, -1, 0, 1], dtype=np.int64)
+
+
+_SIGN_BIT = np.uint32(0x80000000)
+_ALL_BITS = np.uint32(0xFFFFFFFF)
+_INDEX_MASK = np.uint64(0xFFFFFFFF)
+
+
+@njit("u8(u4, i8)", nogil=True)
+def _queue_key(zbits: np.uint32, idx: np.int64) -> np.uint64:
+    """Pack the bits of a float32 elevation and a linear index into a key.
+
+    The bits are flipped so that the keys sort by elevation and then by index.
+    """
+    flipped = zbits ^ _ALL_BITS if zbits >= _SIGN_BIT else zbits | _SIGN_BIT
+    return (np.uint64(flipped) << np.uint64(32)) | np.uint64(idx)
+
+
+@njit("u4(u8)", nogil=True)
+def _key_bits(key: np.uint64) -> np.uint32:
+    """Get the bits of the float32 elevation of a queue key."""
+    zbits = np.uint32(key >> np.uint64(32))
+    return zbits ^ _SIGN_BIT if zbits >= _SIGN_BIT else zbits ^ _ALL_BITS
+
+
+@njit("void(u8[::1], i8, i8, u8)", nogil=True)
+def _sift_down(heap: NDArray[np.uint64], size: np.int64, pos: np.int64, key: np.uint64) -> None:
+    """Put a key at a position of a binary min-heap and move it down to its place."""
+    child = 2 * pos + 1
+    while child < size:
+        if child + 1 < size and heap[child + 1] < heap[child]:
+            child += 1
+        if key <= heap[child]:
+            break
+        heap[pos] = heap[child]
+        pos = child
+        child = 2 * pos + 1
+    heap[pos] = key
+
+
+@njit("Tuple((u8[::1], i8))(boolean[:, ::1], u4[::1])", nogil=True)
+def _seed_queue(seeds: BoolArray, zbits: NDArray[np.uint32]) -> tuple[NDArray[np.uint64], int]:
+    """Get a binary min-heap of the seed cells that has room for all the cells."""
+    heap = np.empty(seeds.size, dtype=np.uint64)
+    size = 0
+    for idx in np.flatnonzero(seeds):
+        heap[size] = _queue_key(zbits[idx], idx)
+        size += 1
+    for pos in range(size // 2 - 1, -1, -1):
+        _sift_down(heap, size, pos, heap[pos])
+    return heap, size
+
+
+@njit("Tuple((i8, i8))(u8[::1], i8, u4[::1], i8, u8, boolean)", nogil=True)
+def _queue_push(  # noqa: PLR0917
+    heap: NDArray[np.uint64],
+    size: np.int64,
+    fifo: NDArray[np.uint32],
+    tail: np.int64,
+    key: np.uint64,
+    flat: bool,
+) -> tuple[int, int]:
+    """Push a key to the FIFO, if ``flat``, or the heap and get their new sizes."""
+    if flat:
+        fifo[tail] = key & _INDEX_MASK
+        return size, tail + 1
+    pos = size
+    while pos > 0:
+        parent = (pos - 1) // 2
+        if heap[parent] <= key:
+            break
+        heap[pos] = heap[parent]
+        pos = parent
+    heap[pos] = key
+    return size + 1, tail
+
+
+@njit("Tuple((u8, i8, i8))(u8[::1], i8, u4[::1], i8, i8, u4[::1])", nogil=True)
+def _queue_pop(  # noqa: PLR0917
+    heap: NDArray[np.uint64],
+    size: np.int64,
+    fifo: NDArray[np.uint32],
+    head: np.int64,
+    tail: np.int64,
+    zbits: NDArray[np.uint32],
+) -> tuple[np.uint64, int, int]:
+    """Pop the next key, from the FIFO first, and get the new heap size and FIFO head.
+
+    The keys of the FIFO cells are made from their elevations in ``zbits``.
+    """
+    if head < tail:
+        idx = np.int64(fifo[head])
+        return _queue_key(zbits[idx], idx), size, head + 1
+    key = heap[0]
+    size -= 1
+    _sift_down(heap, size, 0, heap[size])
+    return key, size, head
 
 
 @njit(
-    "f4[:, ::1](f4[:, ::1], unicode_type, optional(uint32[::1]), f4, f4, optional(f4), i4)",
+    "f4[:, ::1](f4[:, ::1], unicode_type, optional(uint32[::1]), f4, f4, optional(f4), i4, optional(i8[::1]))",
     nogil=True,
 )
 def _fill_depressions(
@@ -103,38 +247,54 @@ def _fill_depressions(
     max_depth: np.float32,
     elv_max: np.float32 | None,
     connectivity: np.uint8,
+    order: NDArray[np.int64] | None,
 ) -> FloatArray:
-    """Fill local depressions in elevation data based on Wang and Liu (2006)."""
+    """Fill local depressions in elevation data based on Wang and Liu (2006).
+
+    The cells are processed with the improved priority-flood of Barnes et al. (2014):
+    the cells that are raised or lie on flats are processed from a FIFO before the
+    priority queue, which is a binary heap of packed ``(elevation, index)`` keys.
+    Since each cell is queued at most once, both are preallocated with one entry per cell.
+    With a positive ``max_depth``, the unfilled pits are queued below the current
+    elevation, so all the cells go through the heap to keep the order by elevation.
+    If ``order`` is given, the linear indices of the cells are written to it in the
+    order that they are processed, the rest of it is left as is.
+    """
     nrow, ncol = elevtn.shape
     delv = elevtn.copy()
     done = np.isnan(elevtn) if np.isnan(nodata) else np.isclose(elevtn, nodata)
 
-    struct = np.full((3, 3), True, dtype=np.bool_)
-    if connectivity == 4:
-        struct[0, 0], struct[-1, -1] = False, False
-        struct[0, -1], struct[-1, 0] = False, False
-
-    queued = _get_queued(elevtn, ~done, struct, idxs_pit, elv_max)
+    queued = np.empty((nrow, ncol), dtype=np.bool_)
+    _get_queued(elevtn, done, connectivity, idxs_pit, elv_max, queued)
 
-    # queue contains (elevation, row, col)
-    # boundary is included to favor non-boundary cells over boundary
-    # cells with same elevation
-    q = [(np.float32(0), np.uint32(0), np.uint32(0)) for _ in range(0)]
-    for r, c in zip(*np.where(queued)):
-        heapq.heappush(q, (np.float32(elevtn[r, c]), np.uint32(r), np.uint32(c)))
-    heapq.heapify(q)
+    # ties are broken by the linear index, i.e., row then column
+    elev_bits = elevtn.reshape(-1).view(np.uint32)
+    fill_bits = delv.reshape(-1).view(np.uint32)
+    heap, size = _seed_queue(queued, elev_bits)
 
     # restrict queue to global edge minimum (single outlet)
-    if outlets == "min":
-        q = [heapq.heappop(q)]
-        queued = np.full((nrow, ncol), False, dtype=np.bool_)
-        queued[q[0][-2], q[0][-1]] = True
+    if outlets == "min" and size > 0:
+        size = 1
+        queued[:, :] = False
+        queued.flat[heap[0] & _INDEX_MASK] = True
+
+    fifo = np.empty(nrow * ncol, dtype=np.uint32)
+    head = tail = 0
+    zbits = np.empty(1, dtype=np.uint32)
+    zval = zbits.view(np.float32)
 
     # loop over cells and neighbors with ascending cell elevation.
-    drs, dcs = np.where(struct)
-    drs, dcs = drs - 1, dcs - 1
-    while q:
-        z0, r0, c0 = heapq.heappop(q)
+    drs, dcs = _neighbors(connectivity)
+    n_done = 0
+    while head < tail or size > 0:
+        key, size, head = _queue_pop(heap, size, fifo, head, tail, fill_bits)
+        zbits[0] = _key_bits(key)
+        z0 = zval[0]
+        r0, c0 = divmod(np.int64(key & _INDEX_MASK), ncol)
+        done[r0, c0] = True
+        if order is not None:
+            order[n_done] = r0 * ncol + c0
+            n_done += 1
         for dr, dc in zip(drs, dcs):
             r = r0 + dr
             c = c0 + dc
@@ -146,19 +306,534 @@ def _fill_depressions(
             # if positive max_depth: don't fill when dz > max_depth
             if max_depth >= 0 and dz >= max_depth:
                 if not queued[r, c]:
-                    heapq.heappush(q, (np.float32(z1), np.uint32(r), np.uint32(c)))
+                    key = _queue_key(elev_bits[r * ncol + c], r * ncol + c)
+                    size, tail = _queue_push(heap, size, fifo, tail, key, False)
                     queued[r, c] = True
                 continue
             if dz > 0:
-                delv[r, c] += dz
+                delv[r, c] = z0
             # add to queue if not already in queue
-            if ~queued[r, c]:
-                heapq.heappush(q, (np.float32(delv[r, c]), np.uint32(r), np.uint32(c)))
+            if not queued[r, c]:
+                key = _queue_key(fill_bits[r * ncol + c], r * ncol + c)
+                size, tail = _queue_push(heap, size, fifo, tail, key, dz >= 0 and max_depth < 0)
                 queued[r, c] = True
             done[r, c] = True
     return delv
 
 
+# D8 directions in the ESRI (and pyflwdir) convention, clockwise from east
+_D8_CODES = np.array([1, 2, 4, 8, 16, 32, 64, 128], dtype=np.uint8)
+_D8_DR = np.array([0, 1, 1, 1, 0, -1, -1, -1], dtype=np.int64)
+_D8_DC = np.array([1, 1, 0, -1, -1, -1, 0, 1], dtype=np.int64)
+D8_PIT = 0
+D8_NODATA = 247
+
+
+@njit("Tuple((u1[:, ::1], i8[::1]))(f4[:, ::1], boolean[:, ::1], i8[::1], f8[::1], f8)", nogil=True)
+def _d8_directions(
+    filled: FloatArray,
+    valid: BoolArray,
+    order: NDArray[np.int64],
+    dx: NDArray[np.float64],
+    dy: float,
+) -> tuple[NDArray[np.uint8], NDArray[np.int64]]:
+    """Get the D8 flow directions and the linear indices of the downstream cells.
+
+    Each cell drains to its steepest downslope neighbor. The cells on flats drain
+    to their neighbor with the same elevation that the priority-flood reached
+    first, so the flow paths follow the flood back to the outlets and downstream
+    cells always come before their upstream cells in ``order``. Pits, outlets,
+    and the cells that the flood didn't reach have no downstream cell, i.e., -1.
+    The cell size along x, ``dx``, is given for each row, since it depends on
+    the latitude for geographic CRSs.
+    """
+    nrow, ncol = filled.shape
+    rank = np.full(nrow * ncol, -1, dtype=np.int64)
+    for k, idx in enumerate(order):
+        if idx >= 0:
+            rank[idx] = k
+    dist = np.empty((nrow, 8))
+    for r in range(nrow):
+        dist[r] = np.sqrt((_D8_DC * dx[r]) ** 2 + (_D8_DR * dy) ** 2)
+    flwdir = np.full((nrow, ncol), D8_NODATA, dtype=np.uint8)
+    downstream = np.full(nrow * ncol, -1, dtype=np.int64)
+    for idx in range(nrow * ncol):
+        r0, c0 = divmod(idx, ncol)
+        if not valid[r0, c0]:
+            continue
+        flwdir[r0, c0] = D8_PIT
+        if rank[idx] < 0:
+            continue
+        best, best_slope, best_rank = -1, 0.0, rank[idx]
+        for k in range(8):
+            r = r0 + _D8_DR[k]
+            c = c0 + _D8_DC[k]
+            if not (0 <= r < nrow and 0 <= c < ncol) or not valid[r, c]:
+                continue
+            slope = (filled[r0, c0] - filled[r, c]) / dist[r0, k]
+            if slope > best_slope:
+                best, best_slope = k, slope
+            elif best_slope == 0 and slope == 0 and 0 <= rank[r * ncol + c] < best_rank:
+                best, best_rank = k, rank[r * ncol + c]
+        if best >= 0:
+            flwdir[r0, c0] = _D8_CODES[best]
+            downstream[idx] = (r0 + _D8_DR[best]) * ncol + c0 + _D8_DC[best]
+    return flwdir, downstream
+
+
+@njit("Tuple((f8[:, ::1], u1[:, ::1]))(i8[::1], i8[::1], f8[:, ::1], f8)", nogil=True)
+def _accumulate(
+    order: NDArray[np.int64],
+    downstream: NDArray[np.int64],
+    weights: NDArray[np.float64],
+    threshold: float,
+) -> tuple[NDArray[np.float64], NDArray[np.uint8]]:
+    """Accumulate the weights downstream and get the Strahler order of the streams.
+
+    The cells are visited in the reverse of the priority-flood order, so each cell
+    is visited after all its upstream cells. The stream cells are the ones whose
+    accumulation is at least ``threshold``, the other cells have order 0.
+    """
+    acc = weights.copy()
+    strahler = np.zeros(weights.shape, dtype=np.uint8)
+    flat_acc = acc.reshape(-1)
+    flat_order = strahler.reshape(-1)
+    n_max = np.zeros(weights.size, dtype=np.uint8)
+    for k in range(order.size - 1, -1, -1):
+        idx = order[k]
+        if idx < 0:
+            continue
+        down = downstream[idx]
+        if down >= 0:
+            flat_acc[down] += flat_acc[idx]
+        if flat_acc[idx] < threshold:
+            flat_order[idx] = 0
+            continue
+        # the order goes up where two or more streams of the highest order meet
+        so = max(flat_order[idx] + (1 if n_max[idx] > 1 else 0), 1)
+        flat_order[idx] = so
+        if down < 0:
+            continue
+        if so > flat_order[down]:
+            flat_order[down] = so
+            n_max[down] = 1
+        elif so == flat_order[down]:
+            n_max[down] += 1
+    return acc, strahler
+
+
+@njit(
+    "Tuple((f4[:, ::1], i4[:, ::1], i8, i8[::1], i8[::1], f4[::1]))(f4[:, ::1], boolean[:, ::1], i8[::1], i4)",
+    nogil=True,
+)
+def _flood_tile(
+    elevtn: FloatArray,
+    valid: BoolArray,
+    idxs_outlet: NDArray[np.int64],
+    connectivity: np.int32,
+) -> tuple[FloatArray, NDArray[np.int32], int, NDArray[np.int64], NDArray[np.int64], FloatArray]:
+    """Priority-flood a tile from its outlets and perimeter and label the cells by their seed.
+
+    The cells that are flooded from the outlets get label 1 and each perimeter
+    cell that is not an outlet gets its own label, starting from 2, as do the
+    cells that are flooded from it. Unreached and invalid cells have label 0.
+    Whenever two cells with different labels meet, the spill elevation between
+    their labels, i.e., the larger of their filled elevations, is recorded.
+    """
+    nrow, ncol = elevtn.shape
+    fill = elevtn.copy()
+    labels = np.zeros((nrow, ncol), dtype=np.int32)
+    seeds = np.zeros((nrow, ncol), dtype=np.bool_)
+    seeds[0, :], seeds[-1, :], seeds[:, 0], seeds[:, -1] = True, True, True, True
+    seeds &= valid
+    for idx in idxs_outlet:
+        labels.flat[idx] = 1
+        seeds.flat[idx] = True
+    queued = seeds | ~valid
+    fill_bits = fill.reshape(-1).view(np.uint32)
+    heap, size = _seed_queue(seeds, elevtn.reshape(-1).view(np.uint32))
+    fifo = np.empty(nrow * ncol, dtype=np.uint32)
+    head = tail = 0
+
+    drs, dcs = _neighbors(connectivity)
+    edge_a = [np.int64(0) for _ in range(0)]
+    edge_b = [np.int64(0) for _ in range(0)]
+    edge_w = [np.float32(0) for _ in range(0)]
+    n_labels = 2
+    while head < tail or size > 0:
+        key, size, head = _queue_pop(heap, size, fifo, head, tail, fill_bits)
+        r0, c0 = divmod(np.int64(key & _INDEX_MASK), ncol)
+        z0 = fill[r0, c0]
+        lab = labels[r0, c0]
+        if lab == 0:
+            lab = n_labels
+            labels[r0, c0] = lab
+            n_labels += 1
+        for dr, dc in zip(drs, dcs):
+            r = r0 + dr
+            c = c0 + dc
+            if not (0 <= r < nrow and 0 <= c < ncol) or not valid[r, c]:
+                continue
+            lab1 = labels[r, c]
+            if lab1 != 0:
+                if lab1 != lab:
+                    edge_a.append(np.int64(lab))
+                    edge_b.append(np.int64(lab1))
+                    edge_w.append(max(z0, fill[r, c]))
+                continue
+            # perimeter cells that are still queued get their own label
+            if queued[r, c]:
+                continue
+            fill[r, c] = max(elevtn[r, c], z0)
+            labels[r, c] = lab
+            queued[r, c] = True
+            key = _queue_key(fill_bits[r * ncol + c], r * ncol + c)
+            size, tail = _queue_push(heap, size, fifo, tail, key, elevtn[r, c] <= z0)
+    return (
+        fill,
+        labels,
+        n_labels,
+        np.array(edge_a, dtype=np.int64),
+        np.array(edge_b, dtype=np.int64),
+        np.array(edge_w, dtype=np.float32),
+    )
+
+
+@njit("f4[::1](i8[::1], i8[::1], f4[::1])", nogil=True)
+def _spill_levels(
+    indptr: NDArray[np.int64], indices: NDArray[np.int64], weights: FloatArray
+) -> FloatArray:
+    """Get the lowest spill elevation from node 0 to all nodes of a graph (priority-flood)."""
+    n_nodes = len(indptr) - 1
+    levels = np.full(n_nodes, np.inf, dtype=np.float32)
+    done = np.zeros(n_nodes, dtype=np.bool_)
+    levels[0] = -np.inf
+    q = [(np.float32(-np.inf), np.int64(0))]
+    while q:
+        z0, n0 = heapq.heappop(q)
+        if done[n0]:
+            continue
+        done[n0] = True
+        for k in range(indptr[n0], indptr[n0 + 1]):
+            n1 = indices[k]
+            z1 = max(z0, weights[k])
+            if not done[n1] and z1 < levels[n1]:
+                levels[n1] = z1
+                heapq.heappush(q, (np.float32(z1), np.int64(n1)))
+    return levels
+
+
+class _TileFlood(NamedTuple):
+    """Outlets, number of labels, perimeter, and spill edges of a flooded tile."""
+
+    outlets: NDArray[np.int64]
+    n_labels: int
+    perimeter: dict[str, tuple[NDArray[np.int32], FloatArray]]
+    edges: tuple[NDArray[np.int64], NDArray[np.int64], FloatArray]
+
+
+def _tile_bounds(size: int, tile_size: int) -> list[tuple[int, int]]:
+    """Get the start and stop indices of the tiles along an axis."""
+    return [(i, min(i + tile_size, size)) for i in range(0, size, tile_size)]
+
+
+def _read_tile(
+    elevtn: Any, rows: tuple[int, int], cols: tuple[int, int], nodata: np.float32, halo: int
+) -> FloatArray:
+    """Read a tile of a 2D array with a halo that is padded with nodata beyond the array."""
+    nrow, ncol = elevtn.shape
+    (r0, r1), (c0, c1) = rows, cols
+    block = np.full((r1 - r0 + 2 * halo, c1 - c0 + 2 * halo), nodata, dtype=np.float32)
+    pr0, pr1 = max(r0 - halo, 0), min(r1 + halo, nrow)
+    pc0, pc1 = max(c0 - halo, 0), min(c1 + halo, ncol)
+    block[pr0 - r0 + halo : pr1 - r0 + halo, pc0 - c0 + halo : pc1 - c0 + halo] = np.asarray(
+        elevtn[pr0:pr1, pc0:pc1], dtype=np.float32
+    )
+    return block
+
+
+def _valid_cells(elevtn: FloatArray, nodata: np.float32) -> BoolArray:
+    """Get the cells that are not nodata."""
+    return ~np.isnan(elevtn) if np.isnan(nodata) else ~np.isclose(elevtn, nodata)
+
+
+def _edge_cells(valid: BoolArray, connectivity: int) -> BoolArray:
+    """Get the valid cells with an invalid neighbor in a tile with a halo of one cell."""
+    nrow, ncol = valid.shape
+    core = valid[1:-1, 1:-1]
+    interior = core.copy()
+    for dr, dc in itertools.product((-1, 0, 1), repeat=2):
+        if connectivity == 4 and dr != 0 and dc != 0:
+            continue
+        interior &= valid[1 + dr : nrow - 1 + dr, 1 + dc : ncol - 1 + dc]
+    return core & ~interior
+
+
+class _TiledFill:
+    """Priority-flood depression filling of a 2D array in tiles.
+
+    This is the parallel priority-flood of Barnes (2016). In the first pass,
+    each tile is flooded from its perimeter and outlets independently, and
+    the spill elevations between the labels of the cells that meet, within a
+    tile or across the boundaries of adjacent tiles, form a graph. The
+    lowest spill elevation of each label from the outlets is then found by
+    a priority-flood of this graph. In the second pass, each tile is flooded
+    again and its cells are raised to the spill elevations of their labels.
+    Only one tile per worker is in memory at a time.
+
+    Barnes, R., Lehman, C., Mulla, D. (2014). https://doi.org/10.1016/j.cageo.2013.04.024
+    Barnes, R. (2016). https://doi.org/10.1016/j.cageo.2016.07.001
+    """
+
+    def __init__(
+        self,
+        elevtn: Any,
+        row_bounds: list[tuple[int, int]],
+        col_bounds: list[tuple[int, int]],
+        *,
+        nodata: np.float32,
+        connectivity: int,
+        max_workers: int | None,
+    ) -> None:
+        self.elevtn = elevtn
+        self.row_bounds = row_bounds
+        self.col_bounds = col_bounds
+        self.nodata = nodata
+        self.connectivity = connectivity
+        self.max_workers = max_workers
+        self.tiles = list(itertools.product(range(len(row_bounds)), range(len(col_bounds))))
+        self.floods: dict[tuple[int, int], _TileFlood] = {}
+        self.levels: dict[tuple[int, int], FloatArray] = {}
+
+    def _map(self, func: Callable[[tuple[int, int]], T]) -> dict[tuple[int, int], T]:
+        """Apply a function to all tiles concurrently."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(self.tiles, executor.map(func, self.tiles)))
+
+    def _candidates(
+        self, tile: tuple[int, int], idxs_pit: NDArray[np.int64] | None, elv_max: np.float32 | None
+    ) -> tuple[FloatArray, NDArray[np.int64]]:
+        """Get a tile and the local linear indices of its candidate outlets."""
+        rows, cols = self.row_bounds[tile[0]], self.col_bounds[tile[1]]
+        padded = _read_tile(self.elevtn, rows, cols, self.nodata, 1)
+        block = np.ascontiguousarray(padded[1:-1, 1:-1])
+        valid = _valid_cells(padded, self.nodata)
+        ncol = self.elevtn.shape[1]
+        if idxs_pit is not None:
+            pr, pc = np.divmod(idxs_pit, ncol)
+            inside = (pr >= rows[0]) & (pr < rows[1]) & (pc >= cols[0]) & (pc < cols[1])
+            local = (pr[inside] - rows[0]) * block.shape[1] + pc[inside] - cols[0]
+            return block, np.unique(local[valid[1:-1, 1:-1].ravel()[local]])
+        outlet = _edge_cells(valid, self.connectivity)
+        if elv_max is not None:
+            outlet &= block <= elv_max
+        return block, np.flatnonzero(outlet).astype(np.int64)
+
+    def _global_index(self, tile: tuple[int, int], local: NDArray[np.int64]) -> NDArray[np.int64]:
+        """Convert the local linear indices of a tile to global ones."""
+        (r0, _), (c0, c1) = self.row_bounds[tile[0]], self.col_bounds[tile[1]]
+        lr, lc = np.divmod(local, c1 - c0)
+        return (lr + r0) * self.elevtn.shape[1] + lc + c0
+
+    def min_outlet(
+        self, idxs_pit: NDArray[np.int64] | None, elv_max: np.float32 | None
+    ) -> NDArray[np.int64]:
+        """Get the global linear index of the lowest candidate outlet, if any."""
+
+        def _min(tile: tuple[int, int]) -> tuple[float, int] | None:
+            block, local = self._candidates(tile, idxs_pit, elv_max)
+            if len(local) == 0:
+                return None
+            # ties are broken by the linear index, same as the single tile filling
+            idx = self._global_index(tile, local)
+            i = np.lexsort((idx, block.ravel()[local]))[0]
+            return float(block.ravel()[local[i]]), int(idx[i])
+
+        found = [m for m in self._map(_min).values() if m is not None]
+        return np.array([min(found)[1]] if found else [], dtype=np.int64)
+
+    def flood(self, outlets: NDArray[np.int64] | None, elv_max: np.float32 | None) -> int:
+        """Flood all tiles from their perimeters and the outlets and get the number of outlets.
+
+        If ``outlets`` is ``None``, the edge cells of the valid cells are used.
+        """
+        ncol = self.elevtn.shape[1]
+
+        def _flood(tile: tuple[int, int]) -> _TileFlood:
+            if outlets is None:
+                block, local = self._candidates(tile, None, elv_max)
+            else:
+                (r0, r1), (c0, c1) = self.row_bounds[tile[0]], self.col_bounds[tile[1]]
+                block = _read_tile(self.elevtn, (r0, r1), (c0, c1), self.nodata, 0)
+                pr, pc = np.divmod(outlets, ncol)
+                inside = (pr >= r0) & (pr < r1) & (pc >= c0) & (pc < c1)
+                local = ((pr[inside] - r0) * (c1 - c0) + pc[inside] - c0).astype(np.int64)
+                local = local[_valid_cells(block, self.nodata).ravel()[local]]
+            valid = _valid_cells(block, self.nodata)
+            fill, labels, n_labels, *edges = _flood_tile(
+                block, valid, local, np.int32(self.connectivity)
+            )
+            perimeter = {
+                "top": (labels[0], fill[0]),
+                "bottom": (labels[-1], fill[-1]),
+                "left": (labels[:, 0], fill[:, 0]),
+                "right": (labels[:, -1], fill[:, -1]),
+            }
+            return _TileFlood(local, int(n_labels), perimeter, tuple(edges))
+
+        self.floods = self._map(_flood)
+        return sum(len(f.outlets) for f in self.floods.values())
+
+    def _boundary_edges(
+        self,
+        side_a: list[tuple[NDArray[np.int64], FloatArray]],
+        side_b: list[tuple[NDArray[np.int64], FloatArray]],
+    ) -> list[tuple[NDArray[np.int64], NDArray[np.int64], FloatArray]]:
+        """Get the spill edges between the cells on the two sides of a tile boundary."""
+        lab_a = np.concatenate([lab for lab, _ in side_a])
+        lab_b = np.concatenate([lab for lab, _ in side_b])
+        fill_a = np.concatenate([f for _, f in side_a])
+        fill_b = np.concatenate([f for _, f in side_b])
+        n = len(lab_a)
+        edges = []
+        for shift in (0,) if self.connectivity == 4 else (-1, 0, 1):
+            ia = np.arange(max(0, -shift), min(n, n - shift))
+            la, lb = lab_a[ia], lab_b[ia + shift]
+            keep = (la >= 0) & (lb >= 0) & (la != lb)
+            weight = np.maximum(fill_a[ia], fill_b[ia + shift])
+            edges.append((la[keep], lb[keep], weight[keep]))
+        return edges
+
+    def solve(self) -> None:
+        """Get the spill elevation of all labels from the graph of the tiles' spill edges."""
+        # node 0 is the outlets and the labels of each tile are numbered consecutively
+        base, n_nodes = {}, 1
+        for tile in self.tiles:
+            base[tile] = n_nodes - 2
+            n_nodes += self.floods[tile].n_labels - 2
+
+        def _nodes(tile: tuple[int, int], labels: NDArray[Any]) -> NDArray[np.int64]:
+            labels = labels.astype(np.int64)
+            return np.where(labels == 0, -1, np.where(labels == 1, 0, labels + base[tile]))
+
+        edges = []
+        for tile in self.tiles:
+            ea, eb, ew = self.floods[tile].edges
+            edges.append((_nodes(tile, ea), _nodes(tile, eb), ew))
+
+        def _side(tile: tuple[int, int], side: str) -> tuple[NDArray[np.int64], FloatArray]:
+            labels, fill = self.floods[tile].perimeter[side]
+            return _nodes(tile, labels), fill
+
+        n_rows, n_cols = len(self.row_bounds), len(self.col_bounds)
+        for j in range(n_cols - 1):
+            left = [_side((i, j), "right") for i in range(n_rows)]
+            right = [_side((i, j + 1), "left") for i in range(n_rows)]
+            edges.extend(self._boundary_edges(left, right))
+        for i in range(n_rows - 1):
+            top = [_side((i, j), "bottom") for j in range(n_cols)]
+            bottom = [_side((i + 1, j), "top") for j in range(n_cols)]
+            edges.extend(self._boundary_edges(top, bottom))
+
+        src = np.concatenate([e[0] for e in edges] + [e[1] for e in edges])
+        dst = np.concatenate([e[1] for e in edges] + [e[0] for e in edges])
+        weights = np.concatenate([e[2] for e in edges] * 2).astype(np.float32)
+        order = np.argsort(src, kind="stable")
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(src, minlength=n_nodes))
+        levels = _spill_levels(indptr, dst[order], weights[order])
+
+        for tile in self.tiles:
+            n_labels = self.floods[tile].n_labels
+            tile_levels = np.empty(n_labels, dtype=np.float32)
+            tile_levels[0], tile_levels[1] = np.inf, -np.inf
+            tile_levels[2:] = levels[np.arange(2, n_labels) + base[tile]]
+            self.levels[tile] = tile_levels
+
+    def fill_tile(self, block: FloatArray, tile: tuple[int, int]) -> FloatArray:
+        """Flood a tile again and raise its cells to the spill elevations of their labels."""
+        block = np.ascontiguousarray(block, dtype=np.float32)
+        valid = _valid_cells(block, self.nodata)
+        fill, labels, *_ = _flood_tile(
+            block, valid, self.floods[tile].outlets, np.int32(self.connectivity)
+        )
+        levels = self.levels[tile][labels]
+        # unreached cells are not filled, same as the single tile filling
+        return np.where(np.isposinf(levels), block, np.maximum(fill, levels))
+
+    def fill(self, out: FloatArray) -> FloatArray:
+        """Fill all tiles concurrently into an output array."""
+
+        def _fill(tile: tuple[int, int]) -> None:
+            rows, cols = self.row_bounds[tile[0]], self.col_bounds[tile[1]]
+            block = _read_tile(self.elevtn, rows, cols, self.nodata, 0)
+            out[rows[0] : rows[1], cols[0] : cols[1]] = self.fill_tile(block, tile)
+
+        self._map(_fill)
+        return out
+
+    def fill_dask(self) -> Any:
+        """Fill all tiles lazily as the blocks of a dask array."""
+        chunks = (
+            tuple(r1 - r0 for r0, r1 in self.row_bounds),
+            tuple(c1 - c0 for c0, c1 in self.col_bounds),
+        )
+        elevtn = self.elevtn.rechunk(chunks)
+        return elevtn.map_blocks(
+            lambda block, block_id=None: self.fill_tile(block, block_id),
+            dtype=np.float32,
+            meta=np.array((), dtype=np.float32),
+        )
+
+
+def _fill_tiled(
+    elevtn: Any,
+    outlets: Literal["edge", "min"],
+    idxs_pit: IntArray | None,
+    nodata: np.float32,
+    *,
+    elv_max: np.float32 | None,
+    connectivity: int,
+    tile_size: int | None,
+    max_workers: int | None,
+    out: FloatArray | None,
+) -> Any:
+    """Fill depressions of a numpy, memory-mapped, or dask array in tiles."""
+    is_dask = has_dask and isinstance(elevtn, da.Array)
+    nrow, ncol = elevtn.shape
+    if tile_size is not None:
+        if not isinstance(tile_size, int) or tile_size < 1:
+            raise InputTypeError("tile_size", "positive int")
+        row_bounds, col_bounds = _tile_bounds(nrow, tile_size), _tile_bounds(ncol, tile_size)
+    else:
+        row_bounds, col_bounds = (
+            list(zip(np.cumsum((0, *c[:-1])).tolist(), np.cumsum(c).tolist()))
+            for c in elevtn.chunks
+        )
+    tiled = _TiledFill(
+        elevtn,
+        row_bounds,
+        col_bounds,
+        nodata=nodata,
+        connectivity=connectivity,
+        max_workers=max_workers,
+    )
+
+    pits = None if idxs_pit is None else idxs_pit.astype(np.int64)
+    outlet_idx = tiled.min_outlet(pits, elv_max) if outlets == "min" else pits
+    n_outlets = tiled.flood(outlet_idx, None if pits is not None else elv_max)
+    if n_outlets == 0 and pits is None and elv_max is not None:
+        raise NoOutletError
+    tiled.solve()
+    if is_dask:
+        return tiled.fill_dask()
+    if out is None:
+        out = np.empty((nrow, ncol), dtype=np.float32)
+    elif out.shape != (nrow, ncol) or out.dtype != np.float32:
+        raise InputTypeError("out", "float32 array with the same shape as elevtn")
+    return tiled.fill(out)
+
+
 def fill_depressions(
     elevtn: DataArray,
     outlets: Literal["edge", "min"] = "min",
@@ -167,6 +842,10 @@ def fill_depressions(
     max_depth: float = -1.0,
     elv_max: float | None = None,
     connectivity: Literal[4, 8] = 8,
+    *,
+    tile_size: int | None = None,
+    max_workers: int | None = None,
+    out: FloatArray | None = None,
 ) -> DataArray:
     """Fill local depressions in elevation data based on Wang and Liu (2006).
 
@@ -189,8 +868,9 @@ def fill_depressions(
 
     Parameters
     ----------
-    elevtn: numpy.ndarray or xarray.DataArray
-        elevation raster as a 2D ``numpy.ndarray`` or ``xarray.DataArray``.
+    elevtn: numpy.ndarray, dask.array.Array, or xarray.DataArray
+        elevation raster as a 2D ``numpy.ndarray``, ``dask.array.Array``, or
+        ``xarray.DataArray``.
     outlets: {"edge", "min}, optional
         Initial basin outlet(s) at the edge of all cells ('edge')
         or only the minimum elevation edge cell ('min'; default)
@@ -208,17 +888,49 @@ def fill_depressions(
         By default ``None``.
     connectivity: {4, 8}, optional
         Number of neighboring cells to consider, defaults to 8.
+    tile_size: int, optional
+        Fill the depressions in tiles of ``tile_size`` by ``tile_size`` cells
+        that are processed in parallel, see the notes below. Defaults to ``None``,
+        i.e., the whole array is filled at once, unless it's a dask array in which
+        case its chunks are used as the tiles.
+    max_workers: int, optional
+        Maximum number of tiles that are processed concurrently, defaults to
+        the number of CPUs. It's only used for tiled filling.
+    out: numpy.ndarray, optional
+        A float32 array with the same shape as ``elevtn``, e.g., a writable
+        ``numpy.memmap``, for writing the output of a tiled filling into.
+        It's only used for tiled filling of a ``numpy.ndarray``.
 
     Returns
     -------
     elevtn_out: numpy.ndarray
-        Depression filled elevation with type float32.
+        Depression filled elevation with type float32. For dask arrays, the
+        output is a lazy dask array.
+
+    Notes
+    -----
+    The depressions are filled using the improved priority-flood of Barnes et al.
+    (2014) whose queues are preallocated, so in addition to the input and output
+    arrays, filling takes 14 bytes per cell. Arrays with :math:`2^{32}` cells
+    or more must be filled in tiles.
+
+    Tiled filling gives the same result as filling the whole array at once
+    and it's based on the parallel priority-flood of Barnes (2016), i.e.,
+    each tile is filled independently and then the spill elevations across
+    the tile boundaries are resolved using a small graph of the tiles' outlets.
+    Since only a few tiles are in memory at a time, it can be used for arrays
+    that are larger than memory, e.g., dask-backed or memory-mapped arrays.
+    It doesn't support ``max_depth``.
+
+    Barnes, R., Lehman, C., Mulla, D. (2014). https://doi.org/10.1016/j.cageo.2013.04.024
+    Barnes, R. (2016). https://doi.org/10.1016/j.cageo.2016.07.001
     """
     if not has_numba:
         warnings.warn(
             "Numba not installed. Using very slow pure python version.", UserWarning, stacklevel=2
         )
-    if not isinstance(elevtn, (np.ndarray, xr.DataArray)):
+    array_types = (np.ndarray, xr.DataArray, da.Array) if has_dask else (np.ndarray, xr.DataArray)
+    if not isinstance(elevtn, array_types):
         raise InputTypeError("elevtn", "2D numpy.ndarray or xarray.DataArray")
     if elevtn.ndim != 2:
         raise InputTypeError("elevtn", "2D numpy.ndarray or xarray.DataArray")
@@ -229,20 +941,193 @@ def fill_depressions(
     if idxs_pit is not None:  # noqa: SIM102
         if not isinstance(elevtn, np.ndarray) and idxs_pit.ndim != 1:
             raise InputTypeError("idxs_pit", "1D numpy.ndarray")
-    _elevtn = np.asarray(elevtn, dtype=np.float32)
     _idxs_pit = None if idxs_pit is None else np.asarray(idxs_pit, dtype=np.uint32)
     _nodata = np.float32(nodata)
     _max_depth = np.float32(max_depth)
     _elv_max = None if elv_max is None else np.float32(elv_max)
     _connectivity = np.uint8(connectivity)
-    corrected = _fill_depressions(
-        _elevtn, outlets, _idxs_pit, _nodata, _max_depth, _elv_max, _connectivity
-    )
+    data = elevtn.data if isinstance(elevtn, xr.DataArray) else elevtn
+    is_dask = has_dask and isinstance(data, da.Array)
+    if tile_size is None and not is_dask and data.size >= 2**32:
+        raise InputTypeError("tile_size", "int for arrays with 2**32 cells or more")
+    if tile_size is not None or is_dask:
+        if max_depth >= 0:
+            raise InputTypeError("max_depth", "negative float for tiled filling")
+        corrected = _fill_tiled(
+            data,
+            outlets,
+            _idxs_pit,
+            _nodata,
+            elv_max=_elv_max,
+            connectivity=int(connectivity),
+            tile_size=tile_size,
+            max_workers=max_workers,
+            out=out,
+        )
+    else:
+        corrected = _fill_depressions(
+            np.asarray(elevtn, dtype=np.float32),
+            outlets,
+            _idxs_pit,
+            _nodata,
+            _max_depth,
+            _elv_max,
+            _connectivity,
+            None,
+        )
     if isinstance(elevtn, xr.DataArray):
         return elevtn.copy(data=corrected)
     return corrected
 
 
+class FlowRouting(NamedTuple):
+    """Depression-filled elevation, D8 flow direction, flow accumulation, and streams.
+
+    ``flwdir`` follows the ESRI convention that is also used by ``pyflwdir``:
+    1, 2, 4, ..., 128 for east, south-east, south, ..., north-east,
+    ``D8_PIT`` (0) for pits and outlets, and ``D8_NODATA`` (247) for nodata cells.
+    ``streams`` is the Strahler order of the stream cells and 0 elsewhere,
+    or ``None`` if no threshold was given.
+    """
+
+    filled: Any
+    flwdir: Any
+    accumulation: Any
+    streams: Any
+
+
+def cell_spacing(da: xr.DataArray) -> tuple[xr.DataArray | float, float]:
+    """Get the signed spacing of the cells of a 2D DataArray along x and y in meters.
+
+    For geographic CRSs, the spacing along x depends on the latitude, so it's
+    a DataArray along the y dimension. Without a CRS, the spacing is in the
+    units of the coordinates, and it's 1 along a dimension without coordinates
+    or with a single cell.
+
+    Parameters
+    ----------
+    da : xarray.DataArray
+        A 2D DataArray with ``(y, x)`` dimensions.
+
+    Returns
+    -------
+    tuple
+        Spacing along x and y.
+    """
+    spacing = []
+    for dim in da.dims[::-1]:
+        coord = da[dim] if dim in da.coords else None
+        spacing.append(float(coord[1] - coord[0]) if coord is not None and coord.size > 1 else 1.0)
+    dx, dy = spacing
+    crs = da.rio.crs
+    if crs is not None and crs.is_geographic:
+        to_meter = np.deg2rad(1) * EARTH_RADIUS
+        return dx * to_meter * np.cos(np.deg2rad(da[da.dims[0]])), dy * to_meter
+    factor = 1.0 if crs is None else crs.linear_units_factor[1]
+    return dx * factor, dy * factor
+
+
+def flow_routing(
+    elevtn: DataArray,
+    threshold: float | None = None,
+    *,
+    outlets: Literal["edge", "min"] = "edge",
+    idxs_pit: IntArray | None = None,
+    nodata: float = np.nan,
+    elv_max: float | None = None,
+    weights: NDArray[np.floating] | None = None,
+) -> FlowRouting:
+    """Get the D8 flow direction, flow accumulation, and streams of a DEM.
+
+    The depressions are filled first, as in :func:`fill_depressions`, and the
+    order in which the priority-flood processes the cells is reused for routing
+    the flow, so no separate topological sort of the flow directions is needed.
+    Each cell drains to its steepest downslope neighbor on the filled DEM, and
+    the cells on flats drain along the path of the flood towards the outlets.
+
+    Parameters
+    ----------
+    elevtn: numpy.ndarray or xarray.DataArray
+        Elevation raster as a 2D ``numpy.ndarray`` or ``xarray.DataArray``,
+        e.g., the output of ``get_dem`` or ``elevation_bygrid``. The depressions
+        don't need to be filled beforehand.
+    threshold: float, optional
+        Minimum flow accumulation of the stream cells. Defaults to ``None``,
+        i.e., the streams are not extracted.
+    outlets: {"edge", "min}, optional
+        Outlets at the edge of all valid cells ('edge'; default) or only at the
+        minimum elevation edge cell ('min').
+    idxs_pit: 1D array of int, optional
+        Linear indices of outlet cells, if any, defaults to None.
+    nodata: float, optional
+        nodata value, defaults to ``numpy.nan``.
+    elv_max, float, optional
+        Maximum elevation for outlets, only in combination with ``outlets='edge'``.
+        By default ``None``.
+    weights: numpy.ndarray, optional
+        Weights of the cells, e.g., runoff, with the same shape as ``elevtn``
+        for a weighted flow accumulation. Defaults to ``None``, i.e., the flow
+        accumulation is the number of upstream cells including the cell itself.
+
+    Returns
+    -------
+    FlowRouting
+        Filled elevation (float32), flow direction (uint8), flow accumulation
+        (float64, ``NaN`` at nodata cells), and Strahler order of the streams
+        (uint8). They have the same type as ``elevtn``. For ``xarray.DataArray``
+        the slopes are computed using the cell size in meters from its coordinates
+        and CRS, see :func:`cell_spacing`.
+    """
+    if not isinstance(elevtn, (np.ndarray, xr.DataArray)) or elevtn.ndim != 2:
+        raise InputTypeError("elevtn", "2D numpy.ndarray or xarray.DataArray")
+    if outlets not in ("edge", "min"):
+        raise InputValueError("outlets", ("edge", "min"))
+    if elevtn.size >= 2**32:
+        raise InputTypeError("elevtn", "array with less than 2**32 cells")
+    data = np.ascontiguousarray(elevtn, dtype=np.float32)
+    _nodata = np.float32(nodata)
+    valid = _valid_cells(data, _nodata)
+    order = np.full(data.size, -1, dtype=np.int64)
+    filled = _fill_depressions(
+        data,
+        outlets,
+        None if idxs_pit is None else np.asarray(idxs_pit, dtype=np.uint32),
+        _nodata,
+        np.float32(-1),
+        None if elv_max is None else np.float32(elv_max),
+        np.int32(8),
+        order,
+    )
+    if isinstance(elevtn, xr.DataArray):
+        dx, dy = cell_spacing(elevtn)
+    else:
+        dx, dy = 1.0, 1.0
+    dx = np.abs(np.broadcast_to(np.asarray(dx, dtype=np.float64), (data.shape[0],)))
+    flwdir, downstream = _d8_directions(filled, valid, order, np.ascontiguousarray(dx), abs(dy))
+    if weights is None:
+        weights = valid.astype(np.float64)
+    else:
+        weights = np.where(valid, np.asarray(weights, dtype=np.float64), 0.0)
+    acc, strahler = _accumulate(
+        order, downstream, weights, np.inf if threshold is None else float(threshold)
+    )
+    acc[~valid] = np.nan
+    if not isinstance(elevtn, xr.DataArray):
+        return FlowRouting(filled, flwdir, acc, None if threshold is None else strahler)
+
+    def like(arr: NDArray[Any], name: str, fill_value: float) -> xr.DataArray:
+        out = elevtn.copy(data=arr)
+        out.name, out.attrs = name, {}
+        return out.rio.write_nodata(fill_value)
+
+    return FlowRouting(
+        elevtn.copy(data=filled),
+        like(flwdir, "flwdir", D8_NODATA),
+        like(acc, "accumulation", np.nan),
+        None if threshold is None else like(strahler, "streams", 0),
+    )
+
+
 def deg2mpm(slope: xr.DataArray) -> xr.DataArray:
     """Convert slope from degrees to meter/meter.
 
@@ -290,3 +1175,25 @@ def rename_layers(
     else:
         ds = ds.rename({n: rename[str(n)] for n in ds})
     return ds
+
+
+def save_netcdf(ds: xr.DataArray | xr.Dataset, fpath: Path) -> Path:
+    """Save to a netCDF file atomically, so an interrupted write leaves no partial file."""
+    tmp = fpath.with_name(f"{fpath.name}.part")
+    try:
+        ds.to_netcdf(tmp)
+        tmp.replace(fpath)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return fpath
+
+
+def is_valid_netcdf(fpath: Path) -> bool:
+    """Check if a netCDF file exists and can be opened."""
+    if not fpath.is_file():
+        return False
+    try:
+        with xr.open_dataset(fpath) as ds:
+            return len(ds.data_vars) > 0
+    except (OSError, ValueError):
+        return False
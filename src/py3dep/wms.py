@@ -0,0 +1,619 @@
+"""Tiled access to the dynamic 3DEP layers of the WMS service."""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple, Union
+
+import defusedxml.ElementTree as ETree
+import numpy as np
+import pyproj
+import rasterio
+import rasterio.transform
+import rasterio.windows
+import rioxarray as rxr
+import xarray as xr
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+from shapely import LineString
+
+import async_retriever as ar
+from py3dep.exceptions import (
+    InputTypeError,
+    InvalidTileError,
+    ServiceUnavailableError,
+    TileDownloadError,
+)
+from pygeoogc import utils as ogc_utils
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+    from rasterio.io import DatasetWriter
+
+    CRSTYPE = Union[int, str, pyproj.CRS]
+
+__all__ = [
+    "LAYERS",
+    "MAX_RETRIES",
+    "TILE_SIZE",
+    "Capabilities",
+    "Mosaic",
+    "Tile",
+    "cached_capabilities",
+    "clear_capabilities",
+    "get_capabilities",
+    "get_tiled",
+    "grid_shape",
+    "parse_capabilities",
+    "plan_tiles",
+    "read_tile",
+    "store_capabilities",
+    "tile_windows",
+]
+
+TILE_SIZE = 2048
+MAX_RETRIES = 3
+EXPIRE_AFTER = 60 * 60 * 24 * 7  # 1 week
+LAYERS = [
+    "DEM",
+    "Hillshade Gray",
+    "Aspect Degrees",
+    "Aspect Map",
+    "GreyHillshade_elevationFill",
+    "Hillshade Multidirectional",
+    "Slope Map",
+    "Slope Degrees",
+    "Hillshade Elevation Tinted",
+    "Height Ellipsoidal",
+    "Contour 25",
+    "Contour Smoothed 25",
+]
+PINNED_CRS = [
+    "epsg:4326",
+    "epsg:3576",
+    "epsg:3571",
+    "epsg:3575",
+    "epsg:3857",
+    "epsg:3572",
+    "crs:84",
+    "epsg:3573",
+    "epsg:3574",
+]
+
+
+class Capabilities(NamedTuple):
+    """Valid CRSs and layers, as name to title mapping, of a WMS service."""
+
+    crs: list[str]
+    layers: dict[str, str]
+
+
+CAPABILITIES_PARAMS = {"service": "wms", "request": "GetCapabilities"}
+_CAPABILITIES: dict[str, tuple[float, Capabilities]] = {}
+_CAPABILITIES_LOCK = threading.Lock()
+
+
+def _capabilities_file() -> Path:
+    return Path("cache", "3dep_wms_capabilities.json")
+
+
+def _load_capabilities(url: str) -> tuple[float, Capabilities] | None:
+    """Load the capabilities of a service from the disk cache, if any."""
+    try:
+        entry = json.loads(_capabilities_file().read_text())[url]
+        return entry["time"], Capabilities(entry["crs"], entry["layers"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save_capabilities(url: str, fetched: float, caps: Capabilities) -> None:
+    """Persist the capabilities of a service to the disk cache."""
+    fpath = _capabilities_file()
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        entries = json.loads(fpath.read_text())
+    except (OSError, ValueError):
+        entries = {}
+    entries[url] = {"time": fetched, "crs": caps.crs, "layers": caps.layers}
+    tmp = fpath.with_name(f"{fpath.name}.{os.getpid()}.{threading.get_ident()}")
+    tmp.write_text(json.dumps(entries))
+    tmp.replace(fpath)
+
+
+def parse_capabilities(url: str, text: str) -> Capabilities:
+    """Get the valid CRSs and layers from a GetCapabilities response.
+
+    Parameters
+    ----------
+    url : str
+        The WMS service URL, for the error message.
+    text : str
+        The GetCapabilities response.
+
+    Returns
+    -------
+    Capabilities
+        Named tuple of the valid CRSs and layers (name to title mapping).
+    """
+    ns = "{http://www.opengis.net/wms}"
+    try:
+        root = ETree.fromstring(text)
+    except ETree.ParseError as ex:
+        raise ServiceUnavailableError(url) from ex
+    crs = [t.text.lower() for t in root.findall(f"{ns}Capability/{ns}Layer/{ns}CRS") if t.text]
+    layers = {}
+    for lyr in root.iter(f"{ns}Layer"):
+        name, title = lyr.find(f"{ns}Name"), lyr.find(f"{ns}Title")
+        if name is not None and name.text:
+            layers[name.text] = title.text if title is not None and title.text else name.text
+    return Capabilities(crs, layers)
+
+
+def _fetch_capabilities(url: str) -> Capabilities:
+    """Get the valid CRSs and layers from a single GetCapabilities request."""
+    kwds = {"params": CAPABILITIES_PARAMS}
+    return parse_capabilities(url, ar.retrieve_text([url], [kwds], ssl=False)[0])
+
+
+def _pinned_capabilities() -> Capabilities:
+    """Get the capabilities of the 3DEP service that are shipped with Py3DEP."""
+    names = ["None" if lyr == "DEM" else lyr for lyr in LAYERS]
+    return Capabilities(PINNED_CRS.copy(), {f"3DEPElevation:{n}": n for n in names})
+
+
+def get_capabilities(url: str, refresh: bool = False) -> Capabilities:
+    """Get the valid CRSs and layers of a WMS service with caching.
+
+    The capabilities are fetched once per process, kept in memory, and persisted
+    to ``./cache/3dep_wms_capabilities.json``, so the other processes reuse them.
+    They are considered fresh for ``HYRIVER_CACHE_EXPIRE`` seconds (one week by
+    default, never expire if it's negative) and if a refresh fails, the stale
+    entry is used instead. If the ``PY3DEP_WMS_OFFLINE`` environment variable
+    is set to ``true``, the service is never requested: a cached entry is used
+    regardless of its age and if there is none, the capabilities of the 3DEP
+    service that are pinned in Py3DEP are returned.
+
+    Parameters
+    ----------
+    url : str
+        The WMS service URL.
+    refresh : bool, optional
+        Request the capabilities even if they are cached, defaults to ``False``.
+        It's ignored in the offline mode.
+
+    Returns
+    -------
+    Capabilities
+        Named tuple of the valid CRSs and layers (name to title mapping).
+    """
+    with _CAPABILITIES_LOCK:
+        caps, stale = _cached_capabilities(url, refresh)
+        if caps is not None:
+            return caps
+        try:
+            caps = _fetch_capabilities(url)
+        except Exception:
+            if stale is None:
+                raise
+            return stale
+        _store_capabilities(url, caps)
+        return caps
+
+
+def _cached_capabilities(
+    url: str, refresh: bool
+) -> tuple[Capabilities | None, Capabilities | None]:
+    """Get the usable cached capabilities of a service and its stale entry, if any.
+
+    The first item is ``None`` when the service has to be requested.
+    """
+    offline = os.getenv("PY3DEP_WMS_OFFLINE", "false").lower() == "true"
+    disabled = os.getenv("HYRIVER_CACHE_DISABLE", "false").lower() == "true"
+    expire_after = int(os.getenv("HYRIVER_CACHE_EXPIRE", EXPIRE_AFTER))
+    cached = None if disabled and not offline else _CAPABILITIES.get(url)
+    if cached is None and (offline or not disabled):
+        cached = _load_capabilities(url)
+    if offline:
+        return (cached[1] if cached is not None else _pinned_capabilities()), None
+    if cached is None:
+        return None, None
+    # A negative expiration means the cache never expires, as in the rest of HyRiver
+    if not refresh and (expire_after < 0 or time.time() - cached[0] < expire_after):
+        _CAPABILITIES[url] = cached
+        return cached[1], cached[1]
+    return None, cached[1]
+
+
+def cached_capabilities(
+    url: str, refresh: bool = False
+) -> tuple[Capabilities | None, Capabilities | None]:
+    """Get the usable cached capabilities of a WMS service and its stale entry, if any.
+
+    This is the cache lookup of :func:`get_capabilities` for the clients that
+    request the capabilities themselves, e.g., asynchronously. It reads the
+    on-disk cache, so it shouldn't be called on an event loop.
+
+    Parameters
+    ----------
+    url : str
+        The WMS service URL.
+    refresh : bool, optional
+        Ignore the fresh cached entry, defaults to ``False``.
+
+    Returns
+    -------
+    tuple
+        The cached capabilities, ``None`` if the service has to be requested,
+        and the stale entry to use if the request fails, if any.
+    """
+    with _CAPABILITIES_LOCK:
+        return _cached_capabilities(url, refresh)
+
+
+def store_capabilities(url: str, caps: Capabilities) -> None:
+    """Keep the capabilities of a WMS service in the in-memory and on-disk caches.
+
+    Parameters
+    ----------
+    url : str
+        The WMS service URL.
+    caps : Capabilities
+        The freshly requested capabilities of the service.
+    """
+    with _CAPABILITIES_LOCK:
+        _store_capabilities(url, caps)
+
+
+def _store_capabilities(url: str, caps: Capabilities) -> None:
+    """Keep freshly requested capabilities in memory and on disk."""
+    fetched = time.time()
+    _CAPABILITIES[url] = (fetched, caps)
+    if os.getenv("HYRIVER_CACHE_DISABLE", "false").lower() != "true":
+        _save_capabilities(url, fetched, caps)
+
+
+def clear_capabilities() -> None:
+    """Clear the in-memory and on-disk caches of WMS capabilities."""
+    with _CAPABILITIES_LOCK:
+        _CAPABILITIES.clear()
+        _capabilities_file().unlink(missing_ok=True)
+
+
+class Tile(NamedTuple):
+    """A tile of the output grid for a single layer."""
+
+    layer: str
+    window: Window
+    bbox: tuple[float, float, float, float]
+
+
+def grid_shape(
+    bbox: tuple[float, float, float, float], resolution: float, crs: CRSTYPE
+) -> tuple[int, int]:
+    """Get the number of rows and columns of a bbox at a resolution in meters.
+
+    The distances are geodesic and measured the same way as ``WMS.getmap_bybox``,
+    so the tiled and non-tiled requests have the same output shape.
+
+    Parameters
+    ----------
+    bbox : tuple
+        A bounding box; (west, south, east, north).
+    resolution : float
+        The target resolution in meters.
+    crs : str, int, or pyproj.CRS
+        The spatial reference of the bbox.
+
+    Returns
+    -------
+    tuple of int
+        Number of rows (height) and columns (width).
+    """
+    geod = pyproj.Geod(ellps="GRS80")
+    xmin, ymin, xmax, ymax = ogc_utils.match_crs(bbox, crs, 4326)
+    x_dist = geod.geometry_length(LineString([(xmin, ymin), (xmax, ymin)]))
+    y_dist = geod.geometry_length(LineString([(xmin, ymin), (xmin, ymax)]))
+    return max(math.ceil(y_dist / resolution), 1), max(math.ceil(x_dist / resolution), 1)
+
+
+def tile_windows(height: int, width: int, tile_size: int = TILE_SIZE) -> list[Window]:
+    """Split a grid into square tiles of at most ``tile_size`` pixels on each side."""
+    if not isinstance(tile_size, int) or tile_size < 1:
+        raise InputTypeError("tile_size", "positive int")
+    return [
+        Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+        for row in range(0, height, tile_size)
+        for col in range(0, width, tile_size)
+    ]
+
+
+def _axis_swapped(crs: CRSTYPE) -> bool:
+    """Check if WMS 1.3.0 expects the bbox of a CRS in (lat, lon) order."""
+    axis = pyproj.CRS(crs).axis_info
+    return len(axis) > 0 and axis[0].direction.lower() == "north"
+
+
+def read_tile(content: bytes | None, window: Window) -> tuple[NDArray[Any], float]:
+    """Read a GeoTiff response of a tile and check its shape.
+
+    Parameters
+    ----------
+    content : bytes
+        The GetMap response of the tile.
+    window : rasterio.windows.Window
+        The window of the tile in the output grid.
+
+    Returns
+    -------
+    tuple
+        The data of the tile and its nodata value.
+
+    Raises
+    ------
+    InvalidTileError
+        If the response is empty or its shape doesn't match the window.
+    """
+    if not content:
+        raise InvalidTileError((window.height, window.width))
+    with MemoryFile(content) as memfile, memfile.open() as src:
+        data = src.read(1)
+        if src.nodata is not None:
+            nodata = src.nodata
+        elif np.issubdtype(data.dtype, np.integer):
+            nodata = np.iinfo(data.dtype).max
+        else:
+            nodata = np.nan
+    if data.shape != (window.height, window.width):
+        raise InvalidTileError((window.height, window.width), data.shape)
+    return data, nodata
+
+
+class Mosaic:
+    """Pre-allocated output of the tiles, in memory or as GeoTiff files on disk.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Height and width of the output grid.
+    transform : rasterio.Affine
+        Affine transform of the output grid.
+    crs : str
+        The spatial reference of the output grid.
+    tiff_dir : pathlib.Path, optional
+        Directory of the GeoTiff files of the layers, ``None`` for keeping
+        the layers in memory.
+    """
+
+    def __init__(
+        self,
+        shape: tuple[int, int],
+        transform: rasterio.Affine,
+        crs: str,
+        tiff_dir: Path | None,
+    ) -> None:
+        self.shape = shape
+        self.transform = transform
+        self.crs = crs
+        self.tiff_dir = tiff_dir
+        self.nodata: dict[str, float] = {}
+        self.arrays: dict[str, NDArray[Any]] = {}
+        self.files: dict[str, Path] = {}
+        self._writers: dict[str, DatasetWriter] = {}
+        self._lock = threading.Lock()
+
+    def _create(self, layer: str, dtype: np.dtype[Any], nodata: float) -> None:
+        self.nodata[layer] = nodata
+        if self.tiff_dir is None:
+            self.arrays[layer] = np.full(self.shape, nodata, dtype=dtype)
+            return
+        name = layer.rsplit(":", maxsplit=1)[-1].replace(" ", "_").lower()
+        self.files[layer] = Path(self.tiff_dir, f"{name}.tif")
+        self._writers[layer] = rasterio.open(
+            self.files[layer],
+            "w",
+            driver="GTiff",
+            height=self.shape[0],
+            width=self.shape[1],
+            count=1,
+            dtype=dtype.name,
+            crs=self.crs,
+            transform=self.transform,
+            nodata=nodata,
+            tiled=True,
+            blockxsize=256,
+            blockysize=256,
+            compress="deflate",
+            BIGTIFF="IF_SAFER",
+        )
+
+    def write(self, layer: str, window: Window, data: NDArray[Any], nodata: float) -> None:
+        """Write a tile into the output of its layer."""
+        with self._lock:
+            if layer not in self.nodata:
+                self._create(layer, data.dtype, nodata)
+            if self.tiff_dir is not None:
+                self._writers[layer].write(data, 1, window=window)
+                return
+        self.arrays[layer][window.toslices()] = data
+
+    def close(self) -> None:
+        """Close the GeoTiff files, if any."""
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+    def to_dataset(self) -> xr.Dataset:
+        """Convert the mosaic to a dataset with one variable per layer."""
+        self.close()
+        if self.tiff_dir is not None:
+            das = [
+                rxr.open_rasterio(fpath).squeeze("band", drop=True).rename(layer)
+                for layer, fpath in self.files.items()
+            ]
+            return xr.merge(das, combine_attrs="drop_conflicts")
+
+        height, width = self.shape
+        xs, _ = rasterio.transform.xy(self.transform, np.zeros(width), np.arange(width))
+        _, ys = rasterio.transform.xy(self.transform, np.arange(height), np.zeros(height))
+        das = [
+            xr.DataArray(arr, coords={"y": ys, "x": xs}, dims=("y", "x"), name=layer)
+            .rio.write_transform(self.transform)
+            .rio.write_crs(self.crs)
+            .rio.write_nodata(self.nodata[layer])
+            for layer, arr in self.arrays.items()
+        ]
+        return xr.merge(das, combine_attrs="drop_conflicts")
+
+
+def plan_tiles(
+    layers: list[str],
+    bbox: tuple[float, float, float, float],
+    resolution: float,
+    crs: CRSTYPE,
+    tile_size: int = TILE_SIZE,
+) -> tuple[str, tuple[int, int], rasterio.Affine, list[tuple[Tile, dict[str, str]]]]:
+    """Get the output grid of a bbox and the GetMap request parameters of its tiles.
+
+    Parameters
+    ----------
+    layers : list of str
+        The WMS layer names.
+    bbox : tuple
+        A bounding box (west, south, east, north) in ``crs``.
+    resolution : float
+        The target resolution in meters.
+    crs : str, int, or pyproj.CRS
+        The spatial reference of the bbox and the output.
+    tile_size : int, optional
+        Width and height of the tiles in pixels, defaults to 2048.
+
+    Returns
+    -------
+    tuple
+        The validated CRS, the shape and transform of the output grid, and
+        a list of tiles with their WMS 1.3.0 GetMap request parameters.
+    """
+    crs_str = ogc_utils.validate_crs(crs)
+    height, width = grid_shape(bbox, resolution, crs_str)
+    transform = rasterio.transform.from_bounds(*bbox, width, height)
+    swapped = _axis_swapped(crs_str)
+
+    def _payload(tile: Tile) -> dict[str, str]:
+        west, south, east, north = tile.bbox
+        box = (south, west, north, east) if swapped else (west, south, east, north)
+        return {
+            "version": "1.3.0",
+            "format": "image/tiff",
+            "request": "GetMap",
+            "crs": crs_str,
+            "bbox": ",".join(str(c) for c in box),
+            "width": str(int(tile.window.width)),
+            "height": str(int(tile.window.height)),
+            "layers": tile.layer,
+        }
+
+    tiles = [
+        Tile(lyr, win, rasterio.windows.bounds(win, transform))
+        for lyr in layers
+        for win in tile_windows(height, width, tile_size)
+    ]
+    return crs_str, (height, width), transform, [(t, _payload(t)) for t in tiles]
+
+
+def _fetch_tile(
+    url: str, payload: dict[str, str], tile: Tile, max_retries: int
+) -> tuple[NDArray[Any], float]:
+    """Download a tile and retry with exponential backoff if it fails."""
+    for attempt in range(max_retries + 1):
+        try:
+            # Bypass the cache on retries, so a cached invalid response is not reused
+            content = ar.retrieve_binary([url], [{"params": payload}], disable=attempt > 0)[0]
+            return read_tile(content, tile.window)
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(0.5 * 2**attempt)
+    raise RuntimeError("Unreachable")  # pragma: no cover
+
+
+def get_tiled(
+    url: str,
+    layers: list[str],
+    bbox: tuple[float, float, float, float],
+    resolution: float,
+    crs: CRSTYPE,
+    *,
+    tile_size: int = TILE_SIZE,
+    max_workers: int = 4,
+    tiff_dir: str | Path | None = None,
+    max_retries: int = MAX_RETRIES,
+) -> xr.Dataset:
+    """Get WMS layers within a bbox by downloading a grid of tiles concurrently.
+
+    All tiles share a single output grid, so they are placed into a
+    pre-allocated array, or written into a GeoTiff file per layer, as soon
+    as they arrive without any resampling or merging. Failed tiles are
+    retried individually.
+
+    Parameters
+    ----------
+    url : str
+        The WMS service URL.
+    layers : list of str
+        The WMS layer names.
+    bbox : tuple
+        A bounding box (west, south, east, north) in ``crs``.
+    resolution : float
+        The target resolution in meters.
+    crs : str, int, or pyproj.CRS
+        The spatial reference of the bbox and the output.
+    tile_size : int, optional
+        Width and height of the tiles in pixels, defaults to 2048.
+    max_workers : int, optional
+        Maximum number of concurrent tile downloads, defaults to 4.
+    tiff_dir : str or pathlib.Path, optional
+        If given, the layers are written to GeoTiff files in this directory,
+        one file per layer, and the returned dataset is read from them lazily.
+        Defaults to ``None``, i.e., the layers are kept in memory.
+    max_retries : int, optional
+        Maximum number of retries for each failed tile, defaults to 3.
+
+    Returns
+    -------
+    xarray.Dataset
+        The requested layers with the original layer names as variables.
+    """
+    crs_str, (height, width), transform, requests = plan_tiles(
+        layers, bbox, resolution, crs, tile_size
+    )
+    if tiff_dir is not None:
+        tiff_dir = Path(tiff_dir)
+        tiff_dir.mkdir(parents=True, exist_ok=True)
+    mosaic = Mosaic((height, width), transform, crs_str, tiff_dir)
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_fetch_tile, url, p, t, max_retries): t for t, p in requests}
+            for future in as_completed(futures):
+                tile = futures[future]
+                try:
+                    data, nodata = future.result()
+                except Exception as ex:
+                    failed.append((tile, ex))
+                    continue
+                mosaic.write(tile.layer, tile.window, data, nodata)
+    finally:
+        mosaic.close()
+
+    if failed:
+        tiles, errors = zip(*failed)
+        raise TileDownloadError(url, [(t.layer, t.bbox) for t in tiles], list(errors)) from errors[
+            0
+        ]
+    return mosaic.to_dataset()
@@ -0,0 +1,72 @@
+"""Fixtures for the tests."""
+
+from __future__ import annotations
+
+import numpy as np
+import pyproj
+import pytest
+import rasterio
+import rioxarray  # noqa: F401
+import xarray as xr
+
+import py3dep
+
+
+@pytest.fixture
+def synthetic_dem(tmp_path):
+    """Return a function that writes a DEM array to a GeoTIFF and returns its path.
+
+    The DEM is in EPSG:4326 with 0.001-degree cells starting at ``(-70, 45)``
+    and its nodata is -9999.
+    """
+
+    def write(data: np.ndarray, name: str = "dem.tif"):
+        fpath = tmp_path / name
+        with rasterio.open(
+            fpath,
+            "w",
+            driver="GTiff",
+            width=data.shape[1],
+            height=data.shape[0],
+            count=1,
+            dtype=data.dtype,
+            transform=rasterio.transform.from_origin(-70, 45, 0.001, 0.001),
+            crs=4326,
+            nodata=-9999,
+        ) as dst:
+            dst.write(data, 1)
+        return fpath
+
+    return write
+
+
+@pytest.fixture
+def fake_get_dem(monkeypatch):
+    """Return a function that replaces ``_get_dem`` with a synthetic DEM and returns its calls.
+
+    The DEM is ``surface(x, y)`` on a grid with ``step`` spacing in ``crs`` that
+    covers the requested geometry. The calls are recorded as tuples of
+    ``(geometry, resolution, crs)``.
+    """
+
+    def patch(surface, crs=4326, step=0.01):
+        calls = []
+
+        def get_dem(geometry, resolution, geo_crs):
+            calls.append((geometry, resolution, geo_crs))
+            to_crs = pyproj.Transformer.from_crs(geo_crs, crs, always_xy=True)
+            xmin, ymin, xmax, ymax = to_crs.transform_bounds(*geometry)
+            x = np.arange(xmin, xmax, step)
+            y = np.arange(ymax, ymin, -step)
+            dem = xr.DataArray(
+                surface(x[None, :], y[:, None]).astype("f4"),
+                coords={"y": y, "x": x},
+                dims=("y", "x"),
+                attrs={"units": "m", "vertical_datum": "NAVD88"},
+            )
+            return dem.rio.write_crs(crs).rio.write_nodata(np.nan).rename("elevation")
+
+        monkeypatch.setattr(py3dep.py3dep, "_get_dem", get_dem)
+        return calls
+
+    return patch
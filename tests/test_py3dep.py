@@ -1,21 +1,40 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
 import io
+import json
 import shutil
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import SimpleNamespace
 
 import geopandas as gpd
 import numpy as np
 import pandas as pd
 import pyproj
 import pytest
+import rasterio
 import rioxarray as rxr
 import xarray as xr
-from shapely import MultiLineString, Polygon, ops
+from aiohttp import web
+from rasterio.io import MemoryFile
+from shapely import LineString, MultiLineString, Polygon, ops
 
 import py3dep
+from async_retriever.exceptions import ServiceError
+from py3dep import aio, index, seamless, tnm, wms
 from py3dep.cli import cli
+from py3dep.exceptions import (
+    DependencyError,
+    InputRangeError,
+    InputValueError,
+    InvalidTileError,
+    TileDownloadError,
+)
 from pygeoogc import utils
 
 DEF_CRS = 4326
@@ -95,6 +114,715 @@ def test_bycoords(source, expected):
     assert_close(sum(set(dem)), expected)
 
 
+def test_sample_points():
+    rng = np.random.default_rng(42)
+    data = rng.random((300, 400), dtype="f4")
+    transform = rasterio.transform.from_origin(-70, 45, 0.01, 0.01)
+    x = rng.uniform(-70.5, -65.5, 1000)
+    y = rng.uniform(41.5, 45.5, 1000)
+    with contextlib.ExitStack() as stack:
+        mem = stack.enter_context(MemoryFile())
+        src = stack.enter_context(
+            mem.open(
+                driver="GTiff",
+                width=400,
+                height=300,
+                count=1,
+                dtype="f4",
+                transform=transform,
+                nodata=-9999,
+            )
+        )
+        src.write(data, 1)
+        expected = np.array(list(src.sample(zip(x, y)))).ravel()
+        elev = seamless.sample_points(src, x, y, window_size=64)
+    assert elev.dtype == expected.dtype
+    assert np.array_equal(elev, expected)
+
+
+def test_profile_engine(monkeypatch, synthetic_dem):
+    transform = rasterio.transform.from_origin(-70, 45, 0.001, 0.001)
+    rows, cols = np.mgrid[:1000, :1200]
+    xs, ys = rasterio.transform.xy(transform, rows, cols)
+    fpath = synthetic_dem((np.asarray(xs) * 100 + np.asarray(ys) * 50).reshape(rows.shape))
+    lines = [
+        LineString([(-69.9, 44.1), (-69.5, 44.5), (-69.0, 44.6)]),
+        LineString([(-69.8, 44.2), (-69.7, 44.3)]),
+    ]
+    with rasterio.open(fpath) as src:
+        monkeypatch.setattr(seamless, "open_vrt", lambda _: src)
+        single = py3dep.elevation_profile(lines[0], 100, method="bilinear")
+        stacked = py3dep.elevation_profile(lines, 100, method="bilinear")
+        nearest = py3dep.elevation_profile(lines, 100)
+        gdf = gpd.GeoDataFrame(geometry=lines, index=["a", "b"], crs=DEF_CRS).to_crs(ALT_CRS)
+        batch = py3dep.elevation_profile_batch(gdf, 100, method="bilinear")
+        ds = py3dep.elevation_profile_batch(gdf.geometry, 100, as_dataframe=False)
+    assert single.dims == ("z",)
+    assert stacked.dims == ("line", "z")
+    assert_close(single.values, stacked.isel(line=0).values, 1e-9)
+    assert_close(single.values, single.x * 100 + single.y * 50, 1e-9)
+    assert np.all(np.diff(single.distance) > 0)
+    assert_close(single.distance[-1].item(), 100 * (single.size - 1), 0.05)
+    assert stacked.isel(line=1).count() < stacked.isel(line=0).count()
+    assert np.abs(nearest - stacked).max() < 0.1
+    assert batch.index.names == ["line", "station"]
+    assert_close(batch.loc["a", "elevation"].to_numpy(), single.values, 1e-9)
+    assert_close(batch.loc["b", "distance"].to_numpy(), stacked.distance[1].dropna("z"), 1e-6)
+    assert ds.elevation.dims == ("line", "station")
+    assert np.array_equal(ds.elevation.isnull(), nearest.isnull())
+    assert np.abs(ds.elevation.values - nearest.values)[nearest.notnull()].max() < 0.2
+    with pytest.raises(InputValueError):
+        seamless.interp_points(src, [0], [0], method="cubic")
+    with pytest.raises(InputValueError, match="unique line IDs"):
+        py3dep.elevation_profile_batch(gdf.set_axis(["a", "a"]), 100, as_dataframe=False)
+
+
+def test_block_cache(tmp_path, synthetic_dem):
+    rng = np.random.default_rng(42)
+    data = rng.random((1300, 1100), dtype="f4")
+    fpath = synthetic_dem(data)
+    bounds = (-69.7, 44.2, -69.15, 44.9)
+    with rasterio.open(fpath) as src:
+        expected = seamless.clip_box(src, bounds)
+        py3dep.enable_block_cache(tmp_path / "blocks.sqlite", max_size=int(3.5 * 2**20))
+        try:
+            cold = seamless.clip_box(src, bounds)
+            warm = seamless.clip_box(src, bounds)
+            cache = seamless._BLOCK_CACHE["blocks"]
+            assert len(cache) == 3
+            assert cache.size <= cache.max_size
+        finally:
+            py3dep.disable_block_cache()
+    assert expected.equals(cold)
+    assert expected.equals(warm)
+
+
+def test_lazy_clip(synthetic_dem):
+    pytest.importorskip("dask")
+    rng = np.random.default_rng(42)
+    data = rng.random((300, 400), dtype="f4")
+    data[:50, :50] = -9999
+    fpath = synthetic_dem(data)
+    geom = Polygon([(-69.99, 44.99), (-69.65, 44.75), (-69.9, 44.71)])
+    with rasterio.open(fpath) as src:
+        eager = seamless.clip_box(src, geom.bounds).rio.clip([geom], drop=False)
+        eager = eager.where(eager > -9999)
+        lazy = seamless.clip_box(src, geom.bounds, chunks={"y": 64, "x": 48})
+        lazy = seamless.mask_chunks(lazy, geom)
+    assert lazy.chunks is not None
+    assert max(lazy.chunks[0]) == 64
+    assert max(lazy.chunks[1]) == 48
+    assert np.array_equal(lazy.values, eager.values, equal_nan=True)
+    seamless.close_datasets()
+
+
+def test_write_dem(monkeypatch, tmp_path, synthetic_dem):
+    rng = np.random.default_rng(42)
+    data = rng.random((1300, 1100), dtype="f4")
+    data[:100, :100] = -9999
+    fpath = synthetic_dem(data)
+    geom = Polygon([(-69.99, 44.99), (-69.1, 44.75), (-69.9, 43.8)])
+    with rasterio.open(fpath) as src:
+        monkeypatch.setattr(seamless, "open_vrt", lambda _: src)
+        expected = py3dep.static_3dep_dem(geom.bounds, DEF_CRS)
+        out = py3dep.get_dem(geom.bounds, 10, out=tmp_path / "out" / "dem.tif")
+        clipped = py3dep.static_3dep_dem(geom, DEF_CRS)
+        out_clipped = py3dep.static_3dep_dem(geom, DEF_CRS, out=tmp_path / "clipped.tif")
+        for _ in range(3):
+            seamless.write_dem(src, geom.bounds, geom, tmp_path / "again.tif", max_workers=4)
+        assert not any(str(fpath) in d for d in seamless._POOLS.values())
+        with pytest.raises(py3dep.exceptions.InputTypeError):
+            py3dep.static_3dep_dem(geom, DEF_CRS, chunks=64, out=tmp_path / "chunked.tif")
+        if seamless.has_dask and seamless.has_zarr:
+            store = py3dep.static_3dep_dem(geom, DEF_CRS, out=tmp_path / "dem.zarr")
+        else:
+            with pytest.raises(DependencyError):
+                py3dep.static_3dep_dem(geom, DEF_CRS, out=tmp_path / "dem.zarr")
+            store = None
+    with rasterio.open(out) as cog:
+        assert cog.profile["tiled"]
+        assert cog.overviews(1)
+        assert cog.tags()["vertical_datum"] == "NAVD88"
+        assert cog.transform == expected.rio.transform()
+        assert np.array_equal(cog.read(1), expected.values, equal_nan=True)
+    with rasterio.open(out_clipped) as cog:
+        assert_close(np.isfinite(cog.read(1)).sum(), clipped.notnull().sum().item(), 1e-4)
+        if store is not None:
+            # the store, as the COG, covers the bbox of the geometry
+            ds = xr.open_zarr(store)
+            assert ds.elevation.attrs["vertical_datum"] == "NAVD88"
+            assert np.array_equal(ds.elevation.values, cog.read(1), equal_nan=True)
+    assert not list(out.parent.glob("*.part"))
+    assert not list(tmp_path.glob("*.part"))
+    with pytest.raises(InputRangeError):
+        py3dep.get_dem(geom, 5, out=tmp_path / "dem.tif")
+    seamless.close_datasets()
+
+
+def test_decimated_dem(monkeypatch, tmp_path, synthetic_dem):
+    pytest.importorskip("dask")
+    rng = np.random.default_rng(42)
+    data = rng.random((1000, 1200), dtype="f4")
+    fpath = synthetic_dem(data)
+    bounds = (-70.0, 44.0, -68.8, 45.0)
+    assert seamless.source_resolution(250) == 60
+    assert seamless.source_resolution(25) == 10
+    with pytest.raises(InputRangeError):
+        seamless.source_resolution(5)
+    with rasterio.open(fpath) as src:
+        monkeypatch.setattr(seamless, "open_vrt", lambda _: src)
+        dem = py3dep.get_dem(bounds, 25)
+        lazy = py3dep.static_3dep_dem(bounds, DEF_CRS, 25, chunks=128).compute()
+        out = py3dep.static_3dep_dem(bounds, DEF_CRS, 25, out=tmp_path / "dem_25.tif")
+        expected = src.read(1, out_shape=(400, 480), resampling=rasterio.enums.Resampling.average)
+    assert dem.shape == (400, 480)
+    assert_close(float(dem.x[1] - dem.x[0]), 0.0025)
+    assert np.allclose(dem.values, expected)
+    assert np.allclose(lazy.values, expected)
+    with rasterio.open(out) as cog:
+        assert cog.transform == dem.rio.transform()
+        assert np.allclose(cog.read(1), expected)
+    seamless.close_datasets()
+
+
+def test_dataset_pool(tmp_path):
+    fpath = tmp_path / "dem.tif"
+    with rasterio.open(
+        fpath, "w", driver="GTiff", width=10, height=10, count=1, dtype="float32", crs=DEF_CRS
+    ) as dst:
+        dst.write(np.ones((10, 10), dtype="f4"), 1)
+    src = seamless.open_dataset(fpath)
+    assert seamless.open_dataset(fpath) is src
+    with ThreadPoolExecutor(1) as executor:
+        worker = executor.submit(seamless.open_dataset, fpath).result()
+        assert worker is not src
+    assert worker.closed
+    assert sum(str(fpath) in d for d in seamless._POOLS.values()) == 1
+    seamless.invalidate_dataset(fpath)
+    assert src.closed
+    assert not any(str(fpath) in d for d in seamless._POOLS.values())
+    src = seamless.open_dataset(fpath)
+    seamless.close_datasets()
+    assert src.closed
+    assert not seamless.open_dataset(fpath).closed
+    seamless.close_datasets()
+
+
+def _wms_tile(params: dict[str, str]) -> bytes:
+    """Mock a WMS GetMap response whose values are a function of the pixel centers."""
+    width, height = int(params["width"]), int(params["height"])
+    transform = rasterio.transform.from_bounds(
+        *(float(c) for c in params["bbox"].split(",")), width, height
+    )
+    cols, rows = np.meshgrid(np.arange(width), np.arange(height))
+    xs, ys = rasterio.transform.xy(transform, rows, cols)
+    data = (np.asarray(xs) * 1e-3 + np.asarray(ys) * 1e-4).reshape(height, width).astype("f4")
+    with MemoryFile() as mem:
+        with mem.open(
+            driver="GTiff",
+            width=width,
+            height=height,
+            count=1,
+            dtype="float32",
+            transform=transform,
+            crs=params["crs"],
+            nodata=-9999,
+        ) as dst:
+            dst.write(data, 1)
+        return mem.read()
+
+
+@pytest.mark.parametrize("to_disk", [False, True])
+def test_tiled_getmap(monkeypatch, tmp_path, to_disk):
+    bbox = (-7766000.0, 5691000.0, -7744000.0, 5706000.0)
+    calls = {}
+    flaky = None
+
+    def retrieve_binary(urls, kwds, **_):
+        nonlocal flaky
+        params = kwds[0]["params"]
+        flaky = flaky or params["bbox"]
+        calls[params["bbox"]] = calls.get(params["bbox"], 0) + 1
+        if params["bbox"] == flaky and calls[flaky] < 3:
+            return [b"<ServiceException/>"]
+        return [_wms_tile(params)]
+
+    monkeypatch.setattr(wms.ar, "retrieve_binary", retrieve_binary)
+    monkeypatch.setattr(wms.time, "sleep", lambda _: None)
+    ds = wms.get_tiled(
+        "https://wms",
+        ["3DEPElevation:None"],
+        bbox,
+        1000,
+        ALT_CRS,
+        tile_size=8,
+        tiff_dir=tmp_path if to_disk else None,
+    )
+    dem = ds["3DEPElevation:None"]
+    shape = wms.grid_shape(bbox, 1000, ALT_CRS)
+    assert dem.shape == shape
+    assert len(calls) == len(wms.tile_windows(*shape, 8))
+    assert sorted(calls.values())[-1] == 3
+    xx, yy = np.meshgrid(dem.x, dem.y)
+    assert_close(dem.values, (xx * 1e-3 + yy * 1e-4).astype("f4"), 1e-6)
+    assert dem.rio.crs.to_epsg() == ALT_CRS
+
+    monkeypatch.setattr(wms.ar, "retrieve_binary", lambda *_, **__: [None])
+    with pytest.raises(TileDownloadError) as ex:
+        wms.get_tiled("https://wms", ["3DEPElevation:None"], bbox, 1000, ALT_CRS, tile_size=8)
+    assert len(ex.value.tiles) == len(calls)
+    assert len(ex.value.errors) == len(calls)
+    assert isinstance(ex.value.__cause__, InvalidTileError)
+    assert "the response is empty" in str(ex.value)
+
+
+def _getmap_bybox(self, bbox, resolution, box_crs, max_px, *, fail_east=-69.5):
+    """Mock ``WMS.getmap_bybox`` that fails for geometries east of ``fail_east``."""
+    if utils.match_crs(bbox, box_crs, DEF_CRS)[0] > fail_east:
+        raise ConnectionRefusedError
+    height, width = wms.grid_shape(bbox, resolution, box_crs)
+    params = {
+        "width": width,
+        "height": height,
+        "crs": box_crs,
+        "bbox": ",".join(str(c) for c in bbox),
+    }
+    return {f"{lyr}_dd_0_0": _wms_tile(params) for lyr in self.layers}
+
+
+def test_getmap_batch(monkeypatch, tmp_path):
+    monkeypatch.setenv("PY3DEP_WMS_OFFLINE", "true")
+    monkeypatch.setattr(py3dep.py3dep.WMS, "getmap_bybox", _getmap_bybox)
+    gdf = gpd.GeoDataFrame(
+        geometry=[GEOM, ops.transform(lambda x, y: (x + 0.3, y), GEOM), GEOM.buffer(-0.1)],
+        index=["a", "b", "c"],
+        crs=DEF_CRS,
+    )
+    results = dict(
+        py3dep.get_map_batch("DEM", gdf, 5000, crs=ALT_CRS, max_workers=2, return_exceptions=True)
+    )
+    assert sorted(results) == ["a", "b", "c"]
+    assert isinstance(results["b"], ConnectionRefusedError)
+    assert results["a"].name == "elevation"
+    assert results["c"].notnull().sum() < results["a"].notnull().sum()
+
+    saved = py3dep.get_map_batch("DEM", gdf.loc[["a", "c"]], [5000, 10000], save_dir=tmp_path)
+    assert sorted(p.name for _, p in saved) == ["a.nc", "c.nc"]
+    with pytest.raises(ConnectionRefusedError):
+        list(py3dep.get_map_batch("DEM", gdf, 5000))
+
+    active = calls = 0
+
+    def getmap_bybox(*args, **kwargs):
+        nonlocal active, calls
+        active += 1
+        calls += 1
+        try:
+            # Only the first geometry is fast, so the others are running when the batch closes
+            time.sleep(0 if calls == 1 else 0.5)
+            return _getmap_bybox(*args, **kwargs, fail_east=0)
+        finally:
+            active -= 1
+
+    monkeypatch.setattr(py3dep.py3dep.WMS, "getmap_bybox", getmap_bybox)
+    batch = py3dep.get_map_batch("DEM", gdf, 5000, max_workers=3)
+    next(batch)
+    batch.close()
+    assert active == 0
+
+
+def test_getmap_local_terrain(monkeypatch):
+    monkeypatch.setenv("PY3DEP_WMS_OFFLINE", "true")
+    requested = []
+
+    def getmap_bybox(self, *args, **kwargs):
+        requested.append(list(self.layers))
+        return _getmap_bybox(self, *args, **kwargs, fail_east=0)
+
+    monkeypatch.setattr(py3dep.py3dep.WMS, "getmap_bybox", getmap_bybox)
+    layers = ["Slope Degrees", "Aspect Degrees", "Hillshade Multidirectional"]
+    ds = py3dep.get_map(layers, GEOM, 1000, crs=ALT_CRS, local_terrain=True)
+    assert requested == [["3DEPElevation:None"]]
+    assert list(ds) == ["slope_degrees", "aspect_degrees", "hillshade_multidirectional"]
+    expected = np.degrees(np.arctan(np.hypot(1e-3, 1e-4)))
+    assert_close(ds.slope_degrees.mean().item(), expected, 1e-3)
+    assert_close(ds.aspect_degrees.mean().item(), np.degrees(np.arctan2(-1e-3, -1e-4)) + 360, 1e-3)
+    slope = py3dep.get_map("Slope Degrees", GEOM.bounds, 1000, crs=ALT_CRS, local_terrain=True)
+    assert slope.name == "slope_degrees"
+    assert slope.isnull().sum() == 2 * (sum(slope.shape) - 2)
+
+    dem = slope.copy(data=np.add.outer(np.arange(slope.shape[0]), np.arange(slope.shape[1])) ** 2.0)
+    lazy = py3dep.terrain.tpi(dem.chunk(4))
+    assert lazy.chunks is not None
+    xr.testing.assert_allclose(lazy.compute(), py3dep.terrain.tpi(dem))
+    assert_close(lazy.mean().compute().item(), -1.5)
+
+
+def test_wms_capabilities(monkeypatch, tmp_path):
+    xml = "".join(
+        (
+            '<WMS_Capabilities xmlns="http://www.opengis.net/wms"><Capability><Layer>',
+            "<Title>3DEPElevation</Title><CRS>EPSG:3857</CRS><CRS>CRS:84</CRS>",
+            "<Layer><Name>3DEPElevation:None</Name><Title>DEM</Title></Layer>",
+            "</Layer></Capability></WMS_Capabilities>",
+        )
+    )
+    calls = []
+
+    def retrieve_text(urls, kwds, **_):
+        calls.append(urls[0])
+        return [xml]
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(wms.ar, "retrieve_text", retrieve_text)
+    wms.clear_capabilities()
+    caps = wms.get_capabilities("https://wms")
+    assert caps == wms.Capabilities(["epsg:3857", "crs:84"], {"3DEPElevation:None": "DEM"})
+    assert wms.get_capabilities("https://wms") == caps
+    wms._CAPABILITIES.clear()
+    assert wms.get_capabilities("https://wms") == caps
+    assert len(calls) == 1
+    monkeypatch.setenv("HYRIVER_CACHE_EXPIRE", "-1")
+    wms._CAPABILITIES.clear()
+    assert wms.get_capabilities("https://wms") == caps
+    assert len(calls) == 1
+
+    async def poll():
+        # the event loop keeps running while a sync caller holds the cache lock
+        task = asyncio.ensure_future(aio.get_capabilities("https://wms"))
+        ticks = 0
+        while not task.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        return await task, ticks
+
+    wms._CAPABILITIES_LOCK.acquire()
+    threading.Timer(0.2, wms._CAPABILITIES_LOCK.release).start()
+    got, ticks = asyncio.run(poll())
+    assert got == caps
+    assert ticks >= 5
+
+    monkeypatch.setenv("HYRIVER_CACHE_EXPIRE", "0")
+    monkeypatch.setattr(wms.ar, "retrieve_text", lambda *_, **__: ["<Invalid"])
+    assert wms.get_capabilities("https://wms") == caps
+
+    monkeypatch.setenv("PY3DEP_WMS_OFFLINE", "true")
+    assert wms.get_capabilities("https://wms") == caps
+    wms.clear_capabilities()
+    assert "epsg:4326" in wms.get_capabilities("https://wms").crs
+    assert len(wms.get_capabilities("https://wms").layers) == len(py3dep.py3dep.LAYERS)
+
+
+def test_aio(monkeypatch):
+    monkeypatch.setenv("PY3DEP_WMS_OFFLINE", "true")
+    active = peak = 0
+
+    async def getmap(request):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return web.Response(body=_wms_tile(dict(request.query)))
+
+    pqs_calls = []
+
+    async def pqs(request):
+        y = request.query["y"]
+        pqs_calls.append(y)
+        if y == "45.200000" and pqs_calls.count(y) == 1:
+            raise web.HTTPInternalServerError
+        if y == "45.300000":
+            return web.json_response({})
+        return web.json_response({"value": float(y)})
+
+    async def index(request):
+        lyr = int(request.match_info["lyr"])
+        if lyr == 30:
+            raise web.HTTPInternalServerError
+        return web.json_response({"count": int(lyr < 21)})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/wms", getmap)
+        app.router.add_get("/pqs", pqs)
+        app.router.add_get("/index/{lyr}/query", index)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        urls = SimpleNamespace(
+            wms=SimpleNamespace(nm_3dep=f"{url}/wms"),
+            restful=SimpleNamespace(nm_pqs=f"{url}/pqs", nm_3dep_index=f"{url}/index"),
+        )
+        monkeypatch.setattr(aio, "ServiceURL", lambda: urls)
+        try:
+            async with aio.AsyncClient(max_concurrency=3) as client:
+                return await asyncio.gather(
+                    aio.get_map("DEM", GEOM, 5000, crs=ALT_CRS, tile_size=4, client=client),
+                    aio.elevation_bycoords(
+                        [(-69.5, 45.1), (-69.4, 45.2), (-69.5, 45.1), (-69.3, 45.3)],
+                        source="tnm",
+                        max_retries=1,
+                    ),
+                    aio.check_3dep_availability(GEOM.bounds, client=client),
+                )
+        finally:
+            await runner.cleanup()
+
+    monkeypatch.setattr(tnm, "sample_static_dem", lambda keys: np.full(len(keys), -1.0))
+    dem, elev, avail = asyncio.run(main())
+    assert dem.name == "elevation"
+    assert dem.rio.crs.to_epsg() == ALT_CRS
+    assert dem.notnull().sum() > 0
+    assert 1 < peak <= 3
+    assert_close(elev, [45.1, 45.2, 45.1, -1])
+    assert sorted(pqs_calls) == ["45.100000", "45.200000", "45.200000", "45.300000", "45.300000"]
+    assert avail == {
+        "1m": True,
+        "3m": True,
+        "5m": True,
+        "10m": False,
+        "30m": False,
+        "60m": False,
+        "topobathy": "Failed",
+    }
+
+
+def test_index_client(monkeypatch):
+    features = {18: [1, 2, 3], 21: [1, 4], 30: []}
+    calls = []
+
+    def retrieve_json(urls, kwds, request_method="GET", **_):
+        calls.append((request_method, len(urls)))
+        resps = []
+        for url, kwd in zip(urls, kwds):
+            lyr = int(url.split("/")[-2])
+            if "data" in kwd:
+                oids = [int(i) for i in kwd["data"]["objectIds"].split(",")]
+                resps.append(
+                    {
+                        "objectIdFieldName": "OBJECTID",
+                        "features": [
+                            {
+                                "attributes": {"OBJECTID": i},
+                                "geometry": {"rings": [[[i, 0], [i + 1, 0], [i, 1], [i, 0]]]},
+                            }
+                            for i in oids
+                        ],
+                    }
+                )
+                continue
+            xmin = json.loads(kwd["params"]["geometry"])["xmin"]
+            oids = [i for i in features[lyr] if xmin < 0 or (xmin < 100 and i % 2)]
+            if "returnCountOnly" in kwd["params"]:
+                resps.append(None if lyr == 30 else {"count": len(oids)})
+            else:
+                resps.append({"objectIds": oids})
+        return resps
+
+    deleted = []
+    monkeypatch.setattr(index.ar, "retrieve_json", retrieve_json)
+    monkeypatch.setattr(index.ar, "delete_url_cache", lambda url, **_: deleted.append(url))
+    client = index.IndexClient(["1m", "10m", "topobathy"], max_records=2)
+    bboxes = [(-69.8, 45.0, -69.3, 45.5), (1.0, 45.0, 1.5, 45.5)]
+    avail = client.availability(bboxes)
+    assert avail[0] == {"1m": True, "10m": True, "topobathy": "Failed"}
+    assert len(deleted) == 2
+    assert calls == [("GET", 6)]
+
+    calls.clear()
+    sources = client.sources(bboxes)
+    assert calls == [("GET", 6), ("POST", 3)]
+    assert sources[0].groupby("dem_res")["OBJECTID"].apply(list).to_dict() == {
+        "10m": [1, 4],
+        "1m": [1, 2, 3],
+    }
+    assert sources[1]["OBJECTID"].tolist() == [1, 3, 1]
+    # a bbox without any features in a batch with other bboxes
+    sources = client.sources([*bboxes, (150.0, 45.0, 150.5, 45.5)])
+    assert sources[1]["OBJECTID"].tolist() == [1, 3, 1]
+    assert sources[2].empty
+    assert sources[2].columns.tolist() == ["dem_res", "geometry"]
+    assert sources[2].crs.to_epsg() == 4326
+    with pytest.raises(InputValueError):
+        index.IndexClient("2m")
+    with pytest.raises(py3dep.exceptions.InputTypeError):
+        py3dep.query_3dep_sources((0, 0, 1))
+
+
+def test_tnm_scheduler(monkeypatch):
+    calls = []
+
+    def retrieve_json(urls, kwds, max_workers, **_):
+        calls.append((len(urls), max_workers))
+        return [
+            None if k["params"]["x"] == "-69.000000" else {"value": k["params"]["y"]} for k in kwds
+        ]
+
+    monkeypatch.setattr(tnm.ar, "retrieve_json", retrieve_json)
+    monkeypatch.setattr(tnm.ar, "delete_url_cache", lambda *_, **__: None)
+    monkeypatch.setattr(tnm.time, "sleep", lambda _: None)
+    monkeypatch.setattr(tnm.PointQuery, "_fallback", lambda _, keys: np.full(len(keys), -1.0))
+    coords = [(-69.5, 45 + i * SMALL) for i in range(50)] * 2 + [(-69.0, 45.0)]
+    query = tnm.PointQuery("https://pqs")
+    elev = query.query(coords)
+    assert_close(elev[:-1], [y for _, y in coords[:-1]])
+    assert elev[-1] == -1
+    assert query.stats[:5] == (101, 51, 54, 3, 1)
+    assert sum(n for n, _ in calls) == 54
+    assert calls[1][1] > calls[0][1]
+
+    def failing(urls, *_, **__):
+        raise ServiceError("down", urls[0])
+
+    monkeypatch.setattr(tnm.ar, "retrieve_json", failing)
+    assert tnm.PointQuery("https://pqs", max_retries=1).query(coords[:1])[0] == -1
+    monkeypatch.setattr(tnm.ar, "retrieve_json", lambda *_, **__: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        tnm.PointQuery("https://pqs").query(coords[:1])
+
+    ctl = tnm.AdaptiveConcurrency(8)
+    ctl.update(10, 5, 1.0)
+    assert (ctl.workers, ctl.backoff) == (4, 0.5)
+    ctl.update(10, 0, 1.0)
+    assert (ctl.workers, ctl.backoff) == (5, 0)
+    ctl.update(10, 0, 10.0)
+    assert ctl.workers == 4
+
+
+def test_tnm_fallback(monkeypatch, synthetic_dem):
+    data = np.full((100, 100), 50, dtype="f4")
+    data[:10, :10] = -9999
+    with rasterio.open(synthetic_dem(data)) as src:
+        monkeypatch.setattr(tnm.seamless, "open_vrt", lambda _: src)
+        monkeypatch.setattr(tnm.ar, "retrieve_json", lambda urls, *_, **__: [None] * len(urls))
+        monkeypatch.setattr(tnm.ar, "delete_url_cache", lambda *_, **__: None)
+        monkeypatch.setattr(tnm.time, "sleep", lambda _: None)
+        query = tnm.PointQuery("https://pqs", max_retries=0)
+        elev = query.query([(-69.95, 44.95), (-69.9995, 44.9995), (-69.5, 44.95)])
+    np.testing.assert_array_equal(elev, [50, np.nan, np.nan])
+    assert query.stats.fallback == 3
+
+
+def test_elevation_memo(monkeypatch, tmp_path):
+    sampled = []
+
+    def tep(self, as_array=False):
+        sampled.append(len(self.coords))
+        return [x + y for x, y in self.coords]
+
+    monkeypatch.setattr(py3dep.py3dep.ElevationByCoords, "tep", tep)
+    coords = [(-69.5, 45.1), (-69.4, 45.2), (-69.5, 45.1), (-69.3, 45.3)]
+    expected = [x + y for x, y in coords]
+    try:
+        memo = py3dep.enable_elevation_memo(maxsize=2, path=tmp_path / "memo.sqlite")
+        assert_close(py3dep.elevation_bycoords(coords), expected)
+        assert_close(py3dep.elevation_bycoords(coords[3]), expected[3])
+        assert sampled == [3]
+        assert memo.stats == (1, 0, 3, 1, 2)
+
+        memo = py3dep.enable_elevation_memo(path=tmp_path / "memo.sqlite")
+        assert_close(py3dep.elevation_bycoords(coords[1:]), expected[1:])
+        assert sampled == [3]
+        assert memo.stats == (0, 3, 0, 0, 3)
+        assert_close(py3dep.elevation_bycoords(coords[1:]), expected[1:])
+        assert memo.stats.hits == 3
+    finally:
+        py3dep.disable_elevation_memo()
+    py3dep.elevation_bycoords(coords)
+    assert sampled == [3, 4]
+
+
+def test_tiled_fill(tmp_path):
+    rng = np.random.default_rng(42)
+    dem = rng.normal(size=(45, 70)).cumsum(0).cumsum(1).astype("f4")
+    dem += rng.normal(scale=3, size=dem.shape).astype("f4")
+    dem[rng.random(dem.shape) < 0.02] = np.nan
+    dem[10:14, 5:20] = np.nan
+    for outlets, connectivity in [("edge", 4), ("min", 8)]:
+        expected = py3dep.fill_depressions(dem, outlets, connectivity=connectivity)
+        filled = py3dep.fill_depressions(dem, outlets, connectivity=connectivity, tile_size=16)
+        np.testing.assert_array_equal(filled, expected)
+    pits = np.array([5 * 70 + 7, 30 * 70 + 40])
+    expected = py3dep.fill_depressions(dem, "edge", pits)
+    np.testing.assert_array_equal(py3dep.fill_depressions(dem, "edge", pits, tile_size=9), expected)
+
+    expected = py3dep.fill_depressions(dem)
+    src = np.lib.format.open_memmap(tmp_path / "dem.npy", "w+", "f4", dem.shape)
+    src[:] = dem
+    out = np.lib.format.open_memmap(tmp_path / "filled.npy", "w+", "f4", dem.shape)
+    py3dep.fill_depressions(src, tile_size=20, max_workers=2, out=out)
+    np.testing.assert_array_equal(out, expected)
+    if seamless.has_dask:
+        lazy = py3dep.fill_depressions(xr.DataArray(dem).chunk((20, 30)))
+        np.testing.assert_array_equal(lazy.compute().values, expected)
+
+
+def test_fill_flats():
+    dem = np.full((5, 6), -2.0, dtype="f4")
+    dem[1:4, 1:5] = [[-3, -4, -1, -5], [-6, -6, -1, -5], [-3, -4, -1, -1.5]]
+    dem[0, 2] = -4.5
+    filled = py3dep.fill_depressions(dem, connectivity=4)
+    expected = dem.copy()
+    expected[2, 1:3] = -4
+    expected[1:3, 4] = -2
+    np.testing.assert_array_equal(filled, expected)
+    np.testing.assert_array_equal(py3dep.fill_depressions(dem, max_depth=1.2), dem)
+
+
+def test_fill_elv_max():
+    rng = np.random.default_rng(42)
+    dem = rng.random((400, 400), dtype="f4")
+    dem[rng.random(dem.shape) < 0.05] = np.nan
+    for connectivity in (4, 8):
+        filled = py3dep.fill_depressions(dem, elv_max=0.5, connectivity=connectivity)
+        expected = py3dep.fill_depressions(
+            dem, elv_max=0.5, connectivity=connectivity, tile_size=128
+        )
+        np.testing.assert_array_equal(filled, expected)
+
+
+def test_flow_routing():
+    dem = np.add.outer(np.arange(5), np.arange(6)).astype("f4")
+    dem[2, 2] = -1
+    routing = py3dep.flow_routing(dem, 3)
+    np.testing.assert_array_equal(routing.filled, py3dep.fill_depressions(dem, "edge"))
+    # the filled pit is on a flat with its north-west neighbor, so it drains there
+    assert routing.filled[2, 2] == 2
+    assert routing.flwdir[2, 2] == 32
+    assert routing.accumulation[2, 2] == 11
+    assert routing.flwdir[0, 0] == 0
+    assert routing.accumulation[0, 0] == dem.size
+    np.testing.assert_array_equal(routing.streams[:3, 0], [2, 1, 1])
+
+    rng = np.random.default_rng(42)
+    dem = rng.random((40, 50), dtype="f4")
+    dem[rng.random(dem.shape) < 0.1] = np.nan
+    dem = xr.DataArray(dem, coords={"y": np.arange(40)[::-1], "x": np.arange(50)}, dims=("y", "x"))
+    routing = py3dep.flow_routing(dem, 10, outlets="min")
+    # all the valid cells drain to a single outlet
+    outlet = routing.flwdir.to_numpy() == 0
+    assert outlet.sum() == 1
+    assert routing.accumulation.to_numpy()[outlet].item() == dem.notnull().sum()
+    assert (routing.flwdir.to_numpy()[dem.isnull().to_numpy()] == 247).all()
+    assert ((routing.streams > 0) == (routing.accumulation >= 10)).all()
+
+    # at 60N a cell is half as wide as it's tall, so the eastward drop is the
+    # steepest, while in degrees the north-eastward one would be
+    dem = xr.DataArray(
+        np.add.outer(1.1 * np.arange(5), -np.arange(5)).astype("f4") + 100,
+        coords={"y": 60 - 0.001 * np.arange(5), "x": -100 + 0.001 * np.arange(5)},
+        dims=("y", "x"),
+    )
+    assert py3dep.flow_routing(dem).flwdir[2, 2] == 128
+    routing = py3dep.flow_routing(dem.rio.write_crs(4326))
+    assert routing.flwdir[2, 2] == 1
+    dx, dy = py3dep.utils.cell_spacing(dem.rio.write_crs(4326))
+    assert_close(dx.values, dy * -0.5 * np.cos(np.deg2rad(dem.y)) / np.cos(np.deg2rad(60)), 1e-6)
+
+
 def test_deg2mpm():
     slope = py3dep.get_map(LYR, GEOM, 1000)
     slope = py3dep.deg2mpm(slope)
@@ -115,6 +843,20 @@ def test_grid():
     assert_close((elev_fill - elev).sum().item(), 9096.3853)
 
 
+def test_grid_interp(fake_get_dem):
+    calls = fake_get_dem(lambda x, y: x * 1e-3 - y * 2e-3, crs=5070, step=500)
+    gx = np.linspace(-69.77, -69.31, 300)
+    gy = np.linspace(45.45, 45.07, 200)
+    elev = py3dep.elevation_bygrid(gx, gy, DEF_CRS, 1000)
+    assert elev.shape == (200, 300)
+    assert elev.rio.crs.to_epsg() == DEF_CRS
+    xx, yy = pyproj.Transformer.from_crs(DEF_CRS, 5070, always_xy=True).transform(
+        *np.meshgrid(gx, gy)
+    )
+    assert_close(elev.values, xx * 1e-3 - yy * 2e-3, 1e-5)
+    assert len(calls) == 1
+
+
 def test_add_elev():
     crs = (
         "+proj=lcc +lat_1=25 +lat_2=60 +lat_0=42.5 +lon_0=-100 +x_0=0 +y_0=0 +ellps=WGS84 +units=m"
@@ -130,6 +872,67 @@ def test_add_elev():
     assert_close(ds["elevation"].mean().item(), 291.3313)
 
 
+def test_add_elevation_memo(fake_get_dem):
+    calls = fake_get_dem(lambda x, y: x * 10 + y * 20)
+    py3dep.memo.clear_grid_memo()
+    to_3857 = pyproj.Transformer.from_crs(DEF_CRS, ALT_CRS, always_xy=True)
+    xmin, ymin, xmax, ymax = to_3857.transform_bounds(*GEOM.bounds)
+    da = xr.DataArray(
+        np.zeros((3, 20, 30)),
+        dims=("time", "y", "x"),
+        coords={
+            "time": pd.date_range("2000-01-01", periods=3),
+            "y": np.linspace(ymax, ymin, 20),
+            "x": np.linspace(xmin, xmax, 30),
+        },
+    ).rio.write_crs(ALT_CRS)
+    ds = py3dep.add_elevation(da)
+    assert len(calls) == 1
+    assert calls[0][2] == 5070
+    lon, lat = to_3857.transform(*np.meshgrid(da.x, da.y), direction="INVERSE")
+    assert_close(ds.elevation.values, lon * 10 + lat * 20, 1e-4)
+    again = py3dep.add_elevation(da.isel(time=[0]), mask=da.isel(time=0) == 0)
+    assert len(calls) == 1
+    assert np.array_equal(again.elevation.values, ds.elevation.values)
+    py3dep.add_elevation(da, resolution=30)
+    assert len(calls) == 2
+    py3dep.memo.clear_grid_memo()
+
+
+def test_product_cache(fake_get_dem, tmp_path):
+    calls = fake_get_dem(lambda x, y: x + y)
+    py3dep.enable_product_cache(tmp_path / "products.sqlite")
+    try:
+        dem = py3dep.get_dem(GEOM.bounds, 30)
+        cached = py3dep.get_dem(GEOM.bounds, 30)
+        assert len(calls) == 1
+        assert np.array_equal(cached.values, dem.values)
+        assert_close(cached.x.values, dem.x.values, 1e-9)
+        assert cached.attrs["vertical_datum"] == "NAVD88"
+        assert np.isnan(cached.rio.nodata)
+        assert cached.rio.crs == dem.rio.crs
+
+        xs, ys = np.linspace(-69.7, -69.4, 12), np.linspace(45.4, 45.1, 9)
+        grid = py3dep.elevation_bygrid(xs, ys, DEF_CRS, 30)
+        assert len(calls) == 2
+        assert py3dep.elevation_bygrid(xs, ys, DEF_CRS, 30).equals(grid)
+        assert len(calls) == 2
+        py3dep.elevation_bygrid(xs, ys, DEF_CRS, 30, depression_filling=True)
+        assert len(calls) == 3
+
+        da = grid.rename("data")
+        py3dep.memo.clear_grid_memo()
+        ds = py3dep.add_elevation(da)
+        py3dep.memo.clear_grid_memo()
+        assert py3dep.add_elevation(da).elevation.equals(ds.elevation)
+        assert len(calls) == 4
+    finally:
+        py3dep.disable_product_cache()
+        py3dep.memo.clear_grid_memo()
+    py3dep.get_dem(GEOM.bounds, 30)
+    assert len(calls) == 5
+
+
 def test_check_3dep_availability():
     avail = py3dep.check_3dep_availability(GEOM.bounds)
     assert avail["1m"]
@@ -166,6 +969,64 @@ class TestCLI:
         assert "Found 1 geometry" in ret.output
         shutil.rmtree("geo_map")
 
+    def test_geometry_resume(self, runner, monkeypatch, tmp_path):
+        monkeypatch.setenv("PY3DEP_WMS_OFFLINE", "true")
+        monkeypatch.setattr(py3dep.py3dep.WMS, "getmap_bybox", _getmap_bybox)
+        geoms = [GEOM, ops.transform(lambda x, y: (x + 0.3, y), GEOM), GEOM.buffer(-0.1)]
+        gdf = gpd.GeoDataFrame({"id": ["a", "b", "c"], "res": 5e3}, geometry=geoms, crs=DEF_CRS)
+        gdf.to_file(tmp_path / "geo.gpkg")
+        args = ["geometry", str(tmp_path / "geo.gpkg"), "-s", str(tmp_path / "out"), "-w", "2"]
+        ret = runner.invoke(cli, args)
+        assert ret.exit_code == 1
+        assert "Failed to get 1 of 3 geometries" in ret.output
+        assert "b: ConnectionRefusedError" in ret.output
+        assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["a.nc", "c.nc"]
+
+        (tmp_path / "out" / "c.nc").write_bytes(b"corrupted")
+        monkeypatch.setattr(
+            py3dep.py3dep.WMS,
+            "getmap_bybox",
+            lambda *args, **kwargs: _getmap_bybox(*args, **kwargs, fail_east=0),
+        )
+        ret = runner.invoke(cli, [*args, "--resume"])
+        assert ret.exit_code == 0
+        assert "Skipping 1 of them" in ret.output
+        assert len(list((tmp_path / "out").glob("*.nc"))) == 3
+
+    @pytest.mark.parametrize("out_format", ["csv", "parquet"])
+    def test_coords_resume(self, runner, monkeypatch, tmp_path, out_format):
+        pytest.importorskip("pyarrow")
+        calls = []
+
+        def elevation_bycoords(coords, crs, source):
+            calls.append(len(coords))
+            if len(calls) == 3:
+                raise ConnectionError
+            return [x + y for x, y in coords]
+
+        monkeypatch.setattr(py3dep.py3dep, "elevation_bycoords", elevation_bycoords)
+        rng = np.random.default_rng(42)
+        df = pd.DataFrame({"lon": rng.uniform(-70, -69, 25), "lat": rng.uniform(44, 45, 25)})
+        # The resumed run skips the saved rows of the input with the same format
+        fin = tmp_path / f"pts.{out_format}"
+        if out_format == "csv":
+            df.to_csv(fin, index=False)
+        else:
+            df.to_parquet(fin)
+        args = ["coords", str(fin), "-s", str(tmp_path), "-c", "10"]
+        args += ["-f", out_format]
+        ret = runner.invoke(cli, args)
+        assert ret.exit_code != 0
+        ret = runner.invoke(cli, [*args, "--resume"])
+        assert ret.exit_code == 0
+        assert "Resuming after 20 points" in ret.output
+        assert calls == [10, 10, 5, 5]
+
+        fpath = tmp_path / f"pts_elevation.{out_format}"
+        elev = pd.read_csv(fpath, index_col=0) if out_format == "csv" else pd.read_parquet(fpath)
+        assert_close(elev["elevation"], (df.lon + df.lat).astype("f4"), 1e-6)
+        assert elev.index.tolist() == list(range(25))
+
     def test_coords(self, runner):
         df = pd.DataFrame(
             [[-69.77, 45.07], [-69.31, 45.07], [-69.31, 45.45]], columns=["lon", "lat"]